@@ -0,0 +1,343 @@
+"""Module implements fast path for very large imports of ip addresses.
+Addresses are normalized and written to temporary files, loaded with LOAD
+DATA LOCAL INFILE into staging tables and merged into address and source
+tables with set-based queries. Connection must be created with local_infile=1
+option in its config section.
+:functions: write_staging_files, load_addresses, refresh_source"""
+import os
+import tempfile
+from datetime import date
+
+import MySQLdb as mdb
+from netaddr import IPAddress
+from netaddr.core import AddrFormatError
+
+import dbapi
+from dbapi_exceptions import SQLSyntaxError
+from logging_conf import create_logger
+from transaction import Transaction
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+
+def _v6_hex(ip):
+    """Return hex form of 16 bytes in which dbapi stores v6 address"""
+    return '%032x' % ip.value
+
+
+def write_staging_files(ip_addresses, date_added=None):
+    """Write valid addresses to tab separated files for LOAD DATA, one file
+    for each ip version. Invalid addresses are skipped.
+
+    :param ip_addresses: Iterable of ip addresses in string form.
+    :type ip_addresses: iterable.
+    :param date_added: Date when addresses are added, today by default.
+    :type date_added: datetime.date.
+    :returns: tuple -- names of v4 and v6 files, caller should remove them,
+    and number of invalid addresses.
+
+    """
+    date_added = (date_added or date.today()).isoformat()
+    files = {}
+    filenames = {}
+    for ip_version in (4, 6):
+        descriptor, filenames[ip_version] = tempfile.mkstemp(
+            suffix='.ipv%s' % ip_version
+        )
+        files[ip_version] = os.fdopen(descriptor, 'w')
+    invalid = 0
+    try:
+        for ip_address in ip_addresses:
+            try:
+                ip = IPAddress(ip_address.strip())
+            except (AddrFormatError, ValueError):
+                invalid += 1
+                continue
+            value = ip.value if ip.version == 4 else _v6_hex(ip)
+            files[ip.version].write('%s\t%s\n' % (value, date_added))
+    finally:
+        for staging_file in files.values():
+            staging_file.close()
+    return filenames[4], filenames[6], invalid
+
+
+def load_addresses(connection, ip_addresses, sourcename=None,
+                   date_added=None):
+    """Load addresses in database through LOAD DATA LOCAL INFILE. Addresses
+    that are already in database keep their date_added. If sourcename is set
+    all addresses are linked to that source and its statistics and scores
+    are refreshed.
+
+    :param connection: MySQL database connection with local_infile enabled.
+    :type connection: MySQLdb.connections.Connection.
+    :param ip_addresses: Iterable of ip addresses in string form.
+    :type ip_addresses: iterable.
+    :param sourcename: The name of source to link addresses to.
+    :type sourcename: str.
+    :param date_added: Date when addresses are added, today by default.
+    :type date_added: datetime.date.
+    :returns: dict -- number of invalid addresses and for each version
+    number of loaded, inserted and linked addresses.
+
+    """
+    filename_v4, filename_v6, invalid = write_staging_files(
+        ip_addresses, date_added
+    )
+    stats = {'invalid': invalid}
+    cursor = connection.cursor()
+    try:
+        for ip_version, filename in ((4, filename_v4), (6, filename_v6)):
+            stats[ip_version] = _load_staging(cursor, ip_version, filename)
+        with Transaction(connection):
+            for ip_version in (4, 6):
+                stats[ip_version].update(
+                    _merge_staging(cursor, ip_version, sourcename)
+                )
+            if sourcename is not None:
+                dbapi.rebuild_source_stats(connection, sourcename)
+                dbapi.refresh_ip_scores(connection, sourcename)
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        _drop_temporary_tables(cursor, ['staging_ipv4', 'staging_ipv6'])
+        cursor.close()
+        os.remove(filename_v4)
+        os.remove(filename_v6)
+    MODULE_LOGGER.debug(
+        'Loaded addresses for source %s: %s' % (sourcename, stats)
+    )
+    return stats
+
+
+def _drop_temporary_tables(cursor, tables):
+    """Drop temporary tables if they exist, pooled connection outlives
+    them otherwise. Errors are only logged, so they don't hide error which
+    interrupted the load."""
+    for table in tables:
+        try:
+            cursor.execute('DROP TEMPORARY TABLE IF EXISTS %s' % table)
+        except mdb.Error as mdb_error:
+            MODULE_LOGGER.error(mdb_error.message)
+
+
+def _load_staging(cursor, ip_version, filename):
+    """Create staging table and load file in it. Index on staging table is
+    built once after load instead of on every row."""
+    column = 'address' if ip_version == 4 else '@address_hex'
+    _drop_temporary_tables(cursor, ['staging_ipv%s' % ip_version])
+    cursor.execute('''
+    CREATE TEMPORARY TABLE staging_ipv{0} (
+        address {1} NOT NULL,
+        date_added DATE NULL DEFAULT NULL)
+    ENGINE = InnoDB'''.format(
+        ip_version, 'INT(10) UNSIGNED' if ip_version == 4 else 'BINARY(16)'
+    ))
+    sql = '''
+    LOAD DATA LOCAL INFILE '{0}'
+    INTO TABLE staging_ipv{1}
+    FIELDS TERMINATED BY '\\t'
+    ({2}, date_added)'''.format(filename, ip_version, column)
+    if ip_version == 6:
+        sql += '''
+    SET address = UNHEX(@address_hex)'''
+    loaded = cursor.execute(sql)
+    cursor.execute(
+        'ALTER TABLE staging_ipv%s ADD INDEX address_INDEX (address)'
+        % ip_version
+    )
+    return {'loaded': loaded}
+
+
+def _merge_staging(cursor, ip_version, sourcename):
+    """Insert new addresses from staging table and link them to source"""
+    stats = {}
+    stats['inserted'] = cursor.execute('''
+    INSERT IGNORE INTO ipv{0}_addresses (address, date_added)
+    SELECT address, MIN(date_added) FROM staging_ipv{0}
+    GROUP BY address'''.format(ip_version))
+    _notify_staging(cursor, ip_version)
+    if sourcename is None:
+        return stats
+    # ids are taken from existing rows, so foreign key checks are skipped
+    cursor.execute('SET foreign_key_checks = 0')
+    try:
+        stats['linked'] = cursor.execute('''
+        INSERT INTO source_to_addresses (source_id, v{0}_id)
+        SELECT DISTINCT sources.id, ipv{0}_addresses.id
+        FROM staging_ipv{0}
+        JOIN ipv{0}_addresses
+            ON ipv{0}_addresses.address = staging_ipv{0}.address
+        JOIN sources ON sources.source_name = "{1}"
+        LEFT JOIN source_to_addresses
+            ON source_to_addresses.source_id = sources.id
+            AND source_to_addresses.v{0}_id = ipv{0}_addresses.id
+        WHERE source_to_addresses.source_id IS NULL'''.format(
+            ip_version, sourcename
+        ))
+    finally:
+        cursor.execute('SET foreign_key_checks = 1')
+    return stats
+
+
+def _notify_staging(cursor, ip_version):
+    """Pass addresses of staging table to dbapi insert listeners"""
+    if not dbapi.INSERT_LISTENERS:
+        return
+    cursor.execute('SELECT DISTINCT address FROM staging_ipv%s' % ip_version)
+    dbapi.notify_inserted(ip_version, [
+        dbapi._address_value(ip_version, row[0]) for row in cursor.fetchall()
+    ])
+
+
+def refresh_source(connection, sourcename, ip_addresses, date_modified=None):
+    """Make addresses of source equal to new address set. New set is loaded
+    in staging tables, difference with current links of source is computed
+    by set-based queries and only added and removed links are written, so
+    refresh cost grows with number of changes, not with size of source.
+    Addresses removed from source stay in database. Statistics and scores
+    of changed addresses and url_date_modified of source are updated.
+
+    :param connection: MySQL database connection with local_infile enabled.
+    :type connection: MySQLdb.connections.Connection.
+    :param sourcename: The name of source to refresh.
+    :type sourcename: str.
+    :param ip_addresses: Iterable of all ip addresses of source in string
+    form.
+    :type ip_addresses: iterable.
+    :param date_modified: Date of source content, today by default.
+    :type date_modified: datetime.date.
+    :returns: dict -- number of invalid addresses and for each version
+    number of loaded, inserted, added and removed addresses.
+
+    """
+    date_modified = date_modified or date.today()
+    filename_v4, filename_v6, invalid = write_staging_files(ip_addresses)
+    stats = {'invalid': invalid}
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            'SELECT id FROM sources WHERE source_name = "%s"' % sourcename
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise Exception("There is no source %s" % sourcename)
+        source_id = row[0]
+        for ip_version, filename in ((4, filename_v4), (6, filename_v6)):
+            stats[ip_version] = _load_staging(cursor, ip_version, filename)
+        with Transaction(connection):
+            for ip_version in (4, 6):
+                stats[ip_version].update(
+                    _merge_staging(cursor, ip_version, None)
+                )
+                stats[ip_version].update(
+                    _apply_source_delta(cursor, ip_version, source_id)
+                )
+            cursor.execute('''
+            UPDATE sources SET url_date_modified = "{0}"
+            WHERE id = {1}'''.format(date_modified, source_id))
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        _drop_temporary_tables(cursor, [
+            'staging_ipv4', 'staging_ipv6',
+            'source_delta_v4', 'source_delta_v6',
+        ])
+        cursor.close()
+        os.remove(filename_v4)
+        os.remove(filename_v6)
+    MODULE_LOGGER.debug('Refreshed source %s: %s' % (sourcename, stats))
+    return stats
+
+
+def _apply_source_delta(cursor, ip_version, source_id):
+    """Compute addresses added to and removed from source by comparing its
+    links with staging table, then apply only those changes"""
+    _drop_temporary_tables(cursor, ['source_delta_v%s' % ip_version])
+    cursor.execute('''
+    CREATE TEMPORARY TABLE source_delta_v{0} (
+        id INT(11) NOT NULL,
+        added TINYINT(1) NOT NULL,
+        PRIMARY KEY (id))
+    ENGINE = InnoDB'''.format(ip_version))
+    stats = {}
+    stats['added'] = cursor.execute('''
+    INSERT IGNORE INTO source_delta_v{0} (id, added)
+    SELECT ipv{0}_addresses.id, 1
+    FROM staging_ipv{0}
+    JOIN ipv{0}_addresses
+        ON ipv{0}_addresses.address = staging_ipv{0}.address
+    LEFT JOIN source_to_addresses
+        ON source_to_addresses.source_id = {1}
+        AND source_to_addresses.v{0}_id = ipv{0}_addresses.id
+    WHERE source_to_addresses.source_id IS NULL'''.format(
+        ip_version, source_id
+    ))
+    stats['removed'] = cursor.execute('''
+    INSERT IGNORE INTO source_delta_v{0} (id, added)
+    SELECT source_to_addresses.v{0}_id, 0
+    FROM source_to_addresses
+    JOIN ipv{0}_addresses
+        ON ipv{0}_addresses.id = source_to_addresses.v{0}_id
+    LEFT JOIN staging_ipv{0}
+        ON staging_ipv{0}.address = ipv{0}_addresses.address
+    WHERE source_to_addresses.source_id = {1}
+    AND staging_ipv{0}.address IS NULL'''.format(ip_version, source_id))
+    if stats['added'] or stats['removed']:
+        condition = '''source_to_addresses.source_id = {0}
+            AND ipv{1}_addresses.id IN
+            (
+                SELECT id FROM source_delta_v{1} WHERE added = {2}
+            )'''
+        # statistics are computed from links before they are removed and
+        # after they are added
+        dbapi._change_source_stats(
+            cursor, ip_version, condition.format(source_id, ip_version, 0),
+            '-'
+        )
+        cursor.execute('''
+        DELETE source_to_addresses FROM source_to_addresses
+        JOIN source_delta_v{0}
+            ON source_delta_v{0}.id = source_to_addresses.v{0}_id
+        WHERE source_to_addresses.source_id = {1}
+        AND source_delta_v{0}.added = 0'''.format(ip_version, source_id))
+        # ids are taken from existing rows, so foreign key checks are skipped
+        cursor.execute('SET foreign_key_checks = 0')
+        try:
+            cursor.execute('''
+            INSERT INTO source_to_addresses (source_id, v{0}_id)
+            SELECT {1}, id FROM source_delta_v{0}
+            WHERE added = 1'''.format(ip_version, source_id))
+        finally:
+            cursor.execute('SET foreign_key_checks = 1')
+        dbapi._change_source_stats(
+            cursor, ip_version, condition.format(source_id, ip_version, 1),
+            '+'
+        )
+        _refresh_delta_scores(cursor, ip_version)
+    return stats
+
+
+def _refresh_delta_scores(cursor, ip_version):
+    """Recompute scores of changed addresses, remove scores of addresses
+    which lost their last source"""
+    cursor.execute('''
+    REPLACE INTO address_scores (address_version, address_id,
+        source_count, max_rank, weighted_rank)
+    SELECT {0}, source_to_addresses.v{0}_id,
+        COUNT(DISTINCT sources.id), MAX(sources.rank), SUM(sources.rank)
+    FROM source_to_addresses
+    JOIN sources ON source_to_addresses.source_id = sources.id
+    WHERE source_to_addresses.v{0}_id IN
+    (
+        SELECT id FROM source_delta_v{0}
+    )
+    GROUP BY source_to_addresses.v{0}_id'''.format(ip_version))
+    cursor.execute('''
+    DELETE address_scores FROM address_scores
+    JOIN source_delta_v{0} ON source_delta_v{0}.id = address_scores.address_id
+    LEFT JOIN source_to_addresses
+        ON source_to_addresses.v{0}_id = source_delta_v{0}.id
+    WHERE address_scores.address_version = {0}
+    AND source_to_addresses.v{0}_id IS NULL'''.format(ip_version))
@@ -0,0 +1,57 @@
+"""Benchmark of LOAD DATA import path against row-based inserts. Loads
+addresses from 11.0.0.0/8 network into database from dbapi.cfg, which must
+have local_infile=1 option, and removes them afterwards."""
+import time
+
+from netaddr import IPAddress
+
+import dbapi
+from bulk_load import load_addresses
+from mysql_connector import get_database_connection
+from transaction import Transaction
+
+FIRST_ADDRESS = IPAddress('11.0.0.0')
+ADDRESSES = 100000
+
+
+def benchmark_addresses():
+    return (str(FIRST_ADDRESS + offset) for offset in xrange(ADDRESSES))
+
+
+def remove_benchmark_addresses(connection):
+    """Delete addresses inserted by benchmark"""
+    cursor = connection.cursor()
+    cursor.execute(
+        'DELETE FROM ipv4_addresses WHERE address BETWEEN %s AND %s'
+        % (FIRST_ADDRESS.value, FIRST_ADDRESS.value + ADDRESSES)
+    )
+    cursor.close()
+
+
+def row_based(connection):
+    with Transaction(connection, flush_every=1000) as transaction:
+        for ip_address in benchmark_addresses():
+            transaction.execute(dbapi.insert_ip_into_db, ip_address)
+
+
+def load_data(connection):
+    load_addresses(connection, benchmark_addresses())
+
+
+def main():
+    connection = get_database_connection('dbapi.cfg', 'MySQL settings')
+    try:
+        runs = (('row inserts', row_based), ('load data', load_data))
+        for name, run in runs:
+            remove_benchmark_addresses(connection)
+            start = time.time()
+            run(connection)
+            elapsed = time.time() - start
+            print('%12s: %10.1f addresses/s' % (name, ADDRESSES / elapsed))
+        remove_benchmark_addresses(connection)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
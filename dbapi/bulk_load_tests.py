@@ -0,0 +1,95 @@
+import os
+import unittest
+from datetime import date
+
+import MySQLdb as mdb
+
+import bulk_load
+from bulk_load import load_addresses, write_staging_files
+from dbapi_exceptions import SQLSyntaxError
+
+
+class FakeCursor(object):
+
+    def __init__(self, fail_on):
+        self.fail_on = fail_on
+        self.executed = []
+
+    def execute(self, sql):
+        self.executed.append(' '.join(sql.split()))
+        if self.fail_on in sql:
+            raise mdb.ProgrammingError('Table is full')
+        return 0
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+class WriteStagingFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.filenames = []
+
+    def tearDown(self):
+        for filename in self.filenames:
+            os.remove(filename)
+
+    def read(self, filename):
+        self.filenames.append(filename)
+        with open(filename) as staging_file:
+            return staging_file.read().splitlines()
+
+    def test_write_staging_files(self):
+        filename_v4, filename_v6, invalid = write_staging_files(
+            ['192.168.1.1\n', ' 1.1.1.1', 'spam', '::1', '', '300.1.1.1'],
+            date(2013, 6, 20)
+        )
+        self.assertEquals(
+            self.read(filename_v4),
+            ['3232235777\t2013-06-20', '16843009\t2013-06-20']
+        )
+        self.assertEquals(
+            self.read(filename_v6),
+            ['0' * 31 + '1\t2013-06-20']
+        )
+        self.assertEquals(invalid, 3)
+
+    def test_no_addresses(self):
+        filename_v4, filename_v6, invalid = write_staging_files([])
+        self.assertEquals(self.read(filename_v4), [])
+        self.assertEquals(self.read(filename_v6), [])
+        self.assertEquals(invalid, 0)
+
+
+class LoadAddressesTest(unittest.TestCase):
+
+    def test_staging_tables_dropped_after_error(self):
+        cursor = FakeCursor('LOAD DATA')
+        self.assertRaises(
+            SQLSyntaxError, load_addresses, FakeConnection(cursor),
+            ['1.1.1.1']
+        )
+        self.assertEquals(cursor.executed[0],
+                          'DROP TEMPORARY TABLE IF EXISTS staging_ipv4')
+        self.assertEquals(cursor.executed[-2:], [
+            'DROP TEMPORARY TABLE IF EXISTS staging_ipv4',
+            'DROP TEMPORARY TABLE IF EXISTS staging_ipv6',
+        ])
+
+    def test_drop_errors_are_logged(self):
+        cursor = FakeCursor('DROP')
+        bulk_load._drop_temporary_tables(cursor, ['staging_ipv4'])
+        self.assertEquals(len(cursor.executed), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
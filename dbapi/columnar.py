@@ -0,0 +1,218 @@
+"""Module implements columnar fetch of ipv4 addresses into NumPy arrays for
+analytics and vectorized helpers for set operations, /24 bucketing and date
+histograms. Each page of rows comes from server as comma separated columns
+made by GROUP_CONCAT and is parsed straight into arrays, so no Python tuple
+is created per row. NumPy is optional and needed only by this module.
+:functions: get_ip_columns_from_range, get_ip_columns_added_in_range,
+get_source_columns, intersect_addresses, difference_addresses, bucket_by_24,
+counts_per_date"""
+import MySQLdb as mdb
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from dbapi import get_ip_data
+from dbapi_exceptions import SQLSyntaxError
+from logging_conf import create_logger
+from mysql_connector import SessionVariable
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+# TO_DAYS value of 1970-01-01, start of datetime64 calendar
+EPOCH_DAYS = 719528
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for columnar fetch mode")
+
+
+def _parse_page(page):
+    """Convert page row of GROUP_CONCAT columns to arrays
+
+    :param page: Row with ids, addresses and TO_DAYS dates as comma
+    separated strings, dates of rows without date_added are 0.
+    :type page: tuple.
+    :returns: tuple -- arrays of ids, addresses and dates.
+
+    """
+    ids_text, addresses_text, days_text = page
+    ids = np.fromstring(ids_text, dtype=np.int64, sep=',')
+    addresses = np.fromstring(addresses_text, dtype=np.uint32, sep=',')
+    days = np.fromstring(days_text, dtype=np.int64, sep=',')
+    dates = (days - EPOCH_DAYS).astype('datetime64[D]')
+    dates[days == 0] = np.datetime64('NaT')
+    return ids, addresses, dates
+
+
+def _fetch_columns(connection, condition, batch_size):
+    """Fetch ipv4 rows that match condition page by page in order of id
+
+    :returns: dict -- 'id' int64 array, 'address' uint32 array and
+    'date_added' datetime64[D] array.
+
+    """
+    _require_numpy()
+    sql = '''
+    SELECT GROUP_CONCAT(id ORDER BY id),
+        GROUP_CONCAT(address ORDER BY id),
+        GROUP_CONCAT(IFNULL(TO_DAYS(date_added), 0) ORDER BY id)
+    FROM
+    (
+        SELECT id, address, date_added FROM ipv4_addresses
+        WHERE ({0}) AND id > {1}
+        ORDER BY id
+        LIMIT {2}
+    ) AS page'''
+    ids, addresses, dates = [], [], []
+    last_id = 0
+    cursor = connection.cursor()
+    try:
+        # each page is returned as a single row of long strings
+        with SessionVariable(connection, 'group_concat_max_len',
+                             batch_size * 24):
+            while True:
+                cursor.execute(sql.format(condition, last_id, batch_size))
+                page = cursor.fetchone()
+                if page is None or page[0] is None:
+                    break
+                page_ids, page_addresses, page_dates = _parse_page(page)
+                ids.append(page_ids)
+                addresses.append(page_addresses)
+                dates.append(page_dates)
+                last_id = page_ids[-1]
+                if len(page_ids) < batch_size:
+                    break
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    result = {
+        'id': np.concatenate(ids) if ids else np.array([], np.int64),
+        'address': (np.concatenate(addresses) if addresses
+                    else np.array([], np.uint32)),
+        'date_added': (np.concatenate(dates) if dates
+                       else np.array([], 'datetime64[D]')),
+    }
+    MODULE_LOGGER.debug(
+        'Fetched %s ipv4 rows in columns where %s'
+        % (len(result['id']), condition)
+    )
+    return result
+
+
+def get_ip_columns_from_range(connection, start, end, batch_size=100000):
+    """Get ipv4 addresses in range as NumPy arrays
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param start: Start ip-address.
+    :type start: str.
+    :param end: End ip-address.
+    :type end: str.
+    :param batch_size: Number of rows fetched by one query.
+    :type batch_size: int.
+    :returns: dict -- 'id', 'address' and 'date_added' arrays.
+
+    """
+    start_value, start_version = get_ip_data(start)
+    end_value, end_version = get_ip_data(end)
+    if start_version != 4 or end_version != 4:
+        raise Exception("Columnar fetch supports only ipv4 addresses")
+    return _fetch_columns(
+        connection,
+        'address BETWEEN %s AND %s' % (start_value, end_value),
+        batch_size
+    )
+
+
+def get_ip_columns_added_in_range(connection, startdate, enddate,
+                                  batch_size=100000):
+    """Get ipv4 addresses added since startdate till enddate as NumPy arrays
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param startdate: Date range start.
+    :type start: datetime.datetime.
+    :param enddate: Date range end.
+    :type enddate: datetime.datetime.
+    :param batch_size: Number of rows fetched by one query.
+    :type batch_size: int.
+    :returns: dict -- 'id', 'address' and 'date_added' arrays.
+
+    """
+    if startdate > enddate:
+        raise Exception("End date is before start date")
+    return _fetch_columns(
+        connection,
+        "date_added BETWEEN '%s' AND '%s'"
+        % (startdate.date(), enddate.date()),
+        batch_size
+    )
+
+
+def get_source_columns(connection, sourcename, batch_size=100000):
+    """Get ipv4 addresses of source as NumPy arrays
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param sourcename: The name of ip addresses source.
+    :type sourcename: str.
+    :param batch_size: Number of rows fetched by one query.
+    :type batch_size: int.
+    :returns: dict -- 'id', 'address' and 'date_added' arrays.
+
+    """
+    return _fetch_columns(
+        connection,
+        '''id IN
+        (
+            SELECT source_to_addresses.v4_id FROM source_to_addresses
+            JOIN sources ON source_to_addresses.source_id = sources.id
+            WHERE sources.source_name = "%s"
+        )''' % sourcename,
+        batch_size
+    )
+
+
+def intersect_addresses(addresses, other_addresses):
+    """Return sorted unique addresses present in both arrays"""
+    _require_numpy()
+    return np.intersect1d(addresses, other_addresses)
+
+
+def difference_addresses(addresses, other_addresses):
+    """Return sorted unique addresses of first array missing in second"""
+    _require_numpy()
+    return np.setdiff1d(addresses, other_addresses)
+
+
+def bucket_by_24(addresses):
+    """Count addresses in each /24 network
+
+    :param addresses: uint32 array of ipv4 addresses.
+    :returns: tuple -- uint32 array of network addresses and array of
+    counts.
+
+    """
+    _require_numpy()
+    networks, counts = np.unique(
+        np.asarray(addresses, np.uint32) & np.uint32(0xFFFFFF00),
+        return_counts=True
+    )
+    return networks, counts
+
+
+def counts_per_date(dates):
+    """Count addresses added on each date, missing dates are skipped
+
+    :param dates: datetime64[D] array.
+    :returns: tuple -- array of dates and array of counts.
+
+    """
+    _require_numpy()
+    dates = np.asarray(dates, 'datetime64[D]')
+    return np.unique(dates[~np.isnat(dates)], return_counts=True)
@@ -0,0 +1,57 @@
+import unittest
+
+import columnar
+from columnar import (_parse_page, bucket_by_24, counts_per_date,
+                      difference_addresses, intersect_addresses)
+
+# NumPy is optional, columnar module imports it if it's installed
+np = columnar.np
+
+
+@unittest.skipIf(np is None, 'NumPy is not installed')
+class ColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        # 192.168.1.1, 192.168.1.15 and 1.1.1.1
+        self.addresses = np.array(
+            [3232235777, 3232235791, 16843009], np.uint32
+        )
+
+    def test_parse_page(self):
+        ids, addresses, dates = _parse_page(
+            ('3,4,5', '3232235777,3232235791,16843009', '735404,0,735404')
+        )
+        self.assertEquals(list(ids), [3, 4, 5])
+        self.assertEquals(addresses.dtype, np.uint32)
+        self.assertEquals(list(addresses), list(self.addresses))
+        self.assertEquals(dates[0], np.datetime64('2013-06-20'))
+        self.assertTrue(np.isnat(dates[1]))
+
+    def test_set_operations(self):
+        other = np.array([16843009, 68772477], np.uint32)
+        self.assertEquals(
+            list(intersect_addresses(self.addresses, other)),
+            [16843009]
+        )
+        self.assertEquals(
+            list(difference_addresses(self.addresses, other)),
+            [3232235777, 3232235791]
+        )
+
+    def test_bucket_by_24(self):
+        networks, counts = bucket_by_24(self.addresses)
+        self.assertEquals(list(networks), [16843008, 3232235776])
+        self.assertEquals(list(counts), [1, 2])
+
+    def test_counts_per_date(self):
+        dates = np.array(
+            ['2013-06-20', 'NaT', '2013-06-20', '2013-06-21'],
+            'datetime64[D]'
+        )
+        days, counts = counts_per_date(dates)
+        self.assertEquals(len(days), 2)
+        self.assertEquals(list(counts), [2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,19 +2,96 @@
 as a function (for now), each function takes MySQLdb.Connection as a first
 parameter, other parameter depend on function itself. Functions use MySQLdb
 library for executing queries and retrieving data"""
+from binascii import hexlify
+
 import MySQLdb as mdb
 from netaddr import IPAddress
 from netaddr.core import AddrFormatError
 
 from logging_conf import create_logger
 from dbapi_exceptions import IPAddressError, SQLSyntaxError
+from transaction import Transaction
 
 MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
 
+# names of functions which only read from database, they can be served by
+# replicas and their results can be shared between concurrent callers
+READ_FUNCTIONS = frozenset([
+    'get_ip_with_source_name',
+    'get_ip_from_range',
+    'find_ip_list_type',
+    'find_ip_list_types',
+    'get_ips_added_in_range',
+    'get_sources_modified_in_range',
+    'check_if_ip_in_database',
+    'find_ip_id',
+    'get_ip_not_in_source',
+    'get_source_by_sourcename',
+    'get_sourcename_list_with_ip',
+    'select_source_with_rank',
+    'select_ip_with_rank',
+    'select_sourcename_with_rank_in_range',
+    'select_ips_with_rank_in_range',
+    'get_ip_scores',
+    'get_top_scored_ips',
+    'get_ip_score',
+    'get_source_stats',
+])
+
+# list functions use unified list_membership table instead of whitelist
+# and blacklist tables when set, see sql/migrations/list_membership.sql
+LIST_MEMBERSHIP = False
+
+
+def use_list_membership(enabled=True):
+    """Switch list functions to list_membership table or back to whitelist
+    and blacklist tables"""
+    global LIST_MEMBERSHIP
+    LIST_MEMBERSHIP = enabled
+
+
+# delete functions remove only address rows and let foreign keys and
+# triggers remove links, list rows and scores when set, database must be
+# migrated with sql/migrations/cascade_delete.sql
+CASCADE_DELETE = False
+
+
+def use_cascade_delete(enabled=True):
+    """Switch delete functions to ON DELETE CASCADE schema or back to
+    deleting dependent rows one table at a time"""
+    global CASCADE_DELETE
+    CASCADE_DELETE = enabled
+
+
+# functions called with ip version and integer values of addresses added to
+# address tables, see add_insert_listener
+INSERT_LISTENERS = []
+
+
+def add_insert_listener(listener):
+    """Register function which is called with ip version and list of
+    integer values of inserted addresses. Insert functions of dbapi,
+    bulk_load, feed_import and export call it before transaction is
+    committed, so addresses may be passed to it and then rolled back."""
+    INSERT_LISTENERS.append(listener)
+
+
+def remove_insert_listener(listener):
+    INSERT_LISTENERS.remove(listener)
+
+
+def notify_inserted(ip_version, values):
+    """Pass integer values of inserted addresses to insert listeners"""
+    if not values:
+        return
+    for listener in list(INSERT_LISTENERS):
+        listener(ip_version, values)
+
 
 def get_ip_data(ip_address):
     """Return value of ip address and ip version (value is integer if ip
-    version is 4 and binary - if ip version is 6
+    version is 4 and hex literal of 16 bytes in network order - if ip
+    version is 6, so v6 addresses compare as numbers in range queries)
 
     :param ip_address: ip address in string form.
     :author: Andriy Kohut
@@ -25,7 +102,7 @@ def get_ip_data(ip_address):
     except AddrFormatError:
         raise IPAddressError
     ip_version = ip.version
-    ip_value = ip.value if ip_version == 4 else bin(ip)
+    ip_value = ip.value if ip_version == 4 else '0x%032x' % ip.value
     return ip_value, ip_version
 
 
@@ -112,7 +189,8 @@ def get_ip_from_range(connection, start, end, limit=None):
     cursor = connection.cursor()
     sql = '''
     SELECT * FROM ipv{0}_addresses
-    WHERE address BETWEEN {1} AND {2}'''
+    WHERE address BETWEEN {1} AND {2}
+    ORDER BY address'''
     if limit:
         # if "limit" parameter is set, add LIMIT clause to sql query
         sql = add_sql_limit(sql, limit)
@@ -138,8 +216,70 @@ def get_ip_from_range(connection, start, end, limit=None):
     return result
 
 
+def _list_joins(ip_version, id_column, alias='list'):
+    """Return sql joins of list tables to address id column and conditions
+    which are true if address is in whitelist or blacklist
+
+    :param ip_version: Version of ip addresses (4 or 6).
+    :type ip_version: int.
+    :param id_column: Column with address id to join lists on.
+    :type id_column: str.
+    :param alias: Prefix of joined tables aliases, must be unique in query.
+    :type alias: str.
+    :returns: tuple -- joins, whitelist condition and blacklist condition.
+
+    """
+    if LIST_MEMBERSHIP:
+        joins = """
+    LEFT JOIN list_membership AS {0}_membership
+        ON {0}_membership.address_version = {1}
+        AND {0}_membership.address_id = {2}""".format(
+            alias, ip_version, id_column
+        )
+        return (
+            joins,
+            '{0}_membership.list_type = "whitelist"'.format(alias),
+            '{0}_membership.list_type = "blacklist"'.format(alias),
+        )
+    joins = """
+    LEFT JOIN whitelist AS {0}_whitelist
+        ON {0}_whitelist.v{1}_id_whitelist = {2}
+    LEFT JOIN blacklist AS {0}_blacklist
+        ON {0}_blacklist.v{1}_id_blacklist = {2}""".format(
+        alias, ip_version, id_column
+    )
+    return (
+        joins,
+        '{0}_whitelist.v{1}_id_whitelist IS NOT NULL'.format(
+            alias, ip_version
+        ),
+        '{0}_blacklist.v{1}_id_blacklist IS NOT NULL'.format(
+            alias, ip_version
+        ),
+    )
+
+
+def _list_type(in_whitelist, in_blacklist):
+    """Return list name from flags of address presence in lists
+
+    :param in_whitelist: True if address is in whitelist.
+    :param in_blacklist: True if address is in blacklist.
+    :returns: str -- 'whitelist', 'blacklist' or None.
+
+    """
+    if in_whitelist and in_blacklist:
+        raise Exception("Ip both in white and black lists, something wrong")
+    if in_whitelist:
+        return 'whitelist'
+    if in_blacklist:
+        return 'blacklist'
+    return None
+
+
 def find_ip_list_type(connection, ip_address):
-    """Find to which list ip address belongs
+    """Find to which list ip address belongs. Address id is resolved once
+    and both lists are checked by the same query, with list_membership
+    table it is a single primary key lookup.
 
     :param connection: MySQL database connection.
     :type connection: MySQLdb.connections.Connection.
@@ -150,40 +290,110 @@ def find_ip_list_type(connection, ip_address):
 
     """
     cursor = connection.cursor()
-    sql = '''
-    SELECT count(*) FROM {0}
-    WHERE v{1}_id_{0} =
-    (
-        SELECT id FROM ipv{1}_addresses
-        WHERE address = {2}
-    )
-    '''
     ip_value, ip_version = get_ip_data(ip_address)
-    # format sql for whitelist and blacklist
-    sql_whitelist = sql.format('whitelist', ip_version, ip_value)
-    sql_blacklist = sql.format('blacklist', ip_version, ip_value)
-    try:
-        # get number of address occurrences
-        cursor.execute(sql_whitelist)
-        whitelist_count = cursor.fetchone()[0]
-        cursor.execute(sql_blacklist)
-        blacklist_count = cursor.fetchone()[0]
+    joins, in_whitelist, in_blacklist = _list_joins(
+        ip_version, 'ipv%s_addresses.id' % ip_version
+    )
+    sql = '''
+    SELECT {2}, {3}
+    FROM ipv{0}_addresses{4}
+    WHERE address = {1}
+    '''.format(ip_version, ip_value, in_whitelist, in_blacklist, joins)
+    try:
+        cursor.execute(sql)
+        result = cursor.fetchone()
     except mdb.ProgrammingError as mdb_error:
         MODULE_LOGGER.error(mdb_error.message)
         raise SQLSyntaxError
     finally:
         cursor.close()
-    if whitelist_count == blacklist_count:
-        if whitelist_count > 0:
-            raise Exception("Ip both in white and black lists, something wrong")
-        return None
-    list_name = 'whitelist' if whitelist_count > 0 else 'blacklist'
+    # address is not in database at all
+    list_name = _list_type(*result) if result else None
     MODULE_LOGGER.debug(
         "Get %s list type. Found: %s" % (ip_address, list_name)
     )
     return list_name
 
 
+def _group_addresses(ip_addresses):
+    """Group ip addresses by version and integer value
+
+    :param ip_addresses: ip-addresses.
+    :type ip_addresses: iterable.
+    :returns: tuple -- for each version dict of address strings and dict of
+    sql values, both keyed by integer value.
+
+    """
+    addresses = {4: {}, 6: {}}
+    sql_values = {4: {}, 6: {}}
+    for ip_address in ip_addresses:
+        ip_value, ip_version = get_ip_data(ip_address)
+        key = IPAddress(ip_address).value
+        addresses[ip_version].setdefault(key, []).append(ip_address)
+        sql_values[ip_version][key] = ip_value
+    return addresses, sql_values
+
+
+def _address_value(ip_version, value):
+    """Convert address column value to integer"""
+    return int(hexlify(value), 16) if ip_version == 6 else value
+
+
+def find_ip_list_types(connection, ip_addresses, chunk_size=1000):
+    """Find list types of many ip addresses, one query per chunk_size
+    addresses of the same ip version
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param ip_addresses: ip-addresses.
+    :type ip_addresses: iterable.
+    :param chunk_size: Number of addresses checked by one query.
+    :type chunk_size: int.
+    :returns: dict -- list name 'whitelist', 'blacklist' or None for each
+    ip address.
+
+    """
+    addresses, sql_values = _group_addresses(ip_addresses)
+    sql = '''
+    SELECT address, {2}, {3}
+    FROM ipv{0}_addresses{4}
+    WHERE address IN ({1})
+    '''
+    result = {}
+    cursor = connection.cursor()
+    try:
+        for ip_version in (4, 6):
+            keys = list(sql_values[ip_version])
+            for start in xrange(0, len(keys), chunk_size):
+                chunk = keys[start:start + chunk_size]
+                joins, in_whitelist, in_blacklist = _list_joins(
+                    ip_version, 'ipv%s_addresses.id' % ip_version
+                )
+                cursor.execute(sql.format(ip_version, ', '.join(
+                    str(sql_values[ip_version][key]) for key in chunk
+                ), in_whitelist, in_blacklist, joins))
+                for value, in_whitelist, in_blacklist in cursor.fetchall():
+                    value = _address_value(ip_version, value)
+                    list_name = _list_type(in_whitelist, in_blacklist)
+                    for ip_address in addresses[ip_version][value]:
+                        result[ip_address] = list_name
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    # addresses which are not in database
+    for ip_version in (4, 6):
+        for ip_address_list in addresses[ip_version].values():
+            for ip_address in ip_address_list:
+                result.setdefault(ip_address, None)
+    MODULE_LOGGER.debug(
+        "Get list types of %s ips. Found in lists: %s"
+        % (len(result), len([name for name in result.values() if name]))
+    )
+    return result
+
+
 def get_ips_added_in_range(connection, startdate, enddate, limit=None):
     """Get information about ip addresses added since startdate till enddate
 
@@ -329,7 +539,7 @@ def find_ip_id(connection, ip_address):
         MODULE_LOGGER.error(mdb_error.message)
         raise SQLSyntaxError
     finally:
-        MODULE_LOGGER.debug("IP addresses %s id %s" /
+        MODULE_LOGGER.debug("IP addresses %s id %s" \
                             % (ip_address, ip_id[0]))
         cursor.close()
 
@@ -348,18 +558,23 @@ def del_ip_from_list(connection, ip_address, lists):
     ipid = find_ip_id(connection, ip_address)
     #Version detection
     ipv = get_ip_data(ip_address)[1]
-    sql = "DELETE FROM %s WHERE v%s_id_%s = %s"%(lists,ipv,lists,ipid)
+    if LIST_MEMBERSHIP:
+        sql = '''DELETE FROM list_membership WHERE address_version = %s
+        AND address_id = %s AND list_type = "%s"''' % (ipv, ipid, lists)
+    else:
+        sql = "DELETE FROM %s WHERE v%s_id_%s = %s"%(lists,ipv,lists,ipid)
     cursor = connection.cursor()
     try:
         #Execute the SQL command
         cursor.execute(sql)
-    except mdb.Error:
+        _change_source_list_stats(cursor, ipv, ipid, lists, -cursor.rowcount)
+    except mdb.Error as mdb_error:
         # Rollback in case there is any error
         connection.rollback()
         MODULE_LOGGER.error(mdb_error.message)
         raise SQLSyntaxError
     finally:
-        MODULE_LOGGER.debug("Removing %s IP%s addresses which has ID = %s from a %s" /
+        MODULE_LOGGER.debug("Removing %s IP%s addresses which has ID = %s from a %s" \
                             % (ip_address, ipv, ipid, lists))
         cursor.close()
 
@@ -372,30 +587,120 @@ def delete_ip(connection, ip_address):
     :type ip: str
     :author: Oleg Babiy
     '''
+    if CASCADE_DELETE:
+        _delete_ip_cascade(connection, ip_address)
+        return
     #Version detection
-    ipid = find_ip_id(connection, ip_address)
     ipv = get_ip_data(ip_address)[1]
     ip_address = get_ip_data(ip_address)[0]
     sql = "DELETE FROM `ipv%s_addresses` WHERE `address` = %s" % (ipv, ip_address)
-    sql1 = "DELETE FROM `blacklist` WHERE `v%s_id_blacklist` = %s" % (ipv, ipid)
-    sql2 = "DELETE FROM `whitelist` WHERE `v%s_id_whitelist` = %s" % (ipv, ipid)
-    sql3 = "DELETE FROM `source_to_addresses` WHERE `v%s_id` = %s" % (ipv, ipid)
+    condition = 'ipv%s_addresses.address = %s' % (ipv, ip_address)
+    cursor = connection.cursor()
     try:
-        #Execute the SQL command
-        cursor = connection.cursor()
-        cursor.execute(sql3)
-        cursor.execute(sql1)
-        cursor.execute(sql2)
-        cursor.execute(sql)
-    except mdb.Error:
-        # Rollback in case there is any error
-        connection.rollback()
+        # statistics and rows are changed in one commit, error rolls back
+        with Transaction(connection):
+            #Source statistics are computed from rows that will be removed
+            _change_source_stats(cursor, ipv, condition, '-')
+            # links, list rows and score, same as in delete_ips
+            _delete_dependent_rows(cursor, ipv, condition)
+            #Execute the SQL command
+            cursor.execute(sql)
+    except mdb.Error as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug("Removing %s IP%s address from a database"
+                        % (ip_address, ipv))
+
+
+def _delete_ip_cascade(connection, ip_address):
+    """Delete address row, links, list rows and score go with it"""
+    ip_value, ip_version = get_ip_data(ip_address)
+    condition = 'ipv%s_addresses.address = %s' % (ip_version, ip_value)
+    cursor = connection.cursor()
+    try:
+        with Transaction(connection):
+            # statistics are computed from links that will be removed
+            _change_source_stats(cursor, ip_version, condition, '-')
+            cursor.execute(
+                'DELETE FROM ipv%s_addresses WHERE address = %s'
+                % (ip_version, ip_value)
+            )
+    except mdb.Error as mdb_error:
         MODULE_LOGGER.error(mdb_error.message)
         raise SQLSyntaxError
     finally:
-        MODULE_LOGGER.debug("Removing %s IP%s addresses which has ID = %s from a database" /
-                            % (ip_address, ipv, ipid))
         cursor.close()
+    MODULE_LOGGER.debug("Removed %s from a database" % ip_address)
+
+
+def delete_ips(connection, ip_addresses, chunk_size=1000):
+    """Delete many ip addresses with their links to sources, list rows
+    and source statistics, chunk_size addresses at a time. With
+    use_cascade_delete() each chunk is one DELETE of address rows. All
+    chunks are deleted in one transaction, error rolls back all of them.
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param ip_addresses: Ip addresses to delete.
+    :type ip_addresses: iterable.
+    :param chunk_size: Number of addresses deleted by one query.
+    :type chunk_size: int.
+    :returns: int -- number of addresses that were in database.
+
+    """
+    sql_values = _group_addresses(ip_addresses)[1]
+    deleted = 0
+    cursor = connection.cursor()
+    try:
+        with Transaction(connection):
+            for ip_version in (4, 6):
+                values = sql_values[ip_version].values()
+                for start in xrange(0, len(values), chunk_size):
+                    condition = 'ipv%s_addresses.address IN (%s)' % (
+                        ip_version,
+                        ', '.join(str(value) for value in
+                                  values[start:start + chunk_size])
+                    )
+                    _change_source_stats(cursor, ip_version, condition, '-')
+                    if not CASCADE_DELETE:
+                        _delete_dependent_rows(
+                            cursor, ip_version, condition
+                        )
+                    cursor.execute(
+                        'DELETE FROM ipv%s_addresses WHERE %s'
+                        % (ip_version, condition)
+                    )
+                    deleted += cursor.rowcount
+    except mdb.Error as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug("Deleted %s IP addresses" % deleted)
+    return deleted
+
+
+def _delete_dependent_rows(cursor, ip_version, condition):
+    """Delete links, list rows and scores of addresses matching condition
+    on ipv{N}_addresses table"""
+    tables = [('source_to_addresses', 'source_to_addresses.v{0}_id')]
+    if LIST_MEMBERSHIP:
+        tables.append(('list_membership', 'list_membership.address_id'))
+    else:
+        tables.append(('whitelist', 'whitelist.v{0}_id_whitelist'))
+        tables.append(('blacklist', 'blacklist.v{0}_id_blacklist'))
+    tables.append(('address_scores', 'address_scores.address_id'))
+    for table, id_column in tables:
+        sql = """
+        DELETE {1} FROM {1}
+        JOIN ipv{0}_addresses ON {2} = ipv{0}_addresses.id
+        WHERE {3}""".format(ip_version, table, id_column.format(ip_version),
+                            condition)
+        if table in ('list_membership', 'address_scores'):
+            sql += ' AND {0}.address_version = {1}'.format(table, ip_version)
+        cursor.execute(sql)
 
 
 def delete_ip_range(connection, ip1, ip2):
@@ -408,44 +713,29 @@ def delete_ip_range(connection, ip1, ip2):
     :type ip2: str
     :author: Oleg Babiy
     '''
-    ipv = get_ip_data(ip_address)[1]
+    ipv = get_ip_data(ip1)[1]
     ip1 = get_ip_data(ip1)[0]
     ip2 = get_ip_data(ip2)[0]
 
-    sql = 'SELECT `id` FROM `ipv%s_addresses` WHERE `address`BETWEEN %s AND %s' % (ipv, ip1, ip2)
     sqldel = 'DELETE FROM `ipv%s_addresses` WHERE `address` BETWEEN %s AND %s' % (ipv, ip1, ip2)
+    condition = 'ipv%s_addresses.address BETWEEN %s AND %s' % (ipv, ip1, ip2)
+    cursor = connection.cursor()
     try:
-        cursor = connection.cursor()
-        #Execute the SQL command
-        cursor.execute(sql)
-        #Commit your changes in the database
-        fetch = cursor.fetchall()
-        for x in fetch:
-            if ipv == 4:
-                lists = 'DELETE FROM `source_to_addresses` WHERE `v4_id` = %s'%(x)
-                cursor.execute(lists)
-                lists1 = 'DELETE FROM `blacklist` WHERE `v4_id_blacklist` = %s'%(x)
-                cursor.execute(lists1)
-                lists2 = 'DELETE FROM `whitelist` WHERE `v4_id_whitelist` = %s'%(x)
-                cursor.execute(lists2)
-            else:
-                lists = 'DELETE FROM `source_to_addresses` WHERE `v6_id` = %s'%(x)
-                cursor.execute(lists)
-                lists1 = 'DELETE FROM `blacklist` WHERE `v6_id_blacklist` = %s'%(x)
-                cursor.execute(lists1)
-                lists2 = 'DELETE FROM `whitelist` WHERE `v6_id_whitelist` = %s'%(x)
-                cursor.execute(lists2)
-        #Execute the SQL command
-        cursor.execute(sqldel)
-    except mdb.Error:
-        # Rollback in case there is any error
-        connection.rollback()
+        with Transaction(connection):
+            #Source statistics are computed from rows that will be removed
+            _change_source_stats(cursor, ipv, condition, '-')
+            # dependent rows are removed by foreign keys and triggers
+            if not CASCADE_DELETE:
+                _delete_dependent_rows(cursor, ipv, condition)
+            #Execute the SQL command
+            cursor.execute(sqldel)
+        MODULE_LOGGER.debug("Removing IP%s address from the range between "
+                            "%s and %s. Total number of erased IP is %s"
+                            % (ipv, ip1, ip2, cursor.rowcount))
+    except mdb.Error as mdb_error:
         MODULE_LOGGER.error(mdb_error.message)
         raise SQLSyntaxError
     finally:
-        MODULE_LOGGER.debug("Removing IP%s address from the range between %s and %s." /
-                            + "Total number of erased IP is %s" /
-                            % (ipv, ip1, ip2, len(fetch)))
         cursor.close()
 
 
@@ -532,7 +822,7 @@ def get_sourcename_list_with_ip(connection, ip_address):
     SELECT `source_name` FROM sources
     WHERE id IN (SELECT source_id FROM source_to_addresses
     WHERE v%s_id IN (SELECT id FROM ipv%s_addresses
-    WHERE address = '%s' ))
+    WHERE address = %s ))
     """ % (version, version, value)
     try:
         cursor.execute(sql)
@@ -691,6 +981,255 @@ def select_ips_with_rank_in_range(connection, minrank, maxrank, limit=None):
     return result
 
 
+def _merge_scored_ips(result_v4, result_v6, top=None):
+    """Merge v4 and v6 score rows ordered by weighted rank, cut to top rows
+
+    :param result_v4: Score rows of ipv4 addresses.
+    :type result_v4: tuple.
+    :param result_v6: Score rows of ipv6 addresses.
+    :type result_v6: tuple.
+    :param top: Number of rows to keep, all rows if not set.
+    :type top: int.
+    :returns: tuple -- score rows with highest weighted rank first.
+
+    """
+    # weighted rank is the last column, version and id break ties
+    result = sorted(
+        result_v4 + result_v6,
+        key=lambda row: (-row[-1], row[0], row[1])
+    )
+    if top is not None:
+        result = result[:int(top)]
+    return tuple(result)
+
+
+def get_ip_scores(connection, min_score=None, top=None):
+    """Compute reputation score of ip addresses from sources they belong to.
+    Score is computed by database over sources and source_to_addresses
+    tables: number of sources that list address, maximal rank of those
+    sources and weighted rank (sum of source ranks).
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param min_score: Lowest weighted rank of returned addresses.
+    :type min_score: int.
+    :param top: Number of addresses with highest weighted rank to return.
+    :type top: int.
+    :returns: tuple -- each inner tuple contains ip version, address id,
+    address, source count, max rank and weighted rank, ordered by weighted
+    rank descending.
+
+    """
+    cursor = connection.cursor()
+    sql = '''
+    SELECT {0}, ipv{0}_addresses.id, ipv{0}_addresses.address,
+        COUNT(DISTINCT sources.id) AS source_count,
+        MAX(sources.rank) AS max_rank,
+        CAST(SUM(sources.rank) AS SIGNED) AS weighted_rank
+    FROM source_to_addresses
+    JOIN sources ON source_to_addresses.source_id = sources.id
+    JOIN ipv{0}_addresses ON source_to_addresses.v{0}_id = ipv{0}_addresses.id
+    GROUP BY ipv{0}_addresses.id, ipv{0}_addresses.address'''
+    if min_score is not None:
+        sql += '''
+    HAVING weighted_rank >= %s''' % int(min_score)
+    sql += '''
+    ORDER BY weighted_rank DESC, ipv{0}_addresses.id'''
+    if top is not None:
+        # each version can't give more than top rows to merged result
+        sql = add_sql_limit(sql, (0, int(top)))
+    try:
+        cursor.execute(sql.format(4))
+        result_v4 = cursor.fetchall()
+        cursor.execute(sql.format(6))
+        result_v6 = cursor.fetchall()
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    result = _merge_scored_ips(result_v4, result_v6, top)
+    MODULE_LOGGER.debug(
+        'Computed scores of ips, min score is %s, top is %s. Found: %s'
+        % (min_score, top, len(result))
+    )
+    return result
+
+
+def get_top_scored_ips(connection, top=None, min_score=None):
+    """Get addresses with highest reputation score from address_scores
+    summary table, which is kept by refresh_ip_scores function
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param top: Number of addresses with highest weighted rank to return.
+    :type top: int.
+    :param min_score: Lowest weighted rank of returned addresses.
+    :type min_score: int.
+    :returns: tuple -- each inner tuple contains ip version, address id,
+    address, source count, max rank and weighted rank, ordered by weighted
+    rank descending.
+
+    """
+    cursor = connection.cursor()
+    sql = '''
+    SELECT address_scores.address_version, address_scores.address_id,
+        ipv{0}_addresses.address, address_scores.source_count,
+        address_scores.max_rank, address_scores.weighted_rank
+    FROM address_scores
+    JOIN ipv{0}_addresses ON address_scores.address_id = ipv{0}_addresses.id
+    WHERE address_scores.address_version = {0}'''
+    if min_score is not None:
+        sql += '''
+    AND address_scores.weighted_rank >= %s''' % int(min_score)
+    sql += '''
+    ORDER BY address_scores.weighted_rank DESC, address_scores.address_id'''
+    if top is not None:
+        sql = add_sql_limit(sql, (0, int(top)))
+    try:
+        cursor.execute(sql.format(4))
+        result_v4 = cursor.fetchall()
+        cursor.execute(sql.format(6))
+        result_v6 = cursor.fetchall()
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    result = _merge_scored_ips(result_v4, result_v6, top)
+    MODULE_LOGGER.debug(
+        'Get top scored ips, min score is %s, top is %s. Found: %s'
+        % (min_score, top, len(result))
+    )
+    return result
+
+
+def get_ip_score(connection, ip_address):
+    """Get reputation score of single ip address from address_scores table
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param ip_address: ip address.
+    :type ip_address: str.
+    :returns: tuple -- source count, max rank and weighted rank, or None if
+    address doesn't belong to any source.
+
+    """
+    ip_value, ip_version = get_ip_data(ip_address)
+    sql = '''
+    SELECT address_scores.source_count, address_scores.max_rank,
+        address_scores.weighted_rank
+    FROM address_scores
+    JOIN ipv{0}_addresses ON address_scores.address_id = ipv{0}_addresses.id
+    WHERE address_scores.address_version = {0}
+    AND ipv{0}_addresses.address = {1}'''.format(ip_version, ip_value)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql)
+        result = cursor.fetchone()
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug(
+        'Get score of %s. Found: %s' % (ip_address, result)
+    )
+    return result
+
+
+def refresh_ip_scores(connection, sourcename=None, chunk_size=1000):
+    """Refresh address_scores summary table. If sourcename is set only
+    addresses which belong to that source are recomputed, so call it after
+    adding addresses to source, together with addresses unlinked from any
+    source since last refresh, which trigger of source_to_addresses
+    records in address_scores_dirty table. Scores of those addresses that
+    don't belong to any source anymore are removed. Full refresh
+    recomputes all addresses and removes all scores without source.
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param sourcename: The name of source which addresses should be
+    recomputed.
+    :type sourcename: str.
+    :param chunk_size: Number of unlinked addresses recomputed by one
+    query.
+    :type chunk_size: int.
+    :returns: int -- number of affected rows in address_scores table.
+
+    """
+    sql = '''
+    REPLACE INTO address_scores (address_version, address_id,
+        source_count, max_rank, weighted_rank)
+    SELECT {0}, source_to_addresses.v{0}_id,
+        COUNT(DISTINCT sources.id), MAX(sources.rank), SUM(sources.rank)
+    FROM source_to_addresses
+    JOIN sources ON source_to_addresses.source_id = sources.id
+    WHERE source_to_addresses.v{0}_id IS NOT NULL'''
+    sql_group = '''
+    GROUP BY source_to_addresses.v{0}_id'''
+    sql_source = sql + '''
+    AND source_to_addresses.v{0}_id IN
+    (
+        SELECT source_to_addresses.v{0}_id FROM source_to_addresses
+        JOIN sources ON source_to_addresses.source_id = sources.id
+        WHERE sources.source_name = "%s"
+    )''' % sourcename + sql_group
+    sql_ids = sql + '''
+    AND source_to_addresses.v{0}_id IN ({1})''' + sql_group
+    # unlinked addresses which lost all their sources
+    sql_orphans = '''
+    DELETE address_scores FROM address_scores
+    LEFT JOIN source_to_addresses
+        ON source_to_addresses.v{0}_id = address_scores.address_id
+    WHERE address_scores.address_version = {0}
+    AND source_to_addresses.v{0}_id IS NULL'''
+    sql_dirty = '''
+    DELETE FROM address_scores_dirty
+    WHERE address_version = {0}'''
+    affected = 0
+    cursor = connection.cursor()
+    try:
+        for ip_version in (4, 6):
+            if sourcename is None:
+                affected += cursor.execute(
+                    (sql + sql_group).format(ip_version)
+                )
+                affected += cursor.execute(sql_orphans.format(ip_version))
+                cursor.execute(sql_dirty.format(ip_version))
+                continue
+            affected += cursor.execute(sql_source.format(ip_version))
+            cursor.execute('''
+            SELECT address_id FROM address_scores_dirty
+            WHERE address_version = {0}'''.format(ip_version))
+            ids = [str(row[0]) for row in cursor.fetchall()]
+            for start in xrange(0, len(ids), chunk_size):
+                # address unlinked again between recompute and clear of
+                # its chunk keeps stale score until next full refresh
+                chunk = ', '.join(ids[start:start + chunk_size])
+                affected += cursor.execute(
+                    sql_ids.format(ip_version, chunk)
+                )
+                affected += cursor.execute(
+                    sql_orphans.format(ip_version)
+                    + ' AND address_scores.address_id IN (%s)' % chunk
+                )
+                cursor.execute(
+                    sql_dirty.format(ip_version)
+                    + ' AND address_id IN (%s)' % chunk
+                )
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug(
+        'Refreshed ip scores for source %s, affected rows: %s'
+        % (sourcename, affected)
+    )
+    return affected
+
+
 def insert_ip_into_db(connection, ip_address):
     """Insert ip address in database
 
@@ -703,25 +1242,162 @@ def insert_ip_into_db(connection, ip_address):
     """
     try:
         cursor = connection.cursor()
-        ip = IPAddress(ip_address)
-        if ip.version == 4:
-            sql = '''INSERT INTO `ipv4_addresses`(`address`, `date_added`)
-            VALUES (INET_ATON('%s'), curdate())''' % ip
-            cursor.execute(sql)
-        else:
-            ip = bin(ip)
-            sql = ''' INSERT INTO `ipv6_addresses`(`address`, `date_added`)
-            VALUES ( %s , curdate()); ''' % ip
-            cursor.execute(sql)
+        ip_value, ip_version = get_ip_data(ip_address)
+        sql = '''INSERT INTO `ipv{0}_addresses`(`address`, `date_added`)
+        VALUES ({1}, curdate())'''.format(ip_version, ip_value)
+        cursor.execute(sql)
     except mdb.ProgrammingError as mdb_error:
         MODULE_LOGGER.error(mdb_error.message)
         raise SQLSyntaxError
     finally:
         cursor.close()
+    notify_inserted(ip_version, [IPAddress(ip_address).value])
     MODULE_LOGGER.debug(
         "IP address - %s inserted seccessfuly" % ip_address)
 
 
+def insert_ips_into_db(connection, ip_addresses, chunk_size=1000):
+    """Insert many ip addresses in database with one multi-row insert per
+    chunk_size addresses of the same ip version
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param ip_addresses: Ip addresses to add.
+    :type ip_addresses: iterable.
+    :param chunk_size: Number of addresses inserted by one query.
+    :type chunk_size: int.
+    :returns: dict -- True for each ip address that was inserted, False if
+    it was already in database.
+
+    """
+    addresses, sql_values = _group_addresses(ip_addresses)
+    result = {}
+    cursor = connection.cursor()
+    try:
+        for ip_version in (4, 6):
+            keys = list(sql_values[ip_version])
+            for start in xrange(0, len(keys), chunk_size):
+                chunk = keys[start:start + chunk_size]
+                cursor.execute('''
+                SELECT address FROM ipv{0}_addresses
+                WHERE address IN ({1})'''.format(ip_version, ', '.join(
+                    str(sql_values[ip_version][key]) for key in chunk
+                )))
+                existing = set(
+                    _address_value(ip_version, row[0])
+                    for row in cursor.fetchall()
+                )
+                new_keys = [key for key in chunk if key not in existing]
+                if new_keys:
+                    cursor.execute('''
+                    INSERT IGNORE INTO ipv{0}_addresses (address, date_added)
+                    VALUES {1}'''.format(ip_version, ', '.join(
+                        '(%s, CURDATE())' % sql_values[ip_version][key]
+                        for key in new_keys
+                    )))
+                    notify_inserted(ip_version, new_keys)
+                for key in chunk:
+                    for ip_address in addresses[ip_version][key]:
+                        result[ip_address] = key not in existing
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug(
+        "Inserted %s of %s IP addresses"
+        % (len([added for added in result.values() if added]), len(result))
+    )
+    return result
+
+
+def insert_ips_into_list(connection, ip_addresses, list_type,
+                         chunk_size=1000):
+    """Insert many ip addresses in black or white list, addresses should
+    already be in database. Statistics of sources are updated as well.
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param ip_addresses: Ip addresses to add.
+    :type ip_addresses: iterable.
+    :param list_type: 'whitelist' or 'blacklist'.
+    :type list_type: str.
+    :param chunk_size: Number of addresses inserted by one query.
+    :type chunk_size: int.
+    :returns: dict -- True for each ip address that was added to list,
+    False if it is not in database or is already in some list.
+
+    """
+    addresses, sql_values = _group_addresses(ip_addresses)
+    result = {}
+    cursor = connection.cursor()
+    try:
+        for ip_version in (4, 6):
+            joins, in_whitelist, in_blacklist = _list_joins(
+                ip_version, 'ipv%s_addresses.id' % ip_version
+            )
+            keys = list(sql_values[ip_version])
+            for start in xrange(0, len(keys), chunk_size):
+                chunk = keys[start:start + chunk_size]
+                cursor.execute('''
+                SELECT ipv{0}_addresses.id, address, {2}, {3}
+                FROM ipv{0}_addresses{4}
+                WHERE address IN ({1})'''.format(ip_version, ', '.join(
+                    str(sql_values[ip_version][key]) for key in chunk
+                ), in_whitelist, in_blacklist, joins))
+                ids = {}
+                for ip_id, value, whitelisted, blacklisted in \
+                        cursor.fetchall():
+                    if not (whitelisted or blacklisted):
+                        ids[_address_value(ip_version, value)] = ip_id
+                if ids:
+                    _insert_list_rows(
+                        cursor, ip_version, ids.values(), list_type
+                    )
+                for key in chunk:
+                    for ip_address in addresses[ip_version][key]:
+                        result[ip_address] = key in ids
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug(
+        "Inserted %s of %s IP addresses in %s"
+        % (len([added for added in result.values() if added]), len(result),
+           list_type)
+    )
+    return result
+
+
+def _insert_list_rows(cursor, ip_version, ip_ids, list_type):
+    """Insert address ids in list and add them to list counts of sources"""
+    ip_ids = ', '.join(str(ip_id) for ip_id in ip_ids)
+    if LIST_MEMBERSHIP:
+        cursor.execute('''
+        INSERT INTO list_membership (address_version, address_id, list_type)
+        SELECT {0}, id, "{1}" FROM ipv{0}_addresses
+        WHERE id IN ({2})'''.format(ip_version, list_type, ip_ids))
+    else:
+        cursor.execute('''
+        INSERT INTO {1} (v{0}_id_{1})
+        SELECT id FROM ipv{0}_addresses
+        WHERE id IN ({2})'''.format(ip_version, list_type, ip_ids))
+    # source may contain several of addresses, so counts are grouped first
+    cursor.execute('''
+    UPDATE source_stats
+    JOIN
+    (
+        SELECT source_id, COUNT(*) AS amount FROM source_to_addresses
+        WHERE v{0}_id IN ({2})
+        GROUP BY source_id
+    ) AS delta ON source_stats.source_id = delta.source_id
+    SET source_stats.{1}ed_count = source_stats.{1}ed_count + delta.amount,
+        source_stats.last_updated = NOW()'''.format(
+        ip_version, list_type, ip_ids
+    ))
+
+
 def insert_new_source(connection, source_name, url, rank):
     """Adding new source in database
 
@@ -749,6 +1425,10 @@ def insert_new_source(connection, source_name, url, rank):
             '%s'); ''' % (source_name, url, rank)
         cursor = connection.cursor()
         cursor.execute(sql)
+        # new source starts with empty statistics
+        cursor.execute('''
+        INSERT INTO `source_stats` (`source_id`, `last_updated`)
+        VALUES (LAST_INSERT_ID(), NOW()); ''')
     except mdb.ProgrammingError as mdb_error:
         MODULE_LOGGER.error(mdb_error.message)
         raise SQLSyntaxError
@@ -778,9 +1458,15 @@ def insert_ip_into_list(connection, ip_address, list_type):
         cursor = connection.cursor()
         cursor.execute(sql)
         result = int(cursor.fetchone()[0])
-        sql = ''' INSERT INTO `{0}`(`v{1}_id_{0}`)
-        VALUES ({2}); '''.format(list_type, ip_version, result)
+        if LIST_MEMBERSHIP:
+            sql = ''' INSERT INTO `list_membership`
+            (`address_version`, `address_id`, `list_type`)
+            VALUES ({1}, {2}, "{0}"); '''.format(list_type, ip_version, result)
+        else:
+            sql = ''' INSERT INTO `{0}`(`v{1}_id_{0}`)
+            VALUES ({2}); '''.format(list_type, ip_version, result)
         cursor.execute(sql)
+        _change_source_list_stats(cursor, ip_version, result, list_type, 1)
     except mdb.ProgrammingError as mdb_error:
         MODULE_LOGGER.error(mdb_error.message)
         raise SQLSyntaxError
@@ -788,4 +1474,214 @@ def insert_ip_into_list(connection, ip_address, list_type):
         cursor.close()
     MODULE_LOGGER.debug(
         "IP address - %s inserted in - %s" % (ip_address, list_type))
-    
+
+
+def insert_ip_into_source(connection, ip_address, sourcename):
+    """Link ip address to source, address and source should already be
+    in database. Statistics of source are updated as well.
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param ip_address: Ip address to link.
+    :type ip_address: str.
+    :param sourcename: The name of ip addresses source.
+    :type sourcename: str.
+    :returns: boolean -- True if link was added, False if it already exists.
+
+    """
+    ip_value, ip_version = get_ip_data(ip_address)
+    sql = '''
+    INSERT INTO source_to_addresses (source_id, v{0}_id)
+    SELECT sources.id, ipv{0}_addresses.id
+    FROM sources, ipv{0}_addresses
+    WHERE sources.source_name = "{1}" AND ipv{0}_addresses.address = {2}
+    AND NOT EXISTS
+    (
+        SELECT * FROM source_to_addresses AS links
+        WHERE links.source_id = sources.id
+        AND links.v{0}_id = ipv{0}_addresses.id
+    )'''.format(ip_version, sourcename, ip_value)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql)
+        inserted = cursor.rowcount > 0
+        if inserted:
+            _change_source_stats(
+                cursor,
+                ip_version,
+                'sources.source_name = "%s" AND ipv%s_addresses.address = %s'
+                % (sourcename, ip_version, ip_value),
+                '+'
+            )
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug(
+        "IP address - %s linked to source %s: %s"
+        % (ip_address, sourcename, inserted)
+    )
+    return inserted
+
+
+def _change_source_stats(cursor, ip_version, condition, sign):
+    """Add or subtract address and list counts of links matching condition
+    from source_stats table. Must be called after links are inserted or
+    before they are deleted.
+
+    :param cursor: Cursor of MySQL database connection.
+    :type cursor: MySQLdb.cursors.Cursor.
+    :param ip_version: Version of ip addresses (4 or 6).
+    :type ip_version: int.
+    :param condition: Sql condition on source_to_addresses, sources and
+    ipv{N}_addresses tables, that selects links to count.
+    :type condition: str.
+    :param sign: '+' or '-'.
+    :type sign: str.
+
+    """
+    joins, in_whitelist, in_blacklist = _list_joins(
+        ip_version, 'ipv%s_addresses.id' % ip_version
+    )
+    sql = '''
+    UPDATE source_stats
+    JOIN
+    (
+        SELECT source_to_addresses.source_id,
+            COUNT(*) AS address_count,
+            COUNT(IF({3}, 1, NULL)) AS whitelisted_count,
+            COUNT(IF({4}, 1, NULL)) AS blacklisted_count
+        FROM source_to_addresses
+        JOIN sources ON source_to_addresses.source_id = sources.id
+        JOIN ipv{0}_addresses
+            ON source_to_addresses.v{0}_id = ipv{0}_addresses.id{5}
+        WHERE {1}
+        GROUP BY source_to_addresses.source_id
+    ) AS delta ON source_stats.source_id = delta.source_id
+    SET source_stats.v{0}_count =
+            source_stats.v{0}_count {2} delta.address_count,
+        source_stats.whitelisted_count =
+            source_stats.whitelisted_count {2} delta.whitelisted_count,
+        source_stats.blacklisted_count =
+            source_stats.blacklisted_count {2} delta.blacklisted_count,
+        source_stats.last_updated = NOW()'''.format(
+        ip_version, condition, sign, in_whitelist, in_blacklist, joins
+    )
+    cursor.execute(sql)
+
+
+def _change_source_list_stats(cursor, ip_version, ip_id, list_type, amount):
+    """Change whitelisted or blacklisted count of every source which contains
+    ip address.
+
+    :param cursor: Cursor of MySQL database connection.
+    :type cursor: MySQLdb.cursors.Cursor.
+    :param ip_version: Version of ip address (4 or 6).
+    :type ip_version: int.
+    :param ip_id: Id of ip address.
+    :type ip_id: int.
+    :param list_type: 'whitelist' or 'blacklist'.
+    :type list_type: str.
+    :param amount: Number to add to count, negative to subtract.
+    :type amount: int.
+
+    """
+    if not amount:
+        return
+    sql = '''
+    UPDATE source_stats
+    JOIN source_to_addresses
+        ON source_stats.source_id = source_to_addresses.source_id
+    SET source_stats.{0}ed_count = source_stats.{0}ed_count + {1},
+        source_stats.last_updated = NOW()
+    WHERE source_to_addresses.v{2}_id = {3}'''.format(
+        list_type, int(amount), ip_version, ip_id
+    )
+    cursor.execute(sql)
+
+
+def rebuild_source_stats(connection, sourcename=None):
+    """Recompute source_stats table from sources, source_to_addresses and
+    list tables, used to repair statistics if they drift from real data.
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param sourcename: The name of source to rebuild, all sources if not set.
+    :type sourcename: str.
+    :returns: int -- number of affected rows in source_stats table.
+
+    """
+    joins_v4, in_whitelist_v4, in_blacklist_v4 = _list_joins(
+        4, 'source_to_addresses.v4_id', 'v4'
+    )
+    joins_v6, in_whitelist_v6, in_blacklist_v6 = _list_joins(
+        6, 'source_to_addresses.v6_id', 'v6'
+    )
+    sql = '''
+    REPLACE INTO source_stats (source_id, v4_count, v6_count,
+        whitelisted_count, blacklisted_count, last_updated)
+    SELECT sources.id,
+        COUNT(source_to_addresses.v4_id),
+        COUNT(source_to_addresses.v6_id),
+        COUNT(IF({0}, 1, NULL)) + COUNT(IF({1}, 1, NULL)),
+        COUNT(IF({2}, 1, NULL)) + COUNT(IF({3}, 1, NULL)),
+        NOW()
+    FROM sources
+    LEFT JOIN source_to_addresses
+        ON source_to_addresses.source_id = sources.id{4}{5}'''.format(
+        in_whitelist_v4, in_whitelist_v6, in_blacklist_v4, in_blacklist_v6,
+        joins_v4, joins_v6
+    )
+    if sourcename is not None:
+        sql += '''
+    WHERE sources.source_name = "%s"''' % sourcename
+    sql += '''
+    GROUP BY sources.id'''
+    cursor = connection.cursor()
+    try:
+        affected = cursor.execute(sql)
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug(
+        'Rebuilt statistics of source %s, affected rows: %s'
+        % (sourcename, affected)
+    )
+    return affected
+
+
+def get_source_stats(connection, sourcename):
+    """Get statistics of source from source_stats table
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param sourcename: The name of ip addresses source.
+    :type sourcename: str.
+    :returns: tuple -- number of v4 and v6 addresses, number of whitelisted
+    and blacklisted addresses and time of last update, None if there is no
+    such source.
+
+    """
+    sql = '''
+    SELECT source_stats.v4_count, source_stats.v6_count,
+        source_stats.whitelisted_count, source_stats.blacklisted_count,
+        source_stats.last_updated
+    FROM sources
+    JOIN source_stats ON source_stats.source_id = sources.id
+    WHERE sources.source_name = "%s"''' % sourcename
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql)
+        result = cursor.fetchone()
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug(
+        'Statistics of source "%s": %s' % (sourcename, result)
+    )
+    return result
@@ -1,9 +1,10 @@
 import unittest
 from datetime import datetime
 
-from netaddr import IPAddress
+import MySQLdb as mdb
 
 import dbapi
+from bulk_load import refresh_source
 from mysql_connector import get_database_connection
 from dbapi_exceptions import IPAddressError, SQLSyntaxError
 
@@ -18,7 +19,7 @@ class TestDBAPI(unittest.TestCase):
         self.assertEquals(dbapi.get_ip_data('192.168.1.15'), (3232235791, 4))
         self.assertEquals(
             dbapi.get_ip_data('fe80::200:5aee:feaa:20a2'),
-            (bin(IPAddress('fe80::200:5aee:feaa:20a2')), 6)
+            ('0xfe8000000000000002005aeefeaa20a2', 6)
         )
 
     def test_wrong_ip_format(self):
@@ -183,5 +184,364 @@ class TestDBAPI(unittest.TestCase):
             dbapi.check_if_ip_in_database(self.connection, '192.168.1.16')
         )
 
+    def test_get_ip_scores(self):
+        scores = dbapi.get_ip_scores(self.connection, min_score=5)
+        self.assertEquals(len(scores), 4)
+        self.assertEquals(scores[0][5], 7)
+        self.assertEquals(scores[-1][5], 5)
+
+    def test_get_ip_scores_with_top(self):
+        scores = dbapi.get_ip_scores(self.connection, top=1)
+        self.assertEquals(len(scores), 1)
+        self.assertEquals(scores[0][2], 16843009L)
+
+    def test_get_ip_score(self):
+        dbapi.refresh_ip_scores(self.connection)
+        self.assertEquals(
+            dbapi.get_ip_score(self.connection, '1.1.1.1'),
+            (1, 7, 7)
+        )
+        self.assertIsNone(
+            dbapi.get_ip_score(self.connection, '192.112.121.12')
+        )
+
+    def test_refresh_ip_scores_of_source(self):
+        dbapi.insert_ip_into_db(self.connection, '14.0.6.1')
+        try:
+            dbapi.insert_ip_into_source(self.connection, '14.0.6.1', 'test1')
+            dbapi.refresh_ip_scores(self.connection, 'test1')
+            self.assertEquals(
+                dbapi.get_ip_score(self.connection, '14.0.6.1')[0], 1
+            )
+            cursor = self.connection.cursor()
+            cursor.execute('''
+            DELETE source_to_addresses FROM source_to_addresses
+            JOIN ipv4_addresses
+                ON source_to_addresses.v4_id = ipv4_addresses.id
+            WHERE ipv4_addresses.address = %s''' % dbapi.get_ip_data(
+                '14.0.6.1'
+            )[0])
+            cursor.close()
+            # address unlinked from its only source loses its score
+            dbapi.refresh_ip_scores(self.connection, 'test1')
+            self.assertIsNone(
+                dbapi.get_ip_score(self.connection, '14.0.6.1')
+            )
+            dbapi.insert_ip_into_source(self.connection, '14.0.6.1', 'test1')
+            dbapi.insert_ip_into_source(self.connection, '14.0.6.1', 'test2')
+            dbapi.refresh_ip_scores(self.connection, 'test1')
+            self.assertEquals(
+                dbapi.get_ip_score(self.connection, '14.0.6.1')[0], 2
+            )
+            cursor = self.connection.cursor()
+            cursor.execute('''
+            DELETE source_to_addresses FROM source_to_addresses
+            JOIN sources ON source_to_addresses.source_id = sources.id
+            WHERE sources.source_name = "test1"
+            AND source_to_addresses.v4_id = %s''' % dbapi.find_ip_id(
+                self.connection, '14.0.6.1'
+            ))
+            cursor.close()
+            # refresh of other source recomputes unlinked address too
+            dbapi.refresh_ip_scores(self.connection, 'test2')
+            self.assertEquals(
+                dbapi.get_ip_score(self.connection, '14.0.6.1')[0], 1
+            )
+        finally:
+            dbapi.delete_ip(self.connection, '14.0.6.1')
+            dbapi.rebuild_source_stats(self.connection, 'test1')
+            dbapi.rebuild_source_stats(self.connection, 'test2')
+
+    def test_get_source_stats(self):
+        self.assertEquals(
+            dbapi.get_source_stats(self.connection, 'test2')[:4],
+            (2, 0, 2, 0)
+        )
+        self.assertIsNone(
+            dbapi.get_source_stats(self.connection, 'spam ham')
+        )
+
+    def test_rebuild_source_stats(self):
+        dbapi.rebuild_source_stats(self.connection)
+        self.assertEquals(
+            dbapi.get_source_stats(self.connection, 'test1')[:4],
+            (2, 0, 0, 2)
+        )
+
+    def test_find_ip_list_types(self):
+        self.assertEquals(
+            dbapi.find_ip_list_types(
+                self.connection,
+                ['192.168.1.1', '1.1.1.1', '192.112.121.12', '::1']
+            ),
+            {
+                '192.168.1.1': 'whitelist',
+                '1.1.1.1': 'blacklist',
+                '192.112.121.12': None,
+                '::1': None,
+            }
+        )
+
+    def test_list_membership(self):
+        dbapi.use_list_membership()
+        try:
+            self.assertEquals(
+                dbapi.find_ip_list_type(self.connection, '192.168.1.1'),
+                'whitelist'
+            )
+            self.assertEquals(
+                dbapi.find_ip_list_types(
+                    self.connection, ['1.1.1.1', '192.112.121.12']
+                ),
+                {'1.1.1.1': 'blacklist', '192.112.121.12': None}
+            )
+            dbapi.rebuild_source_stats(self.connection)
+            self.assertEquals(
+                dbapi.get_source_stats(self.connection, 'test1')[:4],
+                (2, 0, 0, 2)
+            )
+        finally:
+            dbapi.use_list_membership(False)
+
+    def test_delete_ips(self):
+        dbapi.insert_ip_into_db(self.connection, '14.0.0.1')
+        dbapi.insert_ip_into_db(self.connection, '14::1')
+        dbapi.insert_ip_into_list(self.connection, '14.0.0.1', 'blacklist')
+        self.assertEquals(
+            dbapi.delete_ips(
+                self.connection, ['14.0.0.1', '14::1', '14.0.0.2']
+            ),
+            2
+        )
+        self.assertFalse(
+            dbapi.check_if_ip_in_database(self.connection, '14.0.0.1')
+        )
+        self.assertFalse(
+            dbapi.check_if_ip_in_database(self.connection, '14::1')
+        )
+
+    def test_delete_ip_range(self):
+        for ip_address in ('14.0.1.1', '14.0.1.2', '14.0.2.1'):
+            dbapi.insert_ip_into_db(self.connection, ip_address)
+        dbapi.insert_ip_into_list(self.connection, '14.0.1.1', 'blacklist')
+        dbapi.delete_ip_range(self.connection, '14.0.1.0', '14.0.1.255')
+        self.assertEquals(
+            dbapi.get_ip_from_range(self.connection, '14.0.1.0',
+                                    '14.0.1.255'),
+            ()
+        )
+        self.assertTrue(
+            dbapi.check_if_ip_in_database(self.connection, '14.0.2.1')
+        )
+        dbapi.delete_ip(self.connection, '14.0.2.1')
+
+    def test_refresh_source(self):
+        # LOAD DATA needs local_infile=1 option in dbapi.cfg
+        dbapi.insert_new_source(self.connection, 'refreshed', 'None', 4)
+        ip_addresses = ['14.0.3.1', '14.0.3.2', '14.0.3.3', '14::3']
+        try:
+            refresh_source(self.connection, 'refreshed', ip_addresses[:2])
+            stats = refresh_source(
+                self.connection, 'refreshed', ip_addresses[1:]
+            )
+            self.assertEquals(
+                (stats[4]['added'], stats[4]['removed'], stats[6]['added']),
+                (1, 1, 1)
+            )
+            self.assertEquals(
+                dbapi.get_source_stats(self.connection, 'refreshed')[:4],
+                (2, 1, 0, 0)
+            )
+            self.assertEquals(
+                dbapi.get_ip_score(self.connection, '14.0.3.3'), (1, 4, 4)
+            )
+            # removed address stays in database without score
+            self.assertTrue(
+                dbapi.check_if_ip_in_database(self.connection, '14.0.3.1')
+            )
+            self.assertIsNone(
+                dbapi.get_ip_score(self.connection, '14.0.3.1')
+            )
+        finally:
+            refresh_source(self.connection, 'refreshed', [])
+            dbapi.delete_ips(self.connection, ip_addresses)
+            cursor = self.connection.cursor()
+            cursor.execute('''
+            DELETE source_stats FROM source_stats
+            JOIN sources ON source_stats.source_id = sources.id
+            WHERE sources.source_name = "refreshed"''')
+            cursor.execute(
+                'DELETE FROM sources WHERE source_name = "refreshed"'
+            )
+            cursor.close()
+
+    def test_cascade_delete(self):
+        # database must be migrated with sql/migrations/cascade_delete.sql
+        cursor = self.connection.cursor()
+        cursor.execute('''
+        SELECT DELETE_RULE FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE()
+        AND CONSTRAINT_NAME = "source_to_addresses_v4_id_fk"''')
+        rule = cursor.fetchone()
+        cursor.close()
+        if not rule or rule[0] != 'CASCADE':
+            self.skipTest('schema is not migrated to ON DELETE CASCADE')
+        ip_addresses = ['14.0.4.1', '14.0.4.2', '14::4']
+        for ip_address in ip_addresses:
+            dbapi.insert_ip_into_db(self.connection, ip_address)
+            dbapi.insert_ip_into_source(self.connection, ip_address, 'test1')
+        dbapi.insert_ip_into_list(self.connection, '14.0.4.1', 'blacklist')
+        dbapi.refresh_ip_scores(self.connection, 'test1')
+        dbapi.use_cascade_delete()
+        try:
+            dbapi.delete_ip(self.connection, '14.0.4.1')
+            self.assertEquals(
+                dbapi.delete_ips(self.connection, ip_addresses[1:]), 2
+            )
+        finally:
+            dbapi.use_cascade_delete(False)
+        for ip_address in ip_addresses:
+            self.assertFalse(
+                dbapi.check_if_ip_in_database(self.connection, ip_address)
+            )
+        self.assertEquals(
+            dbapi.get_source_stats(self.connection, 'test1')[:4],
+            (2, 0, 0, 2)
+        )
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT COUNT(*) FROM address_scores '
+                       'LEFT JOIN ipv4_addresses ON address_id = id '
+                       'WHERE address_version = 4 AND id IS NULL')
+        self.assertEquals(cursor.fetchone()[0], 0)
+        cursor.close()
+
+
+class FakeCursor(object):
+
+    rowcount = 1
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.executed = []
+        self.rows = []
+
+    def execute(self, sql):
+        self.executed.append(' '.join(sql.split()))
+        if self.fail_on is not None and \
+                self.fail_on in sql.replace('`', ''):
+            raise mdb.OperationalError('Lock wait timeout exceeded')
+        return 0
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, fail_on=None):
+        self.fake_cursor = FakeCursor(fail_on)
+        self.calls = []
+
+    def cursor(self):
+        return self.fake_cursor
+
+    def autocommit(self, enabled):
+        self.calls.append('autocommit(%s)' % enabled)
+
+    def commit(self):
+        self.calls.append('commit')
+
+    def rollback(self):
+        self.calls.append('rollback')
+
+
+class TestDeleteStatements(unittest.TestCase):
+
+    def deleted_tables(self, delete, *args):
+        connection = FakeConnection()
+        delete(connection, *args)
+        # table name follows DELETE in multi-table deletes, FROM otherwise
+        return [
+            sql.replace('DELETE FROM', 'DELETE').split()[1].strip('`')
+            for sql in connection.fake_cursor.executed
+            if sql.startswith('DELETE')
+        ]
+
+    def test_dependent_rows(self):
+        tables = ['source_to_addresses', 'whitelist', 'blacklist',
+                  'address_scores', 'ipv4_addresses']
+        self.assertEquals(
+            self.deleted_tables(dbapi.delete_ip, '14.0.0.1'), tables
+        )
+        self.assertEquals(
+            self.deleted_tables(dbapi.delete_ip_range, '14.0.0.1',
+                                '14.0.0.9'),
+            tables
+        )
+        self.assertEquals(
+            self.deleted_tables(dbapi.delete_ips, ['14.0.0.1']), tables
+        )
+
+    def test_cascade_delete(self):
+        dbapi.use_cascade_delete()
+        try:
+            self.assertEquals(
+                self.deleted_tables(dbapi.delete_ip, '14::1'),
+                ['ipv6_addresses']
+            )
+            self.assertEquals(
+                self.deleted_tables(dbapi.delete_ips, ['14.0.0.1', '14::1']),
+                ['ipv4_addresses', 'ipv6_addresses']
+            )
+        finally:
+            dbapi.use_cascade_delete(False)
+
+    def test_failed_delete_is_rolled_back(self):
+        for cascade in (False, True):
+            dbapi.use_cascade_delete(cascade)
+            try:
+                for delete, args in ((dbapi.delete_ip, ('14.0.0.1',)),
+                                     (dbapi.delete_ips, (['14.0.0.1'],)),
+                                     (dbapi.delete_ip_range,
+                                      ('14.0.0.1', '14.0.0.9'))):
+                    connection = FakeConnection('DELETE FROM ipv4_addresses')
+                    self.assertRaises(
+                        SQLSyntaxError, delete, connection, *args
+                    )
+                    # source statistics were updated before failed DELETE
+                    self.assertTrue(connection.fake_cursor.executed[0]
+                                    .startswith('UPDATE source_stats'))
+                    self.assertEquals(connection.calls, [
+                        'autocommit(0)', 'rollback', 'autocommit(1)'
+                    ])
+            finally:
+                dbapi.use_cascade_delete(False)
+
+
+class TestRefreshStatements(unittest.TestCase):
+
+    def test_source_refresh_is_limited_to_dirty_ids(self):
+        connection = FakeConnection()
+        connection.fake_cursor.rows = [(7,), (9,)]
+        dbapi.refresh_ip_scores(connection, 'test1', chunk_size=1)
+        deletes = [sql for sql in connection.fake_cursor.executed
+                   if sql.startswith('DELETE')]
+        self.assertEquals(len(deletes), 8)
+        for sql in deletes:
+            self.assertTrue(sql.endswith('address_id IN (7)') or
+                            sql.endswith('address_id IN (9)'), sql)
+
+    def test_full_refresh_clears_dirty_ids(self):
+        connection = FakeConnection()
+        dbapi.refresh_ip_scores(connection)
+        self.assertIn(
+            'DELETE FROM address_scores_dirty WHERE address_version = 6',
+            connection.fake_cursor.executed
+        )
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,73 @@
+"""Benchmark of address deletes per second: delete_ip on schema with
+ON DELETE NO ACTION foreign keys, delete_ip and batched delete_ips with
+dbapi.use_cascade_delete(). Database from dbapi.cfg must be migrated with
+sql/migrations/cascade_delete.sql and have at least one source. Addresses
+from 14.0.0.0/8 network are linked to first source, every second one is
+blacklisted, all of them are deleted by each run."""
+import time
+
+from netaddr import IPAddress
+
+import dbapi
+from mysql_connector import get_database_connection
+from transaction import Transaction
+
+FIRST_ADDRESS = IPAddress('14.0.0.0')
+ADDRESSES = 5000
+
+
+def benchmark_addresses():
+    return [str(FIRST_ADDRESS + offset) for offset in xrange(ADDRESSES)]
+
+
+def insert_benchmark_addresses(connection):
+    """Insert addresses with links and blacklist rows"""
+    ip_addresses = benchmark_addresses()
+    with Transaction(connection):
+        dbapi.insert_ips_into_db(connection, ip_addresses)
+        cursor = connection.cursor()
+        cursor.execute('''
+        INSERT INTO source_to_addresses (source_id, v4_id)
+        SELECT (SELECT MIN(id) FROM sources), id FROM ipv4_addresses
+        WHERE address BETWEEN %s AND %s''' % (
+            FIRST_ADDRESS.value, FIRST_ADDRESS.value + ADDRESSES
+        ))
+        cursor.close()
+        dbapi.insert_ips_into_list(
+            connection, ip_addresses[::2], 'blacklist'
+        )
+    dbapi.rebuild_source_stats(connection)
+
+
+def delete_one_by_one(connection):
+    for ip_address in benchmark_addresses():
+        dbapi.delete_ip(connection, ip_address)
+
+
+def delete_batched(connection):
+    dbapi.delete_ips(connection, benchmark_addresses())
+
+
+def main():
+    connection = get_database_connection('dbapi.cfg', 'MySQL settings')
+    runs = (
+        ('delete_ip', False, delete_one_by_one),
+        ('delete_ip cascade', True, delete_one_by_one),
+        ('delete_ips cascade', True, delete_batched),
+    )
+    try:
+        for name, cascade, run in runs:
+            insert_benchmark_addresses(connection)
+            dbapi.use_cascade_delete(cascade)
+            start = time.time()
+            run(connection)
+            elapsed = time.time() - start
+            print('%18s: %10.1f deletes/s' % (name, ADDRESSES / elapsed))
+    finally:
+        dbapi.use_cascade_delete(False)
+        dbapi.delete_ips(connection, benchmark_addresses())
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,523 @@
+"""Module implements streaming export and import of database. Sources and
+addresses of each version, with their list type and source names, are read
+through server side cursor and written to compressed NDJSON or CSV files in
+constant memory. Gzip is always available, zstd needs zstandard package
+(0.13 or newer). Each table goes to its own file:
+
+    sources.ndjson.gz   {"id", "source_name", "url", "source_date_added",
+                         "url_date_modified", "rank"}
+    ipv4.ndjson.gz      {"id", "address", "date_added", "list_type",
+                         "sources"}
+    ipv6.ndjson.gz      same as ipv4
+
+CSV files have the same columns, source names of address are separated by
+new lines. Every checkpoint_every rows compressed stream is ended and id of
+last written row and file size are saved in <file>.checkpoint, interrupted
+export continues from there. Import reloads files with multi-row inserts,
+rows which are already in database are skipped.
+
+    python export.py export dbapi.cfg backup --compression zstd
+    python export.py import dbapi.cfg backup
+
+:functions: export_table, export_database, read_records, import_table,
+import_database"""
+import csv
+import gzip
+import json
+import optparse
+import os
+import zlib
+
+import MySQLdb as mdb
+from netaddr import IPAddress
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+import dbapi
+from dbapi_exceptions import SQLSyntaxError
+from logging_conf import create_logger
+from mysql_connector import SessionVariable, get_database_connection
+from rows import decode_address
+from slow_query import server_side_cursor
+from transaction import Transaction
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+TABLES = ('sources', 'ipv4', 'ipv6')
+COLUMNS = {
+    'sources': ('id', 'source_name', 'url', 'source_date_added',
+                'url_date_modified', 'rank'),
+    'ipv4': ('id', 'address', 'date_added', 'list_type', 'sources'),
+    'ipv6': ('id', 'address', 'date_added', 'list_type', 'sources'),
+}
+EXTENSIONS = {'gzip': 'gz', 'zstd': 'zst'}
+READ_SIZE = 65536
+
+
+def export_filename(directory, table, file_format='ndjson',
+                    compression='gzip'):
+    """Return name of export file of table"""
+    return os.path.join(directory, '%s.%s.%s' % (
+        table, file_format, EXTENSIONS[compression]
+    ))
+
+
+def _compressor(compression):
+    """Return compressor object with compress and flush methods, output of
+    each compressor is a complete gzip member or zstd frame"""
+    if compression == 'gzip':
+        # wbits 31 writes gzip header and trailer
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if zstd is None:
+        raise Exception("zstd compression needs zstandard package")
+    return zstd.ZstdCompressor().compressobj()
+
+
+class _ExportWriter(object):
+    """Compressed output file that can be cut at checkpoints. Checkpoint
+    ends current gzip member or zstd frame, so file up to checkpoint offset
+    is complete, and next rows go to new member."""
+
+    def __init__(self, filename, compression, offset=0):
+        if offset:
+            self.file = open(filename, 'r+b')
+            # drop rows written after last checkpoint
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        else:
+            self.file = open(filename, 'wb')
+        self.compression = compression
+        self.compressor = _compressor(compression)
+
+    def write(self, data):
+        self.file.write(self.compressor.compress(data))
+
+    def checkpoint(self):
+        """End compressed stream, sync file and return its size"""
+        self.file.write(self.compressor.flush())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.compressor = _compressor(self.compression)
+        return self.file.tell()
+
+    def close(self):
+        offset = self.checkpoint()
+        self.file.close()
+        return offset
+
+
+def _read_checkpoint(filename):
+    try:
+        with open(filename + '.checkpoint') as checkpoint_file:
+            return json.load(checkpoint_file)
+    except IOError:
+        return None
+
+
+def _write_checkpoint(filename, checkpoint):
+    # checkpoint is replaced atomically, so it is never half written
+    with open(filename + '.checkpoint.tmp', 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.rename(filename + '.checkpoint.tmp', filename + '.checkpoint')
+
+
+def _format_date(value):
+    return value.isoformat() if value else None
+
+
+def _csv_value(value):
+    """Encode value for csv module, which does not accept unicode"""
+    if isinstance(value, list):
+        value = u'\n'.join(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _table_query(table, after_id):
+    """Return query of table rows with id greater than after_id"""
+    if table == 'sources':
+        return '''
+        SELECT id, source_name, url, source_date_added, url_date_modified,
+            rank
+        FROM sources
+        WHERE id > {0}
+        ORDER BY id'''.format(after_id)
+    ip_version = int(table[-1])
+    joins, in_whitelist, in_blacklist = _list_joins(ip_version)
+    return '''
+    SELECT ipv{0}_addresses.id, ipv{0}_addresses.address,
+        ipv{0}_addresses.date_added, MAX({2}), MAX({3}),
+        GROUP_CONCAT(DISTINCT sources.source_name SEPARATOR '\\n')
+    FROM ipv{0}_addresses{4}
+    LEFT JOIN source_to_addresses
+        ON source_to_addresses.v{0}_id = ipv{0}_addresses.id
+    LEFT JOIN sources ON sources.id = source_to_addresses.source_id
+    WHERE ipv{0}_addresses.id > {1}
+    GROUP BY ipv{0}_addresses.id
+    ORDER BY ipv{0}_addresses.id'''.format(
+        ip_version, after_id, in_whitelist, in_blacklist, joins
+    )
+
+
+def _list_joins(ip_version):
+    return dbapi._list_joins(ip_version, 'ipv%s_addresses.id' % ip_version)
+
+
+def _table_record(table, row):
+    """Convert table row to record with values that can be serialized"""
+    if table == 'sources':
+        return (row[0], row[1], row[2], _format_date(row[3]),
+                _format_date(row[4]), row[5])
+    ip_id, value, date_added, in_whitelist, in_blacklist, sources = row
+    return (
+        ip_id, decode_address(value), _format_date(date_added),
+        dbapi._list_type(in_whitelist, in_blacklist),
+        sources.split('\n') if sources else []
+    )
+
+
+def export_table(connection, directory, table, file_format='ndjson',
+                 compression='gzip', checkpoint_every=100000, resume=True,
+                 batch_size=10000):
+    """Stream table to compressed file
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param directory: Directory of export files.
+    :type directory: str.
+    :param table: 'sources', 'ipv4' or 'ipv6'.
+    :type table: str.
+    :param file_format: 'ndjson' or 'csv'.
+    :type file_format: str.
+    :param compression: 'gzip' or 'zstd'.
+    :type compression: str.
+    :param checkpoint_every: Number of rows between checkpoints.
+    :type checkpoint_every: int.
+    :param resume: Continue from checkpoint of earlier export if there is
+    one, start again otherwise.
+    :type resume: bool.
+    :param batch_size: Number of rows fetched from server at once.
+    :type batch_size: int.
+    :returns: dict -- checkpoint with 'last_id', 'offset', 'rows' and
+    'complete' keys.
+
+    """
+    filename = export_filename(directory, table, file_format, compression)
+    checkpoint = resume and _read_checkpoint(filename) or {
+        'last_id': 0, 'offset': 0, 'rows': 0, 'complete': False
+    }
+    if checkpoint['complete']:
+        return checkpoint
+    columns = COLUMNS[table]
+    writer = _ExportWriter(filename, compression, checkpoint['offset'])
+    csv_writer = None
+    if file_format == 'csv':
+        csv_writer = csv.writer(writer, lineterminator='\n')
+        if not checkpoint['offset']:
+            csv_writer.writerow(columns)
+    try:
+        # source names of one address are returned as one string, server
+        # side cursor is closed before session variable is restored
+        with SessionVariable(connection, 'group_concat_max_len', 1048576):
+            cursor = connection.cursor(server_side_cursor())
+            try:
+                _export_rows(cursor, table, checkpoint, batch_size,
+                             checkpoint_every, filename, writer, csv_writer)
+            finally:
+                cursor.close()
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        offset = writer.close()
+    checkpoint['offset'] = offset
+    checkpoint['complete'] = True
+    _write_checkpoint(filename, checkpoint)
+    MODULE_LOGGER.debug('Exported %s to %s: %s'
+                        % (table, filename, checkpoint))
+    return checkpoint
+
+
+def _export_rows(cursor, table, checkpoint, batch_size, checkpoint_every,
+                 filename, writer, csv_writer=None):
+    """Write rows of table after checkpoint to export file, as csv if
+    csv_writer is set, else as ndjson"""
+    columns = COLUMNS[table]
+    cursor.execute(_table_query(table, checkpoint['last_id']))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            record = _table_record(table, row)
+            if csv_writer is not None:
+                csv_writer.writerow([_csv_value(value) for value in record])
+            else:
+                writer.write(json.dumps(dict(zip(columns, record))))
+                writer.write('\n')
+            checkpoint['rows'] += 1
+            checkpoint['last_id'] = record[0]
+            if checkpoint['rows'] % checkpoint_every == 0:
+                checkpoint['offset'] = writer.checkpoint()
+                _write_checkpoint(filename, checkpoint)
+
+
+def export_database(connection, directory, file_format='ndjson',
+                    compression='gzip', checkpoint_every=100000,
+                    resume=True):
+    """Export all tables, see export_table for parameters
+
+    :returns: dict -- checkpoint of each table.
+
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return dict(
+        (table, export_table(connection, directory, table, file_format,
+                             compression, checkpoint_every, resume))
+        for table in TABLES
+    )
+
+
+def _split_lines(chunks):
+    """Generate lines of text given in chunks of any size"""
+    tail = ''
+    for chunk in chunks:
+        lines = (tail + chunk).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if tail:
+        yield tail
+
+
+def _zstd_chunks(export_file):
+    if zstd is None:
+        raise Exception("zstd compression needs zstandard package")
+    reader = zstd.ZstdDecompressor().stream_reader(
+        export_file, read_across_frames=True
+    )
+    while True:
+        chunk = reader.read(READ_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _parse_filename(filename):
+    """Return table, format and compression from name of export file"""
+    table, file_format, extension = \
+        os.path.basename(filename).rsplit('.', 2)
+    compressions = dict(
+        (value, key) for key, value in EXTENSIONS.items()
+    )
+    return table, file_format, compressions[extension]
+
+
+def read_records(filename):
+    """Generate records of export file as dicts, table, format and
+    compression are taken from file name. All gzip members or zstd frames
+    of file are read in turn.
+
+    :param filename: Name of file written by export_table.
+    :type filename: str.
+    :returns: generator -- dicts with COLUMNS of table as keys.
+
+    """
+    table, file_format, compression = _parse_filename(filename)
+    columns = COLUMNS[table]
+    with open(filename, 'rb') as export_file:
+        if compression == 'gzip':
+            # GzipFile reads concatenated members as one stream
+            lines = gzip.GzipFile(fileobj=export_file)
+        else:
+            lines = _split_lines(_zstd_chunks(export_file))
+        if file_format == 'csv':
+            reader = csv.reader(lines)
+            header = next(reader, None)
+            if header is not None and tuple(header) != columns:
+                raise Exception("Unexpected columns %s in %s"
+                                % (header, filename))
+            for values in reader:
+                record = dict(zip(columns, [
+                    value.decode('utf-8') or None for value in values
+                ]))
+                record['id'] = int(record['id'])
+                if table == 'sources':
+                    record['rank'] = int(record['rank'])
+                else:
+                    sources = record['sources']
+                    record['sources'] = sources.split('\n') if sources \
+                        else []
+                yield record
+        else:
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _sql_date(value):
+    return '"%s"' % value if value else 'NULL'
+
+
+def _import_sources(cursor, records):
+    for record in records:
+        # sources are matched by name, existing ones are kept as they are
+        cursor.execute('''
+        INSERT INTO sources
+            (source_name, url, source_date_added, url_date_modified, rank)
+        SELECT %s, %s, %s, %s, %s FROM DUAL
+        WHERE NOT EXISTS (
+            SELECT 1 FROM sources WHERE source_name = %s
+        )''', (record['source_name'], record['url'],
+               record['source_date_added'], record['url_date_modified'],
+               record['rank'], record['source_name']))
+
+
+def _import_addresses(connection, cursor, ip_version, records):
+    sql_values = [
+        dbapi.get_ip_data(record['address'])[0] for record in records
+    ]
+    cursor.execute('''
+    INSERT IGNORE INTO ipv{0}_addresses (address, date_added)
+    VALUES {1}'''.format(ip_version, ', '.join(
+        '(%s, %s)' % (sql_value, _sql_date(record['date_added']))
+        for sql_value, record in zip(sql_values, records)
+    )))
+    dbapi.notify_inserted(ip_version, [
+        IPAddress(record['address']).value for record in records
+    ])
+    by_source = {}
+    for sql_value, record in zip(sql_values, records):
+        for sourcename in record['sources']:
+            by_source.setdefault(sourcename, []).append(str(sql_value))
+    for sourcename, values in by_source.items():
+        # links which are already in database are not duplicated
+        cursor.execute('''
+        INSERT INTO source_to_addresses (source_id, v{0}_id)
+        SELECT sources.id, ipv{0}_addresses.id
+        FROM ipv{0}_addresses
+        JOIN sources ON sources.source_name = %s
+        LEFT JOIN source_to_addresses AS existing
+            ON existing.source_id = sources.id
+            AND existing.v{0}_id = ipv{0}_addresses.id
+        WHERE ipv{0}_addresses.address IN ({1})
+            AND existing.source_id IS NULL'''.format(
+            ip_version, ', '.join(values)
+        ), (sourcename,))
+    for list_type in ('whitelist', 'blacklist'):
+        listed = [
+            record['address'] for record in records
+            if record['list_type'] == list_type
+        ]
+        if listed:
+            dbapi.insert_ips_into_list(connection, listed, list_type)
+
+
+def import_table(connection, filename, batch_size=5000):
+    """Load export file in database. Each batch of records is inserted in
+    one transaction, rows which are already in database are skipped, so
+    interrupted import can be run again. Ids of exported rows are not kept,
+    addresses are linked to sources by source name. Statistics of sources
+    and scores of addresses are not updated, see import_database.
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param filename: Name of file written by export_table.
+    :type filename: str.
+    :param batch_size: Number of records inserted at once.
+    :type batch_size: int.
+    :returns: int -- number of records read.
+
+    """
+    table = _parse_filename(filename)[0]
+    count = 0
+    records = read_records(filename)
+    while True:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                break
+        if not batch:
+            break
+        with Transaction(connection):
+            cursor = connection.cursor()
+            try:
+                if table == 'sources':
+                    _import_sources(cursor, batch)
+                else:
+                    _import_addresses(
+                        connection, cursor, int(table[-1]), batch
+                    )
+            except mdb.ProgrammingError as mdb_error:
+                MODULE_LOGGER.error(mdb_error.message)
+                raise SQLSyntaxError
+            finally:
+                cursor.close()
+        count += len(batch)
+    MODULE_LOGGER.debug('Imported %s records from %s' % (count, filename))
+    return count
+
+
+def import_database(connection, directory, file_format='ndjson',
+                    compression='gzip', batch_size=5000):
+    """Load all export files of directory, sources first, then rebuild
+    statistics of sources and scores of addresses
+
+    :returns: dict -- number of records read from each table.
+
+    """
+    counts = dict(
+        (table, import_table(
+            connection,
+            export_filename(directory, table, file_format, compression),
+            batch_size
+        ))
+        for table in TABLES
+    )
+    dbapi.rebuild_source_stats(connection)
+    dbapi.refresh_ip_scores(connection)
+    return counts
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog export|import CONFIG DIRECTORY [options]'
+    )
+    parser.add_option('--format', dest='file_format', default='ndjson',
+                      choices=['ndjson', 'csv'])
+    parser.add_option('--compression', default='gzip',
+                      choices=sorted(EXTENSIONS))
+    parser.add_option('--checkpoint-every', type='int', default=100000)
+    parser.add_option('--restart', action='store_true', default=False,
+                      help='ignore checkpoints of earlier export')
+    options, args = parser.parse_args()
+    if len(args) != 3 or args[0] not in ('export', 'import'):
+        parser.error('expected export|import CONFIG DIRECTORY')
+    command, config, directory = args
+    connection = get_database_connection(config, 'MySQL settings')
+    try:
+        if command == 'export':
+            result = export_database(
+                connection, directory, options.file_format,
+                options.compression, options.checkpoint_every,
+                not options.restart
+            )
+        else:
+            result = import_database(
+                connection, directory, options.file_format,
+                options.compression
+            )
+    finally:
+        connection.close()
+    for table in TABLES:
+        print('%s: %s' % (table, result[table]))
+
+
+if __name__ == '__main__':
+    main()
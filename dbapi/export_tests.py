@@ -0,0 +1,230 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+import dbapi
+import export
+from export import export_filename, export_table, read_records
+from mysql_connector import get_database_connection
+
+
+class FakeCursor(object):
+
+    def __init__(self, rows, fail_after=None, session=None):
+        self.rows = rows
+        self.fail_after = fail_after
+        self.fetched = 0
+        self.session = session
+
+    def execute(self, sql):
+        if sql.startswith('SET SESSION'):
+            self.session.append(sql)
+        after_id = re.search(r'id > (\d+)', sql)
+        if after_id:
+            self.result = [
+                row for row in self.rows if row[0] > int(after_id.group(1))
+            ]
+
+    def fetchmany(self, size):
+        if self.fail_after is not None and self.fetched >= self.fail_after:
+            raise IOError('connection lost')
+        rows = self.result[:1]
+        self.result = self.result[1:]
+        self.fetched += len(rows)
+        return rows
+
+    def fetchall(self):
+        # previous value of session variable
+        return [(1024,)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, rows, fail_after=None):
+        self.rows = rows
+        self.fail_after = fail_after
+        self.session = []
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self.rows, self.fail_after, self.session)
+
+
+IPV4_ROWS = [
+    (1, 167772161, date(2013, 7, 1), None, 1, 'spam\nham'),
+    (2, 167772162, date(2013, 7, 2), 1, None, None),
+    (3, 167772163, None, None, None, u'\u0161pam'),
+    (4, 167772164, date(2013, 7, 4), None, None, 'spam'),
+    (5, 167772165, date(2013, 7, 5), None, None, 'ham'),
+]
+IPV6_ROWS = [
+    (7, '\xfe\x80' + '\x00' * 13 + '\x01', date(2013, 7, 1), None, None,
+     'spam'),
+]
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def records(self, table, file_format='ndjson', compression='gzip'):
+        return list(read_records(export_filename(
+            self.directory, table, file_format, compression
+        )))
+
+    def test_ndjson(self):
+        checkpoint = export_table(
+            FakeConnection(IPV4_ROWS), self.directory, 'ipv4'
+        )
+        self.assertEquals(checkpoint['rows'], 5)
+        self.assertTrue(checkpoint['complete'])
+        records = self.records('ipv4')
+        self.assertEquals(records[0], {
+            'id': 1, 'address': '10.0.0.1', 'date_added': '2013-07-01',
+            'list_type': 'blacklist', 'sources': ['spam', 'ham']
+        })
+        self.assertEquals(records[1]['list_type'], 'whitelist')
+        self.assertEquals(records[1]['sources'], [])
+        self.assertEquals(records[2]['date_added'], None)
+        export_table(FakeConnection(IPV6_ROWS), self.directory, 'ipv6')
+        self.assertEquals(self.records('ipv6')[0]['address'], 'fe80::1')
+
+    def test_session_variable_is_restored(self):
+        connection = FakeConnection(IPV4_ROWS, fail_after=3)
+        self.assertRaises(IOError, export_table, connection,
+                          self.directory, 'ipv4')
+        self.assertEquals(connection.session, [
+            'SET SESSION group_concat_max_len = 1048576',
+            'SET SESSION group_concat_max_len = 1024',
+        ])
+
+    def test_csv(self):
+        export_table(FakeConnection(IPV4_ROWS), self.directory, 'ipv4',
+                     file_format='csv')
+        records = self.records('ipv4', 'csv')
+        self.assertEquals(len(records), 5)
+        self.assertEquals(records[0]['sources'], ['spam', 'ham'])
+        self.assertEquals(records[1]['sources'], [])
+        self.assertEquals(records[2]['sources'], [u'\u0161pam'])
+        self.assertEquals(records[2]['date_added'], None)
+        self.assertEquals(records[4]['id'], 5)
+
+    def test_resume(self):
+        for file_format in ('ndjson', 'csv'):
+            self.assertRaises(
+                IOError, export_table,
+                FakeConnection(IPV4_ROWS, fail_after=3), self.directory,
+                'ipv4', file_format=file_format, checkpoint_every=2
+            )
+            checkpoint = export_table(
+                FakeConnection(IPV4_ROWS), self.directory, 'ipv4',
+                file_format=file_format, checkpoint_every=2
+            )
+            self.assertEquals(checkpoint['rows'], 5)
+            # third row written before failure is not repeated
+            self.assertEquals(
+                [record['id'] for record in
+                 self.records('ipv4', file_format)],
+                [1, 2, 3, 4, 5]
+            )
+
+    def test_complete_export_is_kept(self):
+        export_table(FakeConnection(IPV4_ROWS), self.directory, 'ipv4')
+        export_table(FakeConnection([]), self.directory, 'ipv4')
+        self.assertEquals(len(self.records('ipv4')), 5)
+        export_table(FakeConnection([]), self.directory, 'ipv4',
+                     resume=False)
+        self.assertEquals(self.records('ipv4'), [])
+
+    @unittest.skipIf(export.zstd is None, 'zstandard is not installed')
+    def test_zstd(self):
+        export_table(FakeConnection(IPV4_ROWS), self.directory, 'ipv4',
+                     compression='zstd', checkpoint_every=2)
+        filename = export_filename(self.directory, 'ipv4', 'ndjson', 'zstd')
+        self.assertTrue(os.path.exists(filename))
+        self.assertEquals(
+            [record['id'] for record in self.records('ipv4', 'ndjson',
+                                                     'zstd')],
+            [1, 2, 3, 4, 5]
+        )
+
+
+class RoundTripTest(unittest.TestCase):
+
+    ADDRESSES = ['14.0.5.1', '14.0.5.2', '14::5']
+
+    def setUp(self):
+        self.connection = get_database_connection('dbapi.cfg',
+                                                  'MySQL settings')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        self.connection.close()
+
+    def delete_exported(self):
+        dbapi.delete_ips(self.connection, self.ADDRESSES)
+        cursor = self.connection.cursor()
+        cursor.execute('''
+        DELETE source_stats FROM source_stats
+        JOIN sources ON source_stats.source_id = sources.id
+        WHERE sources.source_name = "exported"''')
+        cursor.execute('DELETE FROM sources WHERE source_name = "exported"')
+        cursor.close()
+
+    def test_round_trip(self):
+        dbapi.insert_new_source(self.connection, 'exported', 'None', 5)
+        try:
+            for ip_address in self.ADDRESSES:
+                dbapi.insert_ip_into_db(self.connection, ip_address)
+            dbapi.insert_ip_into_source(self.connection, '14.0.5.1',
+                                        'exported')
+            dbapi.insert_ip_into_source(self.connection, '14::5', 'exported')
+            dbapi.insert_ip_into_list(self.connection, '14.0.5.2',
+                                      'whitelist')
+            dbapi.insert_ip_into_list(self.connection, '14::5', 'blacklist')
+            export.export_database(self.connection, self.directory)
+            self.delete_exported()
+            export.import_database(self.connection, self.directory)
+            for ip_address in self.ADDRESSES:
+                self.assertTrue(
+                    dbapi.check_if_ip_in_database(self.connection, ip_address)
+                )
+            self.assertEquals(
+                dbapi.get_source_by_sourcename(self.connection,
+                                               'exported')[5],
+                5
+            )
+            for ip_address, sourcenames in (('14.0.5.1', (('exported',),)),
+                                            ('14.0.5.2', ()),
+                                            ('14::5', (('exported',),))):
+                self.assertEquals(
+                    dbapi.get_sourcename_list_with_ip(self.connection,
+                                                      ip_address),
+                    sourcenames
+                )
+            for ip_address, list_type in (('14.0.5.1', None),
+                                          ('14.0.5.2', 'whitelist'),
+                                          ('14::5', 'blacklist')):
+                self.assertEquals(
+                    dbapi.find_ip_list_type(self.connection, ip_address),
+                    list_type
+                )
+            self.assertEquals(
+                dbapi.get_ip_score(self.connection, '14::5'), (1, 5, 5)
+            )
+        finally:
+            self.delete_exported()
+
+
+if __name__ == '__main__':
+    unittest.main()
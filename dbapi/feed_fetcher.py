@@ -0,0 +1,288 @@
+"""Module implements concurrent fetching of source feeds. Sources with url
+are downloaded by bounded pool of worker threads, sources with higher rank
+are fetched first. ETag and Last-Modified of last download are kept in
+source_fetch_state table and sent back as conditional request headers, so
+unchanged feeds are skipped. Response body is streamed line by line into
+bulk_load.refresh_source without reading whole feed in memory. Fetcher
+settings are in [Feed fetcher] section:
+
+    [Feed fetcher]
+    workers=4
+    timeout=30
+    min_interval=3600
+
+    python feed_fetcher.py dbapi.cfg
+
+:classes: FeedSource, FeedFetcher
+:functions: get_due_sources, save_fetch_state, open_feed, feed_lines"""
+import itertools
+import sys
+import urllib2
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+import MySQLdb as mdb
+
+from bulk_load import refresh_source
+from config_parser import get_section_settings
+from dbapi_exceptions import SQLSyntaxError
+from feed_import import read_chunks
+from logging_conf import create_logger
+from pooling import create_pool
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+FETCHER_DEFAULTS = {
+    'workers': '4',
+    'timeout': '30',
+    'min_interval': '0',
+}
+
+FeedSource = namedtuple(
+    'FeedSource', 'id name url rank etag last_modified'
+)
+
+
+def get_due_sources(connection, min_interval=None):
+    """Get sources with url which should be fetched, highest rank first
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param min_interval: Seconds since last fetch after which source is due,
+    all sources are due if not set. Sources which got no response or
+    failed to refresh last time are always due.
+    :type min_interval: int.
+    :returns: list -- FeedSource for each due source.
+
+    """
+    sql = '''
+    SELECT sources.id, sources.source_name, sources.url, sources.rank,
+        source_fetch_state.etag, source_fetch_state.last_modified
+    FROM sources
+    LEFT JOIN source_fetch_state
+        ON source_fetch_state.source_id = sources.id
+    WHERE sources.url IS NOT NULL AND sources.url != ""'''
+    if min_interval:
+        sql += '''
+    AND (source_fetch_state.last_fetched IS NULL
+        OR source_fetch_state.last_status = 0
+        OR source_fetch_state.last_fetched
+            < NOW() - INTERVAL %s SECOND)''' % int(min_interval)
+    sql += '''
+    ORDER BY sources.rank DESC, sources.id'''
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql)
+        result = [FeedSource(*row) for row in cursor.fetchall()]
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug('Found %s sources to fetch' % len(result))
+    return result
+
+
+def save_fetch_state(connection, source_id, status, etag=None,
+                     last_modified=None):
+    """Remember result of source fetch
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param source_id: Id of fetched source.
+    :type source_id: int.
+    :param status: HTTP status of response, 0 if there was no response.
+    :type status: int.
+    :param etag: ETag header of last downloaded feed.
+    :type etag: str.
+    :param last_modified: Last-Modified header of last downloaded feed.
+    :type last_modified: str.
+
+    """
+    cursor = connection.cursor()
+    try:
+        # validators of last downloaded feed are kept when fetch fails or
+        # feed is not modified
+        cursor.execute('''
+        INSERT INTO source_fetch_state
+            (source_id, etag, last_modified, last_fetched, last_status)
+        VALUES (%s, %s, %s, NOW(), %s)
+        ON DUPLICATE KEY UPDATE
+            etag = IFNULL(VALUES(etag), etag),
+            last_modified = IFNULL(VALUES(last_modified), last_modified),
+            last_fetched = VALUES(last_fetched),
+            last_status = VALUES(last_status)''',
+                       (source_id, etag, last_modified, status))
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+
+
+def open_feed(source, timeout=30):
+    """Send conditional request for source feed
+
+    :param source: Source to fetch.
+    :type source: FeedSource.
+    :param timeout: Socket timeout in seconds.
+    :type timeout: float.
+    :returns: response -- file-like object with feed, None if feed is not
+    modified since last fetch.
+    :raises: urllib2.URLError
+
+    """
+    request = urllib2.Request(source.url)
+    if source.etag:
+        request.add_header('If-None-Match', source.etag)
+    if source.last_modified:
+        request.add_header('If-Modified-Since', source.last_modified)
+    try:
+        return urllib2.urlopen(request, timeout=timeout)
+    except urllib2.HTTPError as error:
+        if error.code == 304:
+            return None
+        raise
+
+
+def feed_lines(response, chunk_size=1000):
+    """Generate addresses from feed response as it is read, empty lines and
+    comments are skipped"""
+    return itertools.chain.from_iterable(read_chunks(response, chunk_size))
+
+
+class FeedFetcher(object):
+    """Fetches due sources in worker threads and refreshes their addresses
+
+        fetcher = FeedFetcher(mysql_pool, workers=8)
+        fetcher.run()
+
+    Pool connections must have local_infile option, it is needed by
+    refresh_source.
+
+    """
+
+    def __init__(self, mysql_pool, workers=4, timeout=30, min_interval=None,
+                 refresh=refresh_source):
+        """
+        :param mysql_pool: Pool of database connections.
+        :type mysql_pool: sqlalchemy.pool.QueuePool.
+        :param workers: Number of feeds fetched at once.
+        :type workers: int.
+        :param timeout: Socket timeout of feed requests in seconds.
+        :type timeout: float.
+        :param min_interval: Seconds after which fetched source is due again.
+        :type min_interval: int.
+        :param refresh: Function which takes connection, source name and
+        iterable of addresses and replaces addresses of source.
+        :type refresh: function.
+
+        """
+        self.mysql_pool = mysql_pool
+        self.workers = workers
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.refresh = refresh
+
+    def fetch(self, source):
+        """Fetch one source and refresh its addresses if feed changed
+
+        :param source: Source to fetch.
+        :type source: FeedSource.
+        :returns: dict -- source name, status 'modified', 'not modified' or
+        'failed' and result of refresh.
+
+        """
+        result = {'source': source.name, 'status': 'failed'}
+        status = 0
+        etag = last_modified = None
+        try:
+            connection = self.mysql_pool.connect()
+        except Exception as error:
+            MODULE_LOGGER.error('Fetching %s failed: %s' % (source.url, error))
+            return result
+        try:
+            try:
+                response = open_feed(source, self.timeout)
+                if response is None:
+                    status = 304
+                    result['status'] = 'not modified'
+                else:
+                    try:
+                        result['stats'] = self.refresh(
+                            connection, source.name, feed_lines(response)
+                        )
+                    finally:
+                        response.close()
+                    # failed refresh is saved with status 0
+                    status = response.getcode()
+                    etag = response.info().getheader('ETag')
+                    last_modified = response.info().getheader(
+                        'Last-Modified'
+                    )
+                    result['status'] = 'modified'
+            except urllib2.HTTPError as error:
+                status = error.code
+                MODULE_LOGGER.error(
+                    'Fetching %s failed: %s' % (source.url, error)
+                )
+            except Exception as error:
+                # failed feed doesn't stop fetching of other feeds, errors
+                # are broken connections, bad feeds or sources deleted
+                # while they were fetched
+                MODULE_LOGGER.error(
+                    'Fetching %s failed: %s' % (source.url, error)
+                )
+            try:
+                save_fetch_state(
+                    connection, source.id, status, etag, last_modified
+                )
+            except Exception as error:
+                MODULE_LOGGER.error('Saving fetch state of %s failed: %s'
+                                    % (source.name, error))
+        finally:
+            connection.close()
+        MODULE_LOGGER.debug('Fetched source %s: %s' % (source.name, result))
+        return result
+
+    def run(self, sources=None):
+        """Fetch sources concurrently, highest rank first
+
+        :param sources: Sources to fetch, due sources from database if not
+        set.
+        :type sources: list.
+        :returns: list -- results of fetch for each source.
+
+        """
+        if sources is None:
+            connection = self.mysql_pool.connect()
+            try:
+                sources = get_due_sources(connection, self.min_interval)
+            finally:
+                connection.close()
+        sources = sorted(sources, key=lambda source: -source.rank)
+        threads = ThreadPool(self.workers)
+        try:
+            # tasks are started in order of submission
+            return threads.map(self.fetch, sources, chunksize=1)
+        finally:
+            threads.terminate()
+            threads.join()
+
+
+def main():
+    config = sys.argv[1] if len(sys.argv) > 1 else 'dbapi.cfg'
+    settings = dict(FETCHER_DEFAULTS)
+    settings.update(get_section_settings(config, 'Feed fetcher'))
+    fetcher = FeedFetcher(
+        create_pool(config),
+        int(settings['workers']),
+        float(settings['timeout']),
+        int(settings['min_interval'])
+    )
+    for result in fetcher.run():
+        print('%(source)s: %(status)s' % result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import threading
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from feed_fetcher import FeedFetcher, FeedSource, feed_lines, open_feed
+
+FEED = '# test feed\n192.168.1.1\n\n10.0.0.1\nfe80::1\n'
+ETAG = '"v1"'
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Stand-in feed server, /feed supports ETag, /missing is 404"""
+
+    def do_GET(self):
+        if self.path != '/feed':
+            self.send_error(404)
+            return
+        if self.headers.getheader('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(FEED)))
+        self.end_headers()
+        self.wfile.write(FEED)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeCursor(object):
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execute(self, sql, args=None):
+        self.statements.append(args)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def cursor(self):
+        return FakeCursor(self.statements)
+
+    def close(self):
+        pass
+
+
+class FakePool(object):
+
+    def __init__(self):
+        self.statements = []
+
+    def connect(self):
+        return FakeConnection(self.statements)
+
+
+class FeedFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('localhost', 0), FeedHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://localhost:%s' % self.server.server_address[1]
+        self.refreshed = []
+        self.pool = FakePool()
+        self.fetcher = FeedFetcher(self.pool, workers=1, refresh=self.refresh)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def refresh(self, connection, sourcename, ip_addresses):
+        if sourcename == 'deleted':
+            raise Exception("There is no source %s" % sourcename)
+        self.refreshed.append((sourcename, list(ip_addresses)))
+        return {}
+
+    def source(self, name, path, rank=5, etag=None):
+        return FeedSource(1, name, self.url + path, rank, etag, None)
+
+    def test_feed_lines(self):
+        response = open_feed(self.source('test', '/feed'))
+        self.assertEquals(
+            list(feed_lines(response)),
+            ['192.168.1.1', '10.0.0.1', 'fe80::1']
+        )
+
+    def test_conditional_request(self):
+        self.assertIsNone(open_feed(self.source('test', '/feed', etag=ETAG)))
+
+    def test_fetch(self):
+        result = self.fetcher.fetch(self.source('test', '/feed'))
+        self.assertEquals(result['status'], 'modified')
+        self.assertEquals(
+            self.refreshed,
+            [('test', ['192.168.1.1', '10.0.0.1', 'fe80::1'])]
+        )
+        # source id, status, etag and last modified are saved
+        self.assertEquals(self.pool.statements, [(1, ETAG, None, 200)])
+
+    def test_fetch_not_modified(self):
+        result = self.fetcher.fetch(self.source('test', '/feed', etag=ETAG))
+        self.assertEquals(result['status'], 'not modified')
+        self.assertEquals(self.refreshed, [])
+        self.assertEquals(self.pool.statements, [(1, None, None, 304)])
+
+    def test_run_by_rank(self):
+        results = self.fetcher.run([
+            self.source('low', '/feed', rank=1),
+            self.source('missing', '/missing', rank=5),
+            self.source('high', '/feed', rank=9),
+        ])
+        self.assertEquals(
+            [(result['source'], result['status']) for result in results],
+            [('high', 'modified'), ('missing', 'failed'),
+             ('low', 'modified')]
+        )
+        self.assertEquals(
+            [sourcename for sourcename, _ in self.refreshed], ['high', 'low']
+        )
+
+    def test_unexpected_error_fails_only_its_source(self):
+        results = self.fetcher.run([
+            self.source('deleted', '/feed', rank=9),
+            self.source('low', '/feed', rank=1),
+        ])
+        self.assertEquals(
+            [(result['source'], result['status']) for result in results],
+            [('deleted', 'failed'), ('low', 'modified')]
+        )
+        # fetch state is saved for failed source too, without status and
+        # validators, so source is fetched again on next run
+        self.assertEquals(
+            sorted(self.pool.statements),
+            [(1, None, None, 0), (1, ETAG, None, 200)]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
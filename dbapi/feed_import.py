@@ -0,0 +1,172 @@
+"""Module implements streaming import of ip address feeds. Import runs in three
+stages: lines are read and split in chunks, chunks are parsed and normalized
+by pool of worker processes into packed arrays of v4 and v6 addresses, parsed
+chunks are written to database by writer threads with pooled connections.
+Number of chunks in flight is limited, so memory stays bounded for feeds of
+any size.
+:functions: parse_chunk, write_chunk, import_feed, import_feed_file"""
+from array import array
+from binascii import hexlify
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+from netaddr import IPAddress
+from netaddr.core import AddrFormatError
+
+import dbapi
+from logging_conf import create_logger
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+
+def read_chunks(lines, chunk_size):
+    """Split iterable of feed lines in lists of chunk_size addresses,
+    empty lines and comments starting with '#' are skipped"""
+    chunk = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_chunk(lines):
+    """Parse chunk of feed lines, runs in worker process
+
+    :param lines: ip addresses in string form.
+    :type lines: list.
+    :returns: tuple -- array of v4 address values, string of packed 16-byte
+    v6 addresses and number of invalid lines.
+
+    """
+    v4_values = array('I')
+    v6_values = []
+    invalid = 0
+    for line in lines:
+        try:
+            ip = IPAddress(line)
+        except (AddrFormatError, ValueError):
+            invalid += 1
+            continue
+        if ip.version == 4:
+            v4_values.append(ip.value)
+        else:
+            v6_values.append(ip.packed)
+    return v4_values, ''.join(v6_values), invalid
+
+
+def _v6_sql_value(packed):
+    """Convert packed v6 address to hex literal of its 16 bytes"""
+    return '0x' + hexlify(packed)
+
+
+def write_chunk(mysql_pool, parsed_chunk):
+    """Insert parsed chunk in database with multi-row inserts, addresses
+    which are already in database are skipped
+
+    :param mysql_pool: Pool of database connections.
+    :type mysql_pool: sqlalchemy.pool.QueuePool.
+    :param parsed_chunk: Result of parse_chunk.
+    :type parsed_chunk: tuple.
+
+    """
+    v4_values, v6_packed, _ = parsed_chunk
+    sql = '''
+    INSERT IGNORE INTO ipv{0}_addresses (address, date_added)
+    VALUES {1}'''
+    connection = mysql_pool.connect()
+    cursor = connection.cursor()
+    try:
+        if v4_values:
+            cursor.execute(sql.format(4, ', '.join(
+                '(%s, CURDATE())' % value for value in v4_values
+            )))
+        if v6_packed:
+            cursor.execute(sql.format(6, ', '.join(
+                '(%s, CURDATE())' % _v6_sql_value(v6_packed[i:i + 16])
+                for i in xrange(0, len(v6_packed), 16)
+            )))
+    finally:
+        cursor.close()
+        connection.close()
+    dbapi.notify_inserted(4, v4_values)
+    dbapi.notify_inserted(6, [
+        int(hexlify(v6_packed[i:i + 16]), 16)
+        for i in xrange(0, len(v6_packed), 16)
+    ])
+
+
+def import_feed(lines, mysql_pool=None, workers=None, writers=2,
+                chunk_size=5000, max_pending=None):
+    """Parse feed lines in worker processes and load them in database
+
+    :param lines: Iterable of feed lines, each line is an ip address.
+    :type lines: iterable.
+    :param mysql_pool: Pool of database connections, if not set lines are
+    only parsed.
+    :type mysql_pool: sqlalchemy.pool.QueuePool.
+    :param workers: Number of parsing processes, number of CPUs by default.
+    :type workers: int.
+    :param writers: Number of threads writing to database.
+    :type writers: int.
+    :param chunk_size: Number of lines parsed and inserted at once.
+    :type chunk_size: int.
+    :param max_pending: Number of chunks being parsed at once, twice the
+    number of workers by default.
+    :type max_pending: int.
+    :returns: dict -- number of read lines, v4 and v6 addresses and invalid
+    lines.
+
+    """
+    workers = workers or cpu_count()
+    max_pending = max_pending or 2 * workers
+    stats = {'lines': 0, 'v4': 0, 'v6': 0, 'invalid': 0}
+    parsing = deque()
+    writing = deque()
+    processes = Pool(workers)
+    threads = ThreadPool(writers)
+
+    def write(parsed_chunk):
+        stats['v4'] += len(parsed_chunk[0])
+        stats['v6'] += len(parsed_chunk[1]) / 16
+        stats['invalid'] += parsed_chunk[2]
+        if mysql_pool is None:
+            return
+        writing.append(
+            threads.apply_async(write_chunk, (mysql_pool, parsed_chunk))
+        )
+        # wait for writers before parsing more, database is slower
+        while len(writing) > 2 * writers:
+            writing.popleft().get()
+
+    try:
+        for chunk in read_chunks(lines, chunk_size):
+            stats['lines'] += len(chunk)
+            parsing.append(processes.apply_async(parse_chunk, (chunk,)))
+            while len(parsing) >= max_pending:
+                write(parsing.popleft().get())
+        while parsing:
+            write(parsing.popleft().get())
+        while writing:
+            writing.popleft().get()
+    finally:
+        processes.terminate()
+        threads.terminate()
+        processes.join()
+        threads.join()
+    MODULE_LOGGER.debug(
+        'Imported feed with %s workers: %s' % (workers, stats)
+    )
+    return stats
+
+
+def import_feed_file(filename, mysql_pool=None, **kwargs):
+    """Import feed from file, see import_feed for parameters"""
+    with open(filename) as feed:
+        return import_feed(feed, mysql_pool, **kwargs)
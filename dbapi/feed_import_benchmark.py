@@ -0,0 +1,41 @@
+"""Benchmark of feed import throughput for 1, 2, 4 and 8 worker processes.
+By default lines are only parsed, with --database option they are also
+loaded in database from dbapi.cfg."""
+import random
+import sys
+import time
+
+from netaddr import IPAddress
+
+from feed_import import import_feed
+from pooling import create_pool
+
+LINES = 1000000
+WORKERS = (1, 2, 4, 8)
+
+
+def generate_feed(lines):
+    """Return list of random v4 and v6 addresses, every tenth is v6"""
+    feed = []
+    for number in xrange(lines):
+        if number % 10:
+            feed.append(str(IPAddress(random.getrandbits(32), 4)))
+        else:
+            feed.append(str(IPAddress(random.getrandbits(128), 6)))
+    return feed
+
+
+def main():
+    mysql_pool = None
+    if '--database' in sys.argv:
+        mysql_pool = create_pool('dbapi.cfg')
+    feed = generate_feed(LINES)
+    for workers in WORKERS:
+        start = time.time()
+        import_feed(feed, mysql_pool, workers=workers)
+        elapsed = time.time() - start
+        print('%s workers: %10.1f lines/s' % (workers, LINES / elapsed))
+
+
+if __name__ == '__main__':
+    main()
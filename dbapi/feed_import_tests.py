@@ -0,0 +1,62 @@
+import unittest
+
+from netaddr import IPAddress
+
+from feed_import import import_feed, parse_chunk, read_chunks
+
+
+class ReadChunksTest(unittest.TestCase):
+
+    def test_comments_and_blank_lines(self):
+        lines = ['# feed header\n', '1.1.1.1\n', '\n', '   \n',
+                 '  2.2.2.2  \n', '#3.3.3.3\n', '::1']
+        self.assertEquals(
+            list(read_chunks(lines, 10)),
+            [['1.1.1.1', '2.2.2.2', '::1']]
+        )
+
+    def test_chunk_boundaries(self):
+        lines = ['10.0.0.%s' % number for number in xrange(7)]
+        chunks = list(read_chunks(lines, 3))
+        self.assertEquals([len(chunk) for chunk in chunks], [3, 3, 1])
+        self.assertEquals(sum(chunks, []), lines)
+        # last chunk is not empty when lines divide evenly
+        self.assertEquals(
+            [len(chunk) for chunk in read_chunks(lines[:6], 3)], [3, 3]
+        )
+        self.assertEquals(list(read_chunks(['# only comment'], 3)), [])
+
+
+class ParseChunkTest(unittest.TestCase):
+
+    def test_parse_chunk(self):
+        v4_values, v6_packed, invalid = parse_chunk(
+            ['192.168.1.1', 'fe80::1', 'spam', '1.1.1.1', '300.0.0.1',
+             '::1', '']
+        )
+        self.assertEquals(
+            list(v4_values),
+            [IPAddress('192.168.1.1').value, IPAddress('1.1.1.1').value]
+        )
+        self.assertEquals(
+            v6_packed, IPAddress('fe80::1').packed + IPAddress('::1').packed
+        )
+        self.assertEquals(invalid, 3)
+
+    def test_empty_chunk(self):
+        v4_values, v6_packed, invalid = parse_chunk([])
+        self.assertEquals((len(v4_values), v6_packed, invalid), (0, '', 0))
+
+
+class ImportFeedTest(unittest.TestCase):
+
+    def test_parse_only(self):
+        lines = ['# feed', '1.1.1.1', 'spam', '::1', '', '2.2.2.2'] * 5
+        self.assertEquals(
+            import_feed(lines, workers=2, chunk_size=4),
+            {'lines': 20, 'v4': 10, 'v6': 5, 'invalid': 5}
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Benchmark of v6 address storage formats: bit literals in VARBINARY(16)
+column, as addresses were stored before, against 16 bytes in BINARY(16)
+column. Both tables are filled with the same random addresses, table and
+index sizes, range scan time and number of addresses each range query
+misses are printed. Database from dbapi.cfg is used, benchmark tables are
+dropped at the end.
+
+    python ipv6_storage_benchmark.py [addresses count]
+
+"""
+import bisect
+import random
+import sys
+import time
+
+from mysql_connector import get_database_connection
+
+ADDRESSES = 1000000
+RANGES = 200
+INSERT_BATCH = 5000
+# networks of generated addresses, with and without leading zero bytes
+NETWORKS = (
+    (0x20010db8 << 96, 96),
+    (0xfe80 << 112, 64),
+    (0xffff << 32, 32),
+    (0, 24),
+)
+FORMATS = (
+    ('bits', 'VARBINARY(16)', bin),
+    ('binary', 'BINARY(16)', lambda value: '0x%032x' % value),
+)
+
+
+def random_addresses(count):
+    addresses = set()
+    while len(addresses) < count:
+        network, host_bits = random.choice(NETWORKS)
+        addresses.add(network | random.getrandbits(host_bits))
+    return sorted(addresses)
+
+
+def create_table(cursor, name, column_type, to_sql, addresses):
+    cursor.execute('DROP TABLE IF EXISTS ipv6_benchmark_%s' % name)
+    cursor.execute('''
+    CREATE TABLE ipv6_benchmark_{0} (
+        id INT(11) NOT NULL AUTO_INCREMENT,
+        address {1} NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE INDEX address_UNIQUE (address))
+    ENGINE = InnoDB'''.format(name, column_type))
+    shuffled = list(addresses)
+    random.shuffle(shuffled)
+    start = time.time()
+    for i in xrange(0, len(shuffled), INSERT_BATCH):
+        cursor.execute(
+            'INSERT INTO ipv6_benchmark_%s (address) VALUES %s' % (
+                name, ', '.join(
+                    '(%s)' % to_sql(value)
+                    for value in shuffled[i:i + INSERT_BATCH]
+                )
+            )
+        )
+    return time.time() - start
+
+
+def table_size(cursor, name):
+    cursor.execute('ANALYZE TABLE ipv6_benchmark_%s' % name)
+    cursor.fetchall()
+    cursor.execute('''
+    SELECT data_length, index_length FROM information_schema.tables
+    WHERE table_schema = DATABASE() AND table_name = %s''',
+                   ('ipv6_benchmark_%s' % name,))
+    return cursor.fetchone()
+
+
+def scan_ranges(cursor, name, to_sql, ranges, addresses):
+    """Run range queries, return time per query and number of addresses
+    which query should find but did not"""
+    missed = 0
+    start = time.time()
+    for first, last in ranges:
+        cursor.execute(
+            'SELECT COUNT(*) FROM ipv6_benchmark_%s '
+            'WHERE address BETWEEN %s AND %s'
+            % (name, to_sql(first), to_sql(last))
+        )
+        expected = bisect.bisect_right(addresses, last) - \
+            bisect.bisect_left(addresses, first)
+        missed += abs(expected - cursor.fetchone()[0])
+    return (time.time() - start) / len(ranges), missed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else ADDRESSES
+    random.seed(0)
+    addresses = random_addresses(count)
+    ranges = []
+    for _ in xrange(RANGES):
+        first = random.randrange(len(addresses))
+        last = min(first + random.randint(1, 1000), len(addresses) - 1)
+        ranges.append((addresses[first], addresses[last]))
+    connection = get_database_connection('dbapi.cfg', 'MySQL settings')
+    cursor = connection.cursor()
+    try:
+        for name, column_type, to_sql in FORMATS:
+            insert_time = create_table(
+                cursor, name, column_type, to_sql, addresses
+            )
+            connection.commit()
+            data_length, index_length = table_size(cursor, name)
+            scan_time, missed = scan_ranges(
+                cursor, name, to_sql, ranges, addresses
+            )
+            print('%6s: insert %.1f s, data %.1f MB, index %.1f MB, '
+                  'range scan %.2f ms, missed %d addresses'
+                  % (name, insert_time, data_length / 1048576.0,
+                     index_length / 1048576.0, scan_time * 1000, missed))
+    finally:
+        for name, _, _ in FORMATS:
+            cursor.execute('DROP TABLE IF EXISTS ipv6_benchmark_%s' % name)
+        cursor.close()
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark of find_ip_list_type against previous implementation with two
+COUNT(*) queries and against batched find_ip_list_types. With --populate N
+option N addresses from 12.0.0.0/8 network are loaded in database first,
+every tenth of them is blacklisted and every tenth whitelisted. Database
+from dbapi.cfg is used, it needs local_infile=1 option for --populate."""
+import random
+import sys
+import time
+
+from netaddr import IPAddress
+
+import dbapi
+from bulk_load import load_addresses
+from mysql_connector import get_database_connection
+
+FIRST_ADDRESS = IPAddress('12.0.0.0')
+LOOKUPS = 10000
+BATCH_SIZE = 100
+
+
+def find_ip_list_type_two_queries(connection, ip_address):
+    """Previous implementation of dbapi.find_ip_list_type"""
+    cursor = connection.cursor()
+    sql = '''
+    SELECT count(*) FROM {0}
+    WHERE v{1}_id_{0} =
+    (
+        SELECT id FROM ipv{1}_addresses
+        WHERE address = {2}
+    )
+    '''
+    ip_value, ip_version = dbapi.get_ip_data(ip_address)
+    cursor.execute(sql.format('whitelist', ip_version, ip_value))
+    whitelist_count = cursor.fetchone()[0]
+    cursor.execute(sql.format('blacklist', ip_version, ip_value))
+    blacklist_count = cursor.fetchone()[0]
+    cursor.close()
+    if whitelist_count == blacklist_count:
+        return None
+    return 'whitelist' if whitelist_count > 0 else 'blacklist'
+
+
+def populate(connection, count):
+    """Load count addresses and put them in lists"""
+    load_addresses(
+        connection,
+        (str(FIRST_ADDRESS + offset) for offset in xrange(count))
+    )
+    cursor = connection.cursor()
+    for list_type, remainder in (('blacklist', 0), ('whitelist', 5)):
+        cursor.execute('''
+        INSERT INTO {0} (v4_id_{0})
+        SELECT id FROM ipv4_addresses
+        WHERE address BETWEEN {1} AND {2} AND address % 10 = {3}'''.format(
+            list_type, FIRST_ADDRESS.value, FIRST_ADDRESS.value + count,
+            remainder
+        ))
+    cursor.close()
+
+
+def timed(function, addresses):
+    start = time.time()
+    function(addresses)
+    return (time.time() - start) / len(addresses) * 1e6
+
+
+def main():
+    connection = get_database_connection('dbapi.cfg', 'MySQL settings')
+    count = LOOKUPS
+    if '--populate' in sys.argv:
+        count = int(sys.argv[sys.argv.index('--populate') + 1])
+        populate(connection, count)
+    # half of looked up addresses are not in database
+    addresses = [
+        str(FIRST_ADDRESS + random.randint(0, 2 * count))
+        for _ in xrange(LOOKUPS)
+    ]
+    runs = (
+        ('two queries', lambda ips: [
+            find_ip_list_type_two_queries(connection, ip) for ip in ips]),
+        ('single query', lambda ips: [
+            dbapi.find_ip_list_type(connection, ip) for ip in ips]),
+        ('batched', lambda ips: [
+            dbapi.find_ip_list_types(connection, ips[i:i + BATCH_SIZE])
+            for i in xrange(0, len(ips), BATCH_SIZE)]),
+    )
+    for name, run in runs:
+        print('%12s: %8.1f us per address' % (name, timed(run, addresses)))
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
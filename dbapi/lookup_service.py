@@ -0,0 +1,376 @@
+"""Module implements HTTP/JSON lookup service on top of dbapi. Requests are
+served by threads with connections from pooling.create_pool, concurrent
+single list type lookups are collected by MicroBatcher and answered by one
+find_ip_list_types query. Service settings are in [Lookup service] section:
+
+    [Lookup service]
+    host=localhost
+    port=8080
+    max_batch=200
+    max_wait=0.002
+    max_range_rows=1000
+    backend=mysql
+    sqlite_path=ip_addresses.db
+
+With backend=sqlite lookups are answered from SQLite database kept in sync
+by sqlite_backend instead of MySQL.
+
+Endpoints, all answer with JSON object:
+
+    GET /list_type?ip=1.2.3.4          {"ip": ..., "list_type": ...}
+    POST /list_types {"ips": [...]}    {"list_types": {ip: list_type}}
+    GET /in_database?ip=1.2.3.4        {"ip": ..., "in_database": ...}
+    GET /sources?ip=1.2.3.4            {"ip": ..., "sources": [...]}
+    GET /range?start=..&end=..[&offset=..&limit=..]
+                                       {"addresses": [[id, ip, date], ...]}
+
+    python lookup_service.py dbapi.cfg
+
+:classes: MicroBatcher, LookupHandler, LookupServer
+:functions: create_server"""
+import json
+import sys
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import deque
+from SocketServer import ThreadingMixIn
+from urlparse import parse_qs, urlparse
+
+import dbapi
+from config_parser import get_section_settings
+from dbapi_exceptions import IPAddressError
+from logging_conf import create_logger
+from pooling import create_pool
+from rows import decode_address
+import sqlite_backend
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+SERVICE_DEFAULTS = {
+    'host': 'localhost',
+    'port': '8080',
+    'max_batch': '200',
+    'max_wait': '0.002',
+    'max_range_rows': '1000',
+    'backend': 'mysql',
+    'sqlite_path': 'ip_addresses.db',
+}
+
+
+class _Lookup(object):
+    """Lookup waiting in MicroBatcher queue"""
+
+    __slots__ = ('ip_address', 'done', 'result', 'error')
+
+    def __init__(self, ip_address):
+        self.ip_address = ip_address
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """Collects list type lookups from concurrent threads and answers them
+    with one query. Batch is sent when max_batch lookups are queued or when
+    the oldest lookup waited max_wait seconds.
+
+        batcher = MicroBatcher(mysql_pool)
+        batcher.find_ip_list_type('192.168.1.1')
+
+    """
+
+    def __init__(self, mysql_pool, max_batch=200, max_wait=0.002,
+                 lookup=dbapi.find_ip_list_types):
+        """
+        :param mysql_pool: Pool of database connections.
+        :type mysql_pool: sqlalchemy.pool.QueuePool.
+        :param max_batch: Maximal number of addresses in one query.
+        :type max_batch: int.
+        :param max_wait: Seconds lookup may wait for other lookups.
+        :type max_wait: float.
+        :param lookup: Function which takes connection and list of addresses
+        and returns dict of list types.
+        :type lookup: function.
+
+        """
+        self.mysql_pool = mysql_pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.lookup = lookup
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self.stats = {'lookups': 0, 'batches': 0}
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def find_ip_list_type(self, ip_address):
+        """Same as dbapi.find_ip_list_type, blocks until batch with address
+        is answered"""
+        pending = _Lookup(ip_address)
+        with self._condition:
+            if self._closed:
+                raise Exception("MicroBatcher is closed")
+            self._queue.append(pending)
+            self._condition.notify()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self):
+        """Wait for lookups and return batch of them, None when closed"""
+        with self._condition:
+            while not self._queue and not self._closed:
+                self._condition.wait()
+            if not self._queue:
+                return None
+            deadline = time.time() + self.max_wait
+            while len(self._queue) < self.max_batch and not self._closed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return [
+                self._queue.popleft()
+                for _ in xrange(min(self.max_batch, len(self._queue)))
+            ]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                connection = self.mysql_pool.connect()
+                try:
+                    result = self.lookup(
+                        connection,
+                        [pending.ip_address for pending in batch]
+                    )
+                finally:
+                    connection.close()
+                for pending in batch:
+                    pending.result = result[pending.ip_address]
+            except Exception as error:
+                MODULE_LOGGER.error('Batch lookup failed: %s' % error)
+                for pending in batch:
+                    pending.error = error
+            self.stats['lookups'] += len(batch)
+            self.stats['batches'] += 1
+            for pending in batch:
+                pending.done.set()
+
+    def close(self):
+        """Answer queued lookups and stop batching thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+
+def _validate(ip_address):
+    """Raise IPAddressError if ip address is not valid"""
+    if not ip_address or not isinstance(ip_address, basestring):
+        raise IPAddressError
+    dbapi.get_ip_data(ip_address)
+    return ip_address
+
+
+def _non_negative(query, name, default):
+    """Return query parameter as integer, raise ValueError if it is not a
+    non-negative integer"""
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise ValueError('%s must be an integer' % name)
+    if value < 0:
+        raise ValueError('%s must not be negative' % name)
+    return value
+
+
+class LookupHandler(BaseHTTPRequestHandler):
+    """Request handler of lookup service, uses pool and batcher of server"""
+
+    # every response has Content-Length, so connections can be kept alive
+    protocol_version = 'HTTP/1.1'
+    # response is buffered and sent at once, separate small writes of
+    # headers and body wait for delayed ack on kept alive connection
+    wbufsize = -1
+
+    def _send(self, status, body):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _call(self, function, *args):
+        """Call dbapi function with pooled connection"""
+        connection = self.server.mysql_pool.connect()
+        try:
+            return function(connection, *args)
+        finally:
+            connection.close()
+
+    def _dispatch(self, handler, *args):
+        try:
+            self._send(200, handler(*args))
+        except (IPAddressError, ValueError, KeyError) as error:
+            self._send(400, {'error': str(error) or 'Bad request'})
+        except Exception as error:
+            MODULE_LOGGER.error('Lookup failed: %s' % error)
+            self._send(500, {'error': str(error)})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = dict(
+            (name, values[0]) for name, values in parse_qs(url.query).items()
+        )
+        handler = {
+            '/list_type': self.list_type,
+            '/in_database': self.in_database,
+            '/sources': self.sources,
+            '/range': self.address_range,
+        }.get(url.path)
+        if handler is None:
+            self._send(404, {'error': 'Unknown path %s' % url.path})
+            return
+        self._dispatch(handler, query)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/list_types':
+            self._send(404, {'error': 'Unknown path %s' % self.path})
+            return
+        length = int(self.headers.getheader('Content-Length') or 0)
+        self._dispatch(self.list_types, self.rfile.read(length))
+
+    def list_type(self, query):
+        ip_address = _validate(query.get('ip'))
+        return {
+            'ip': ip_address,
+            'list_type': self.server.batcher.find_ip_list_type(ip_address),
+        }
+
+    def list_types(self, body):
+        request = json.loads(body)
+        if not isinstance(request, dict) or \
+                not isinstance(request.get('ips'), list):
+            raise ValueError('Expected object with list of ips')
+        ip_addresses = [_validate(ip) for ip in request['ips']]
+        return {
+            'list_types': self._call(
+                self.server.backend.find_ip_list_types, ip_addresses
+            )
+        }
+
+    def in_database(self, query):
+        ip_address = _validate(query.get('ip'))
+        return {
+            'ip': ip_address,
+            'in_database': self._call(
+                self.server.backend.check_if_ip_in_database, ip_address
+            ),
+        }
+
+    def sources(self, query):
+        ip_address = _validate(query.get('ip'))
+        result = self._call(
+            self.server.backend.get_sourcename_list_with_ip, ip_address
+        )
+        return {'ip': ip_address, 'sources': [row[0] for row in result]}
+
+    def address_range(self, query):
+        start = _validate(query.get('start'))
+        end = _validate(query.get('end'))
+        if dbapi.get_ip_data(start)[1] != dbapi.get_ip_data(end)[1]:
+            raise ValueError('start and end must be of same ip version')
+        limit = min(
+            _non_negative(query, 'limit', self.server.max_range_rows),
+            self.server.max_range_rows
+        )
+        offset = _non_negative(query, 'offset', 0)
+        rows = self._call(
+            self.server.backend.get_ip_from_range, start, end,
+            (offset, limit)
+        )
+        return {
+            'addresses': [
+                [row[0], decode_address(row[1]),
+                 row[2] and row[2].isoformat()]
+                for row in rows
+            ]
+        }
+
+    def log_message(self, format, *args):
+        # client address is not resolved to host name, it costs a dns query
+        MODULE_LOGGER.debug('%s %s' % (self.client_address[0], format % args))
+
+
+class LookupServer(ThreadingMixIn, HTTPServer):
+    """Threading HTTP server with pool of connections and lookup batcher,
+    lookup functions are taken from backend module, dbapi or
+    sqlite_backend"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, mysql_pool, max_batch=200, max_wait=0.002,
+                 max_range_rows=1000, backend=dbapi):
+        HTTPServer.__init__(self, address, LookupHandler)
+        self.mysql_pool = mysql_pool
+        self.backend = backend
+        self.batcher = MicroBatcher(mysql_pool, max_batch, max_wait,
+                                    backend.find_ip_list_types)
+        self.max_range_rows = max_range_rows
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.batcher.close()
+        self.mysql_pool.dispose()
+
+
+def create_server(config, section='MySQL settings'):
+    """Create lookup server from [Lookup service] section of config file
+
+    :param config: String with name of configuration file.
+    :param section: Name of config section with database connection
+    settings.
+    :returns: LookupServer -- call serve_forever to start it.
+
+    """
+    settings = dict(SERVICE_DEFAULTS)
+    settings.update(get_section_settings(config, 'Lookup service'))
+    if settings['backend'] == 'sqlite':
+        pool = sqlite_backend.SQLitePool(settings['sqlite_path'])
+        backend = sqlite_backend
+    else:
+        pool = create_pool(config, section)
+        backend = dbapi
+    return LookupServer(
+        (settings['host'], int(settings['port'])),
+        pool,
+        int(settings['max_batch']),
+        float(settings['max_wait']),
+        int(settings['max_range_rows']),
+        backend
+    )
+
+
+def main():
+    server = create_server(sys.argv[1] if len(sys.argv) > 1 else 'dbapi.cfg')
+    MODULE_LOGGER.debug('Lookup service listens on %s:%s'
+                        % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Load test of lookup service. Client threads send requests over kept alive
+connections for given time, requests per second and latency percentiles are
+printed. Service must be started first, for example against local database:
+
+    python lookup_service.py dbapi.cfg
+    python lookup_service_load_test.py localhost:8080 --threads 32 \\
+        --seconds 20 --mode single
+
+Modes: single sends GET /list_type, batch sends POST /list_types with
+--batch addresses. Looked up addresses are random ones from 12.0.0.0/8,
+database can be filled by list_type_benchmark.py --populate N."""
+import httplib
+import json
+import optparse
+import random
+import threading
+import time
+
+from netaddr import IPAddress
+
+FIRST_ADDRESS = IPAddress('12.0.0.0')
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def client(address, options, deadline, latencies, errors):
+    connection = httplib.HTTPConnection(address)
+    while time.time() < deadline:
+        if options.mode == 'single':
+            ip_address = FIRST_ADDRESS + random.randint(0, options.addresses)
+            request = ('GET', '/list_type?ip=%s' % ip_address, None)
+        else:
+            request = ('POST', '/list_types', json.dumps({'ips': [
+                str(FIRST_ADDRESS + random.randint(0, options.addresses))
+                for _ in xrange(options.batch)
+            ]}))
+        start = time.time()
+        try:
+            connection.request(*request)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (httplib.HTTPException, IOError) as error:
+            errors.append(error)
+            connection.close()
+            connection = httplib.HTTPConnection(address)
+            continue
+        latencies.append(time.time() - start)
+    connection.close()
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog host:port [options]')
+    parser.add_option('--threads', type='int', default=16)
+    parser.add_option('--seconds', type='float', default=10)
+    parser.add_option('--mode', choices=['single', 'batch'],
+                      default='single')
+    parser.add_option('--batch', type='int', default=100,
+                      help='addresses in one batch request')
+    parser.add_option('--addresses', type='int', default=100000,
+                      help='addresses are chosen from first N of 12.0.0.0/8')
+    options, args = parser.parse_args()
+    address = args[0] if args else 'localhost:8080'
+    latencies = []
+    errors = []
+    deadline = time.time() + options.seconds
+    threads = [
+        threading.Thread(
+            target=client,
+            args=(address, options, deadline, latencies, errors)
+        )
+        for _ in xrange(options.threads)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    latencies.sort()
+    if not latencies:
+        print('no successful requests, %d errors' % len(errors))
+        return
+    lookups = options.batch if options.mode == 'batch' else 1
+    print('%d requests, %d errors in %.1f s' %
+          (len(latencies), len(errors), elapsed))
+    print('%.0f requests/s, %.0f addresses/s' %
+          (len(latencies) / elapsed, len(latencies) * lookups / elapsed))
+    print('latency p50 %.2f ms, p99 %.2f ms, max %.2f ms' %
+          (percentile(latencies, 0.5) * 1000,
+           percentile(latencies, 0.99) * 1000, latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import json
+import threading
+import unittest
+import urllib2
+
+import dbapi
+from lookup_service import LookupServer, MicroBatcher
+
+
+class FakeConnection(object):
+
+    def close(self):
+        pass
+
+
+class FakePool(object):
+
+    def connect(self):
+        return FakeConnection()
+
+    def dispose(self):
+        pass
+
+
+def fake_list_types(connection, ip_addresses):
+    return dict(
+        (ip_address, 'blacklist' if ip_address.startswith('1.') else None)
+        for ip_address in ip_addresses
+    )
+
+
+class MicroBatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+        def lookup(connection, ip_addresses):
+            self.batches.append(ip_addresses)
+            return fake_list_types(connection, ip_addresses)
+
+        self.batcher = MicroBatcher(FakePool(), max_batch=50, max_wait=0.05,
+                                    lookup=lookup)
+
+    def tearDown(self):
+        self.batcher.close()
+
+    def test_concurrent_lookups_are_batched(self):
+        results = {}
+
+        def find(ip_address):
+            results[ip_address] = self.batcher.find_ip_list_type(ip_address)
+
+        threads = [
+            threading.Thread(target=find, args=('1.0.0.%s' % i,))
+            for i in xrange(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(len(results), 20)
+        self.assertEquals(set(results.values()), set(['blacklist']))
+        self.assertTrue(len(self.batches) < 20)
+        self.assertEquals(self.batcher.stats['lookups'], 20)
+
+    def test_error_is_raised_in_caller(self):
+        def lookup(connection, ip_addresses):
+            raise ValueError('spam')
+
+        self.batcher.lookup = lookup
+        self.assertRaises(
+            ValueError, self.batcher.find_ip_list_type, '1.1.1.1'
+        )
+
+
+class LookupServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.find_ip_list_types = dbapi.find_ip_list_types
+        dbapi.find_ip_list_types = fake_list_types
+        self.server = LookupServer(('localhost', 0), FakePool())
+        self.server.batcher.lookup = fake_list_types
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://localhost:%s' % self.server.server_address[1]
+
+    def tearDown(self):
+        dbapi.find_ip_list_types = self.find_ip_list_types
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_list_type(self):
+        response = json.load(
+            urllib2.urlopen(self.url + '/list_type?ip=1.1.1.1')
+        )
+        self.assertEquals(
+            response, {'ip': '1.1.1.1', 'list_type': 'blacklist'}
+        )
+
+    def test_list_types(self):
+        response = json.load(urllib2.urlopen(
+            self.url + '/list_types',
+            json.dumps({'ips': ['1.1.1.1', '2.2.2.2']})
+        ))
+        self.assertEquals(
+            response,
+            {'list_types': {'1.1.1.1': 'blacklist', '2.2.2.2': None}}
+        )
+
+    def assertBadRequest(self, path, data=None):
+        try:
+            urllib2.urlopen(self.url + path, data)
+        except urllib2.HTTPError as error:
+            self.assertEquals(error.code, 400)
+        else:
+            self.fail('HTTPError not raised')
+
+    def test_wrong_ip(self):
+        self.assertBadRequest('/list_type?ip=SpamHam')
+
+    def test_wrong_range_parameters(self):
+        for parameters in ('limit=-1', 'offset=-5', 'limit=spam',
+                           'offset=1.5'):
+            self.assertBadRequest(
+                '/range?start=1.1.1.1&end=1.1.1.9&' + parameters
+            )
+        self.assertBadRequest('/range?start=1.1.1.1&end=::1')
+
+    def test_wrong_list_types_body(self):
+        for body in ('["1.1.1.1"]', '5', '{"ips": "1.1.1.1"}',
+                     '{"ips": [5]}', 'spam'):
+            self.assertBadRequest('/list_types', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,8 @@ import MySQLdb as mdb
 
 from config_parser import get_section_settings
 from logging_conf import create_logger
-from dbapi_exceptions import ConnectionError
+from dbapi_exceptions import ConfigError, ConnectionError
+import slow_query
 
 MODULE_LOGGER = create_logger('logging.cfg', 'connector')
 
@@ -18,13 +19,32 @@ def get_database_connection(config, section):
 
     """
     section_data = get_section_settings(config, section)
+    connect_options = {}
+    if 'connect_timeout' in section_data:
+        # fail fast instead of waiting for OS timeout if host is down
+        connect_options['connect_timeout'] = int(
+            section_data['connect_timeout']
+        )
+    if 'local_infile' in section_data:
+        # needed for LOAD DATA LOCAL INFILE used by bulk_load module
+        connect_options['local_infile'] = int(section_data['local_infile'])
+    try:
+        slow_query_settings = get_section_settings(config, 'Slow query')
+    except ConfigError:
+        pass
+    else:
+        # queries slower than threshold are captured by slow_query module
+        connect_options['cursorclass'] = slow_query.configure(
+            slow_query_settings
+        )
     try:
         connection = mdb.connect(
             host=section_data['host'],
             user=section_data['user'],
             passwd=section_data['password'],
             db=section_data['database_name'],
-            port=int(section_data['port'])
+            port=int(section_data['port']),
+            **connect_options
         )
         connection.autocommit(1)
         MODULE_LOGGER.debug(
@@ -35,3 +55,40 @@ def get_database_connection(config, section):
     except mdb.OperationalError as connection_error:
         MODULE_LOGGER.error(connection_error.message)
         raise ConnectionError
+
+
+class SessionVariable(object):
+    """Context manager which sets session variable of connection and
+    restores its previous value on exit, so connections returned to pool
+    keep their settings:
+
+        with SessionVariable(connection, 'group_concat_max_len', 1048576):
+            cursor.execute(query)
+
+    """
+
+    def __init__(self, connection, name, value):
+        self.connection = connection
+        self.name = name
+        self.value = value
+        self.previous = None
+
+    def _execute(self, sql):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def __enter__(self):
+        self.previous = self._execute(
+            'SELECT @@SESSION.%s' % self.name
+        )[0][0]
+        self._execute('SET SESSION %s = %s' % (self.name, self.value))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._execute('SET SESSION %s = %s' % (self.name, self.previous))
+        # errors are not suppressed
+        return False
@@ -0,0 +1,302 @@
+"""Module implements workload simulator for pool settings. Threads call a
+weighted mix of dbapi read functions with pooled connections from
+pooling.create_pool for each combination of thread count, pool_size and
+max_overflow. Checkout wait times, overflow use, timeouts and throughput
+of every run are reported. For each thread count the smallest pool whose
+p99 checkout wait is within target is recommended:
+
+    python pool_simulator.py dbapi.cfg --threads 8,32 --pool-sizes 2,5,10 \\
+        --max-overflows 0,10 --duration 5 --target-p99 5 \\
+        --mix find_ip_list_type=7,check_if_ip_in_database=2
+
+Functions of the mix take connection and ip address, addresses are sampled
+from ipv4_addresses table of the database.
+
+:functions: parse_mix, percentile, run_workload, simulate, recommend"""
+import bisect
+import math
+import optparse
+import random
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import exc
+
+import dbapi
+from logging_conf import create_logger
+from pooling import create_pool
+from rows import decode_address
+
+MODULE_LOGGER = create_logger('logging.cfg', 'connector')
+
+DEFAULT_MIX = 'find_ip_list_type=7,check_if_ip_in_database=2,' \
+    'get_sourcename_list_with_ip=1'
+SAMPLE_SIZE = 1000
+
+RunResult = namedtuple(
+    'RunResult',
+    'threads pool_size max_overflow calls timeouts throughput wait_p50 '
+    'wait_p99 call_p99 overflow_used'
+)
+
+
+def parse_mix(mix):
+    """Parse workload mix of dbapi read functions with weights
+
+    :param mix: Comma separated name=weight pairs.
+    :type mix: str.
+    :returns: list -- tuples of function and weight.
+
+    """
+    functions = []
+    for item in mix.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in dbapi.READ_FUNCTIONS:
+            raise ValueError('%s is not a dbapi read function' % name)
+        functions.append((getattr(dbapi, name), float(weight or 1)))
+    return functions
+
+
+def percentile(values, fraction):
+    """Return value below which fraction of values are, nearest rank
+    method
+
+    :param values: Numbers.
+    :type values: list.
+    :param fraction: From 0 to 1.
+    :type fraction: float.
+
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = int(math.ceil(fraction * len(values))) - 1
+    return values[max(rank, 0)]
+
+
+def _worker(mysql_pool, deadline, functions, weights, ip_addresses, seed,
+            stats):
+    rng = random.Random(seed)
+    total = weights[-1]
+    waits, latencies = [], []
+    timeouts = 0
+    overflow_used = 0
+    try:
+        while time.time() < deadline:
+            function = functions[
+                bisect.bisect(weights, rng.random() * total)
+            ]
+            ip_address = rng.choice(ip_addresses)
+            start = time.time()
+            try:
+                connection = mysql_pool.connect()
+            except exc.TimeoutError:
+                timeouts += 1
+                # timed out wait took at least pool timeout, it counts in
+                # wait percentiles
+                waits.append(time.time() - start)
+                continue
+            checked_out = time.time()
+            overflow_used = max(overflow_used, mysql_pool.overflow())
+            try:
+                function(connection, ip_address)
+            finally:
+                connection.close()
+            waits.append(checked_out - start)
+            latencies.append(time.time() - start)
+    finally:
+        # results of worker stopped by error are still counted
+        stats.append((waits, latencies, timeouts, overflow_used))
+
+
+def run_workload(mysql_pool, threads, duration, mix, ip_addresses):
+    """Call functions of mix from threads with pooled connections during
+    duration seconds
+
+    :param mysql_pool: Pool of database connections.
+    :type mysql_pool: sqlalchemy.pool.QueuePool.
+    :param threads: Number of concurrent threads.
+    :type threads: int.
+    :param duration: Seconds to run.
+    :type duration: float.
+    :param mix: Functions and weights returned by parse_mix.
+    :type mix: list.
+    :param ip_addresses: Addresses functions are called with.
+    :type ip_addresses: list.
+    :returns: dict -- 'calls', 'timeouts', 'throughput' in calls per
+    second, 'wait_p50', 'wait_p99' of checkouts including timed out ones
+    and 'call_p99' in milliseconds, 'overflow_used' - maximal number of
+    overflow connections.
+
+    """
+    functions = [function for function, _ in mix]
+    weights = []
+    for _, weight in mix:
+        weights.append(weight + (weights[-1] if weights else 0))
+    stats = []
+    deadline = time.time() + duration
+    workers = [
+        threading.Thread(target=_worker, args=(
+            mysql_pool, deadline, functions, weights, ip_addresses,
+            number, stats
+        ))
+        for number in xrange(threads)
+    ]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+    waits = [wait for worker_stats in stats for wait in worker_stats[0]]
+    latencies = [
+        latency for worker_stats in stats for latency in worker_stats[1]
+    ]
+    return {
+        'calls': len(latencies),
+        'timeouts': sum(worker_stats[2] for worker_stats in stats),
+        'throughput': len(latencies) / elapsed,
+        'wait_p50': percentile(waits, 0.5) * 1000,
+        'wait_p99': percentile(waits, 0.99) * 1000,
+        'call_p99': percentile(latencies, 0.99) * 1000,
+        'overflow_used': max(
+            [0] + [worker_stats[3] for worker_stats in stats]
+        ),
+    }
+
+
+def sample_addresses(mysql_pool, size=SAMPLE_SIZE):
+    """Return addresses from ipv4_addresses table"""
+    connection = mysql_pool.connect()
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT address FROM ipv4_addresses LIMIT %s' % size)
+        return [decode_address(row[0]) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def simulate(config, thread_counts, pool_sizes, max_overflows, duration,
+             mix, section='MySQL settings'):
+    """Run workload for every combination of thread count, pool size and
+    max overflow, each with new pool from create_pool
+
+    :param config: String with name of configuration file.
+    :param thread_counts: Numbers of threads.
+    :type thread_counts: list.
+    :param pool_sizes: Values of pool_size.
+    :type pool_sizes: list.
+    :param max_overflows: Values of max_overflow.
+    :type max_overflows: list.
+    :param duration: Seconds each run takes.
+    :type duration: float.
+    :param mix: Functions and weights returned by parse_mix.
+    :type mix: list.
+    :returns: list -- RunResult of each run.
+
+    """
+    sample_pool = create_pool(config, section)
+    ip_addresses = sample_addresses(sample_pool)
+    sample_pool.dispose()
+    if not ip_addresses:
+        raise Exception('There are no addresses in database')
+    results = []
+    for threads in thread_counts:
+        for pool_size in pool_sizes:
+            for max_overflow in max_overflows:
+                # background validation would take connections in the
+                # middle of measured runs, checkout waits longer than the
+                # run are timed out so run doesn't outlast duration
+                mysql_pool = create_pool(config, section, {
+                    'pool_size': pool_size,
+                    'max_overflow': max_overflow,
+                    'validate_interval': 0,
+                    'timeout': max(int(math.ceil(duration)), 1),
+                })
+                try:
+                    run = run_workload(
+                        mysql_pool, threads, duration, mix, ip_addresses
+                    )
+                finally:
+                    mysql_pool.dispose()
+                result = RunResult(threads, pool_size, max_overflow, **run)
+                MODULE_LOGGER.debug('Pool simulation: %s' % (result,))
+                results.append(result)
+    return results
+
+
+def recommend(results, target_p99):
+    """Choose settings for each thread count: run with fewest connections
+    among runs without timeouts and with p99 checkout wait within target,
+    run with lowest p99 wait if there is no such run
+
+    :param results: RunResult of each run.
+    :type results: list.
+    :param target_p99: Target p99 of checkout wait in milliseconds.
+    :type target_p99: float.
+    :returns: dict -- tuple of RunResult and True if target is met for each
+    thread count.
+
+    """
+    recommendations = {}
+    for threads in sorted(set(result.threads for result in results)):
+        runs = [result for result in results if result.threads == threads]
+        good = [
+            result for result in runs
+            if not result.timeouts and result.wait_p99 <= target_p99
+        ]
+        if good:
+            best = min(good, key=lambda result: (
+                result.pool_size + result.max_overflow, result.pool_size
+            ))
+        else:
+            best = min(runs, key=lambda result: result.wait_p99)
+        recommendations[threads] = (best, bool(good))
+    return recommendations
+
+
+def _numbers(option, opt, value, parser):
+    setattr(parser.values, option.dest,
+            [int(number) for number in value.split(',')])
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog CONFIG [options]')
+    for name, default in (('threads', [8, 32]), ('pool-sizes', [2, 5, 10]),
+                          ('max-overflows', [0, 10])):
+        parser.add_option('--' + name, type='string', action='callback',
+                          callback=_numbers, default=default,
+                          dest=name.replace('-', '_'),
+                          help='comma separated numbers')
+    parser.add_option('--duration', type='float', default=5)
+    parser.add_option('--target-p99', type='float', default=5,
+                      help='target p99 of checkout wait in ms')
+    parser.add_option('--mix', default=DEFAULT_MIX)
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected CONFIG')
+    results = simulate(
+        args[0], options.threads, options.pool_sizes, options.max_overflows,
+        options.duration, parse_mix(options.mix)
+    )
+    print('threads size overflow    calls/s  wait p50  wait p99  call p99'
+          '  overflow used  timeouts')
+    for result in results:
+        print('%7s %4s %8s %10.1f %9.2f %9.2f %9.2f %14s %9s' % (
+            result.threads, result.pool_size, result.max_overflow,
+            result.throughput, result.wait_p50, result.wait_p99,
+            result.call_p99, result.overflow_used, result.timeouts
+        ))
+    recommendations = recommend(results, options.target_p99)
+    for threads, (result, met) in sorted(recommendations.items()):
+        print('%s threads: pool_size=%s max_overflow=%s%s' % (
+            threads, result.pool_size, result.max_overflow,
+            '' if met else ' (p99 wait %.2f ms, target not met)'
+            % result.wait_p99
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import time
+import unittest
+
+import sqlalchemy.pool as pool
+
+import dbapi
+from pool_simulator import (RunResult, parse_mix, percentile, recommend,
+                            run_workload)
+
+
+class FakeConnection(object):
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def find_ip_list_type(connection, ip_address):
+    time.sleep(0.002)
+
+
+def slow_function(connection, ip_address):
+    time.sleep(0.1)
+
+
+def result(threads, pool_size, max_overflow, wait_p99, timeouts=0):
+    return RunResult(threads, pool_size, max_overflow, 100, timeouts, 100.0,
+                     0.0, wait_p99, wait_p99, 0)
+
+
+class PoolSimulatorTest(unittest.TestCase):
+
+    def test_parse_mix(self):
+        self.assertEquals(
+            parse_mix('find_ip_list_type=3, get_ip_score'),
+            [(dbapi.find_ip_list_type, 3), (dbapi.get_ip_score, 1)]
+        )
+        self.assertRaises(ValueError, parse_mix, 'delete_ip=1')
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEquals(percentile(values, 0.5), 50)
+        self.assertEquals(percentile(values, 0.99), 99)
+        self.assertEquals(percentile([], 0.99), 0.0)
+
+    def test_run_workload(self):
+        mysql_pool = pool.QueuePool(FakeConnection, pool_size=1,
+                                    max_overflow=1, timeout=5)
+        run = run_workload(
+            mysql_pool, 6, 0.2, [(find_ip_list_type, 1)], ['1.1.1.1']
+        )
+        self.assertTrue(run['calls'] > 0)
+        self.assertEquals(run['timeouts'], 0)
+        self.assertEquals(run['overflow_used'], 1)
+        # six threads share two connections, most of them wait
+        self.assertTrue(run['wait_p99'] > 1)
+        self.assertTrue(run['wait_p50'] <= run['wait_p99'])
+
+    def test_timed_out_waits_are_counted(self):
+        mysql_pool = pool.QueuePool(FakeConnection, pool_size=1,
+                                    max_overflow=0, timeout=0.05)
+        run = run_workload(
+            mysql_pool, 2, 0.3, [(slow_function, 1)], ['1.1.1.1']
+        )
+        self.assertTrue(run['timeouts'] > 0)
+        self.assertTrue(run['wait_p99'] >= 50)
+
+    def test_recommend(self):
+        results = [
+            result(8, 2, 0, 30.0),
+            result(8, 2, 10, 1.0),
+            result(8, 5, 0, 2.0),
+            result(8, 10, 0, 0.1),
+            result(32, 2, 0, 90.0, timeouts=3),
+            result(32, 5, 10, 20.0),
+        ]
+        recommendations = recommend(results, 5)
+        best, met = recommendations[8]
+        self.assertTrue(met)
+        self.assertEquals((best.pool_size, best.max_overflow), (5, 0))
+        best, met = recommendations[32]
+        self.assertFalse(met)
+        self.assertEquals((best.pool_size, best.max_overflow), (5, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
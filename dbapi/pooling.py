@@ -1,22 +1,293 @@
+import threading
+import time
+
 import sqlalchemy.pool as pool
+from sqlalchemy import event, exc
 
 from mysql_connector import get_database_connection
 from config_parser import get_section_settings
+from dbapi_exceptions import ConnectionError
+from logging_conf import create_logger
+
+MODULE_LOGGER = create_logger('logging.cfg', 'connector')
+
+# values used when [Pooling] section doesn't contain health check options
+HEALTH_DEFAULTS = {
+    'pre_ping': '1',
+    'validate_interval': '0',
+    'reconnect_retries': '3',
+    'reconnect_backoff': '0.1',
+    'reconnect_max_delay': '2',
+    'breaker_threshold': '5',
+    'breaker_reset': '10',
+}
+
+
+class PoolHealth(object):
+    """Thread safe counters of pool health checks and reconnects"""
+
+    COUNTERS = (
+        'connects',
+        'connect_failures',
+        'reconnect_attempts',
+        'fast_failures',
+        'pings',
+        'ping_failures',
+        'validations',
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def increment(self, counter):
+        """Increase counter by one"""
+        with self._lock:
+            self.counters[counter] += 1
+
+    def snapshot(self):
+        """Return copy of all counters as a dictionary"""
+        with self._lock:
+            return dict(self.counters)
+
+
+class CircuitBreaker(object):
+    """Stops connection attempts after several consecutive failures.
+
+    Breaker is closed while database is reachable. After threshold failures
+    in a row it opens and all attempts fail at once during reset_timeout
+    seconds, then it becomes half-open and lets one attempt through, which
+    closes it again on success or opens it on failure.
+
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold, reset_timeout, clock=time.time):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Check if connection attempt can be made now"""
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_running:
+                # only one trial attempt at a time
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._failures >= self.threshold:
+                self._opened_at = self._clock()
+
 
+class PoolValidator(threading.Thread):
+    """Background thread which periodically checks out an idle connection
+    of the pool, so it is pinged and replaced if dead before clients get
+    it. One connection is validated per interval, pool returns the oldest
+    idle connection first, so all of them are validated in turn."""
 
-def create_pool(config):
+    def __init__(self, mysql_pool, interval):
+        threading.Thread.__init__(self, name='PoolValidator')
+        self.daemon = True
+        self.pool = mysql_pool
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.validate()
+
+    def validate(self):
+        """Check out and return one idle connection, clients are not kept
+        waiting and no overflow connection is opened"""
+        if not self.pool.checkedin():
+            return
+        try:
+            connection = self.pool.connect()
+        except (exc.SQLAlchemyError, ConnectionError) as error:
+            MODULE_LOGGER.error('Pool validation failed: %s' % error)
+            return
+        self.pool.health.increment('validations')
+        connection.close()
+
+    def stop(self):
+        self._stopped.set()
+
+
+class HealthCheckedPool(pool.QueuePool):
+    """QueuePool created by create_pool, keeps health counters, circuit
+    breaker and background validator. Validator is stopped when pool is
+    disposed, recreated pool shares counters and breaker and starts its own
+    validator."""
+
+    health = None
+    breaker = None
+    validator = None
+    validate_interval = 0
+
+    def start_validator(self, interval):
+        """Validate idle connections every interval seconds, never if
+        interval is not greater than zero"""
+        self.validate_interval = interval
+        if interval > 0:
+            self.validator = PoolValidator(self, interval)
+            self.validator.start()
+
+    def dispose(self):
+        validator, self.validator = self.validator, None
+        if validator is not None:
+            validator.stop()
+            # validation running now would check out connections again
+            validator.join()
+        pool.QueuePool.dispose(self)
+
+    def recreate(self):
+        new_pool = pool.QueuePool.recreate(self)
+        new_pool.health = self.health
+        new_pool.breaker = self.breaker
+        new_pool.start_validator(self.validate_interval)
+        return new_pool
+
+
+def _ping_connection(health):
+    """Create checkout listener which pings connection taken from the pool.
+    Raising DisconnectionError makes pool discard connection and retry
+    with a new one."""
+    def ping_connection(dbapi_connection, connection_record,
+                        connection_proxy):
+        health.increment('pings')
+        try:
+            dbapi_connection.ping()
+        except Exception as ping_error:
+            health.increment('ping_failures')
+            MODULE_LOGGER.error('Dead connection in pool: %s' % ping_error)
+            raise exc.DisconnectionError()
+    return ping_connection
+
+
+def _reconnecting_creator(config, section, settings, health, breaker):
+    """Create function which connects to database with exponential backoff
+    between attempts and fails fast while circuit breaker is open. Only
+    ConnectionError is retried, every failure is recorded by breaker."""
+    retries = int(settings['reconnect_retries'])
+    backoff = float(settings['reconnect_backoff'])
+    max_delay = float(settings['reconnect_max_delay'])
+
+    def create_connection():
+        if not breaker.allow():
+            health.increment('fast_failures')
+            raise ConnectionError
+        delay = backoff
+        for attempt in xrange(retries + 1):
+            try:
+                connection = get_database_connection(config, section)
+            except Exception as error:
+                # failed half-open trial must be recorded or breaker
+                # never lets another attempt through
+                health.increment('connect_failures')
+                breaker.record_failure()
+                if not isinstance(error, ConnectionError) or \
+                        attempt == retries or not breaker.allow():
+                    raise
+                health.increment('reconnect_attempts')
+                time.sleep(delay)
+                delay = min(delay * 2, max_delay)
+            else:
+                breaker.record_success()
+                health.increment('connects')
+                return connection
+    return create_connection
+
+
+def create_pool(config, section='MySQL settings', overrides=None):
     """Create a pool of database connections
 
+    Connections are pinged on checkout if pre_ping option is set, idle
+    connections are validated in background every validate_interval seconds
+    if it's greater than zero, until pool is disposed. Failed connects are
+    retried reconnect_retries times with exponential backoff starting at
+    reconnect_backoff seconds and limited by reconnect_max_delay, after
+    breaker_threshold failures in a row new connects fail at once for
+    breaker_reset seconds. Health counters are available through
+    get_pool_health.
+
     :param config: String with name of configuration file which contains
     connection settings.
+    :param section: Name of config section with database connection
+    settings.
+    :param overrides: Options used instead of ones from [Pooling] section.
+    :type overrides: dict.
 
     """
-    pool_settings = get_section_settings(config, 'Pooling')
-    mysql_pool = pool.QueuePool(
-        lambda: get_database_connection(config, 'MySQL settings'),
+    pool_settings = dict(HEALTH_DEFAULTS)
+    pool_settings.update(get_section_settings(config, 'Pooling'))
+    pool_settings.update(overrides or {})
+    health = PoolHealth()
+    breaker = CircuitBreaker(
+        int(pool_settings['breaker_threshold']),
+        float(pool_settings['breaker_reset'])
+    )
+    mysql_pool = HealthCheckedPool(
+        _reconnecting_creator(
+            config, section, pool_settings, health, breaker
+        ),
         pool_size=int(pool_settings['pool_size']),
         max_overflow=int(pool_settings['max_overflow']),
         timeout=int(pool_settings['timeout']),
         recycle=int(pool_settings['recycle'])
     )
+    mysql_pool.health = health
+    mysql_pool.breaker = breaker
+    if int(pool_settings['pre_ping']):
+        event.listen(mysql_pool, 'checkout', _ping_connection(health))
+    mysql_pool.start_validator(float(pool_settings['validate_interval']))
     return mysql_pool
+
+
+def get_pool_health(mysql_pool):
+    """Return health metrics of pool created by create_pool
+
+    :param mysql_pool: Pool of database connections.
+    :type mysql_pool: sqlalchemy.pool.QueuePool.
+    :returns: dict -- health counters, circuit breaker state and pool
+    connection counters.
+
+    """
+    metrics = mysql_pool.health.snapshot()
+    metrics['breaker_state'] = mysql_pool.breaker.state
+    metrics['checkedin'] = mysql_pool.checkedin()
+    metrics['checkedout'] = mysql_pool.checkedout()
+    metrics['overflow'] = mysql_pool.overflow()
+    return metrics
@@ -1,5 +1,9 @@
 import unittest
-from pooling import create_pool
+
+from dbapi_exceptions import ConfigError
+from pooling import (CircuitBreaker, HEALTH_DEFAULTS, PoolHealth,
+                     PoolValidator, _reconnecting_creator, create_pool,
+                     get_pool_health)
 
 
 class PoolingTest(unittest.TestCase):
@@ -8,7 +12,7 @@ class PoolingTest(unittest.TestCase):
         self.pool = create_pool('dbapi.cfg')
 
     def tearDown(self):
-        self.pool = self.pool.recreate()
+        self.pool.dispose()
 
     def test_empty_pool(self):
         self.assertEquals(self.pool.overflow(), -5)
@@ -22,5 +26,133 @@ class PoolingTest(unittest.TestCase):
         self.assertEquals(self.pool.checkedout(), 0)
 
 
+    def test_pool_health(self):
+        connection = self.pool.connect()
+        connection.close()
+        health = get_pool_health(self.pool)
+        self.assertEquals(health['connects'], 1)
+        self.assertEquals(health['ping_failures'], 0)
+        self.assertEquals(health['breaker_state'], CircuitBreaker.CLOSED)
+
+
+class FakeConnection(object):
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def close(self):
+        self.pool.idle += 1
+
+
+class FakePool(object):
+
+    def __init__(self, idle):
+        self.idle = idle
+        self.health = PoolHealth()
+
+    def checkedin(self):
+        return self.idle
+
+    def connect(self):
+        self.idle -= 1
+        return FakeConnection(self)
+
+
+class PoolValidatorTest(unittest.TestCase):
+
+    def test_validates_one_connection(self):
+        fake_pool = FakePool(3)
+        validator = PoolValidator(fake_pool, 1)
+        validator.validate()
+        self.assertEquals(fake_pool.health.snapshot()['validations'], 1)
+        self.assertEquals(fake_pool.idle, 3)
+        fake_pool.idle = 0
+        validator.validate()
+        self.assertEquals(fake_pool.health.snapshot()['validations'], 1)
+
+
+class ReconnectingCreatorTest(unittest.TestCase):
+
+    def test_any_error_is_recorded_by_breaker(self):
+        now = [0]
+        health = PoolHealth()
+        breaker = CircuitBreaker(1, 10, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 10
+        # missing section raises ConfigError, not ConnectionError
+        create_connection = _reconnecting_creator(
+            'test_config.cfg', 'No such section', HEALTH_DEFAULTS, health,
+            breaker
+        )
+        self.assertRaises(ConfigError, create_connection)
+        self.assertEquals(breaker.state, CircuitBreaker.OPEN)
+        self.assertEquals(health.snapshot()['reconnect_attempts'], 0)
+        now[0] = 20
+        # next trial is let through
+        self.assertTrue(breaker.allow())
+
+
+class HealthCheckedPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        # pool doesn't connect until connection is checked out
+        self.pool = create_pool('test_config.cfg')
+
+    def tearDown(self):
+        self.pool.dispose()
+
+    def test_dispose_stops_validator(self):
+        validator = self.pool.validator
+        self.assertTrue(validator.is_alive())
+        self.pool.dispose()
+        self.assertFalse(validator.is_alive())
+        self.assertIsNone(self.pool.validator)
+
+    def test_recreate(self):
+        new_pool = self.pool.recreate()
+        try:
+            self.assertIs(new_pool.health, self.pool.health)
+            self.assertIs(new_pool.breaker, self.pool.breaker)
+            self.assertIsNot(new_pool.validator, self.pool.validator)
+            self.assertTrue(new_pool.validator.is_alive())
+            self.assertEquals(new_pool.validator.interval, 30)
+            self.assertEquals(get_pool_health(new_pool)['connects'], 0)
+        finally:
+            new_pool.dispose()
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.breaker = CircuitBreaker(2, 10, clock=lambda: self.now)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEquals(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_after_reset_timeout(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now = 10
+        self.assertEquals(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        # only one trial connection at a time
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEquals(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_trial_opens_again(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now = 10
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEquals(self.breaker.state, CircuitBreaker.OPEN)
+
+
 if __name__ == '__main__':
     unittest.main()
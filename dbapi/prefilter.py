@@ -0,0 +1,291 @@
+"""Module implements approximate membership prefilter for ip address lookups.
+Bloom filter built from address tables answers "definitely not in database"
+without query, only possible hits go to MySQL. Addresses inserted by dbapi,
+bulk_load, feed_import and export are added to filter through dbapi insert
+listener, deleted addresses stay in filter until rebuild.
+:classes: BloomFilter, AddressPrefilter"""
+import hashlib
+import math
+import struct
+import threading
+import time
+from binascii import hexlify
+
+import MySQLdb as mdb
+from netaddr import IPAddress
+from netaddr.core import AddrFormatError
+
+import dbapi
+from dbapi_exceptions import IPAddressError, SQLSyntaxError
+from logging_conf import create_logger
+from slow_query import server_side_cursor
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+# bits count, hash functions count and number of added keys
+HEADER = struct.Struct('!QQQ')
+
+
+class BloomFilter(object):
+    """Bloom filter with double hashing over md5 digest of key"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        :param capacity: Expected number of keys.
+        :type capacity: int.
+        :param error_rate: False positive rate when filter has capacity
+        keys.
+        :type error_rate: float.
+
+        """
+        capacity = max(int(capacity), 1)
+        self.size = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        ))
+        self.hashes = max(1, int(round(
+            float(self.size) / capacity * math.log(2)
+        )))
+        self.count = 0
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.md5(key).digest()
+        first, second = struct.unpack('!QQ', digest)
+        for number in xrange(self.hashes):
+            yield (first + number * second) % self.size
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def save(self, filename):
+        """Write filter to file"""
+        with open(filename, 'wb') as filter_file:
+            filter_file.write(HEADER.pack(self.size, self.hashes, self.count))
+            filter_file.write(self.bits)
+
+    @classmethod
+    def load(cls, filename):
+        """Read filter saved by save method"""
+        bloom_filter = cls.__new__(cls)
+        with open(filename, 'rb') as filter_file:
+            bloom_filter.size, bloom_filter.hashes, bloom_filter.count = \
+                HEADER.unpack(filter_file.read(HEADER.size))
+            bloom_filter.bits = bytearray(filter_file.read())
+        if len(bloom_filter.bits) != (bloom_filter.size + 7) // 8:
+            raise Exception("Bloom filter file %s is damaged" % filename)
+        return bloom_filter
+
+
+def address_key(ip_version, value):
+    """Return filter key of address with given version and integer value"""
+    return '%s:%x' % (ip_version, value)
+
+
+def ip_address_key(ip_address):
+    """Return filter key of ip address in string form"""
+    try:
+        ip = IPAddress(ip_address)
+    except AddrFormatError:
+        raise IPAddressError
+    return address_key(ip.version, ip.value)
+
+
+class AddressPrefilter(object):
+    """Bloom filter of all addresses in database in front of dbapi lookups
+
+        prefilter = AddressPrefilter(error_rate=0.001)
+        prefilter.build(connection)
+        prefilter.check_if_ip_in_database(connection, '192.168.1.1')
+        prefilter.close()
+
+    """
+
+    def __init__(self, error_rate=0.01, rebuild_interval=None,
+                 max_deletions=None, headroom=1.5):
+        """
+        :param error_rate: False positive rate of filter.
+        :type error_rate: float.
+        :param rebuild_interval: Seconds after which maybe_rebuild rebuilds
+        filter, never if not set.
+        :type rebuild_interval: float.
+        :param max_deletions: Number of deletions after which maybe_rebuild
+        rebuilds filter, never if not set.
+        :type max_deletions: int.
+        :param headroom: Filter capacity relative to number of addresses in
+        database, leaves room for inserts between rebuilds.
+        :type headroom: float.
+
+        """
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self.max_deletions = max_deletions
+        self.headroom = headroom
+        self.filter = None
+        self.built_at = None
+        self.deletions = 0
+        self._lock = threading.Lock()
+        # keys of addresses inserted while build reads address tables
+        self._building = None
+        self.stats = {'checks': 0, 'skipped': 0, 'false_positives': 0}
+        dbapi.add_insert_listener(self._inserted)
+
+    def close(self):
+        """Stop adding inserted addresses to filter"""
+        if self._inserted in dbapi.INSERT_LISTENERS:
+            dbapi.remove_insert_listener(self._inserted)
+
+    def _inserted(self, ip_version, values):
+        keys = [address_key(ip_version, value) for value in values]
+        with self._lock:
+            if self._building is not None:
+                self._building.extend(keys)
+            if self.filter is not None:
+                for key in keys:
+                    self.filter.add(key)
+
+    def build(self, connection, batch_size=10000):
+        """Build new filter from address tables and replace old one"""
+        with self._lock:
+            self._building = []
+        cursor = connection.cursor(server_side_cursor())
+        try:
+            cursor.execute('''
+            SELECT (SELECT COUNT(*) FROM ipv4_addresses)
+                + (SELECT COUNT(*) FROM ipv6_addresses)''')
+            total = cursor.fetchone()[0]
+            cursor.fetchall()
+            bloom_filter = BloomFilter(
+                total * self.headroom, self.error_rate
+            )
+            for ip_version in (4, 6):
+                cursor.execute(
+                    'SELECT address FROM ipv%s_addresses' % ip_version
+                )
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for (value,) in rows:
+                        if ip_version == 6:
+                            value = int(hexlify(value), 16)
+                        bloom_filter.add(address_key(ip_version, value))
+        except mdb.ProgrammingError as mdb_error:
+            with self._lock:
+                self._building = None
+            MODULE_LOGGER.error(mdb_error.message)
+            raise SQLSyntaxError
+        finally:
+            cursor.close()
+        with self._lock:
+            # rows inserted during build may be missed by its reads
+            for key in self._building:
+                bloom_filter.add(key)
+            self._building = None
+            self.filter = bloom_filter
+            self.built_at = time.time()
+            self.deletions = 0
+        MODULE_LOGGER.debug(
+            'Built address prefilter of %s addresses' % bloom_filter.count
+        )
+
+    def rebuild_due(self):
+        """Check if filter is too old or has too many deleted addresses"""
+        if self.filter is None:
+            return True
+        if self.max_deletions is not None and \
+                self.deletions >= self.max_deletions:
+            return True
+        if self.rebuild_interval is not None:
+            return time.time() - self.built_at >= self.rebuild_interval
+        return False
+
+    def maybe_rebuild(self, connection):
+        """Rebuild filter if rebuild_due, should be called periodically"""
+        if self.rebuild_due():
+            self.build(connection)
+            return True
+        return False
+
+    def save(self, filename):
+        self.filter.save(filename)
+
+    def load(self, filename):
+        """Load filter saved earlier for warm start. Changes made in
+        database after it was saved are not in the filter, so rebuild it
+        soon or load only filters saved at shutdown."""
+        bloom_filter = BloomFilter.load(filename)
+        with self._lock:
+            self.filter = bloom_filter
+            self.built_at = time.time()
+            self.deletions = 0
+
+    def add(self, ip_address):
+        """Add ip address to filter, does nothing before build or load"""
+        key = ip_address_key(ip_address)
+        with self._lock:
+            if self.filter is not None:
+                self.filter.add(key)
+
+    def might_contain(self, ip_address):
+        """Check filter, False means ip address is not in database. Every
+        address may be in database before filter is built or loaded."""
+        key = ip_address_key(ip_address)
+        bloom_filter = self.filter
+        if bloom_filter is None:
+            return True
+        return key in bloom_filter
+
+    def _check(self, ip_address):
+        might_contain = self.might_contain(ip_address)
+        with self._lock:
+            self.stats['checks'] += 1
+            if not might_contain:
+                self.stats['skipped'] += 1
+        return might_contain
+
+    def check_if_ip_in_database(self, connection, ip_address):
+        """Same as dbapi.check_if_ip_in_database, queries database only if
+        address may be in it"""
+        if not self._check(ip_address):
+            return False
+        result = dbapi.check_if_ip_in_database(connection, ip_address)
+        if not result:
+            with self._lock:
+                self.stats['false_positives'] += 1
+        return result
+
+    def find_ip_list_type(self, connection, ip_address):
+        """Same as dbapi.find_ip_list_type, queries database only if
+        address may be in it"""
+        if not self._check(ip_address):
+            return None
+        return dbapi.find_ip_list_type(connection, ip_address)
+
+    def insert_ip_into_db(self, connection, ip_address):
+        """Insert ip address in database, insert listener adds it to
+        filter"""
+        dbapi.insert_ip_into_db(connection, ip_address)
+
+    def delete_ip(self, connection, ip_address):
+        """Delete ip address from database, it stays in filter until
+        rebuild"""
+        dbapi.delete_ip(connection, ip_address)
+        with self._lock:
+            self.deletions += 1
+
+    def delete_ips(self, connection, ip_addresses):
+        """Delete many ip addresses from database, they stay in filter
+        until rebuild"""
+        deleted = dbapi.delete_ips(connection, ip_addresses)
+        with self._lock:
+            self.deletions += deleted
+        return deleted
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import unittest
+
+from netaddr import IPAddress
+
+import dbapi
+from prefilter import AddressPrefilter, BloomFilter, ip_address_key
+
+
+class FakeCursor(object):
+
+    def execute(self, sql):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def cursor(self):
+        return FakeCursor()
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bloom_filter = BloomFilter(10000, 0.01)
+        self.keys = ['4:%x' % value for value in xrange(10000)]
+        for key in self.keys:
+            self.bloom_filter.add(key)
+
+    def test_no_false_negatives(self):
+        for key in self.keys:
+            self.assertIn(key, self.bloom_filter)
+
+    def test_false_positive_rate(self):
+        false_positives = sum(
+            '6:%x' % value in self.bloom_filter for value in xrange(10000)
+        )
+        self.assertTrue(false_positives < 200)
+
+    def test_save_and_load(self):
+        descriptor, filename = tempfile.mkstemp()
+        os.close(descriptor)
+        try:
+            self.bloom_filter.save(filename)
+            loaded = BloomFilter.load(filename)
+        finally:
+            os.remove(filename)
+        self.assertEquals(loaded.count, 10000)
+        self.assertEquals(loaded.bits, self.bloom_filter.bits)
+        self.assertIn(self.keys[0], loaded)
+
+
+class AddressPrefilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.prefilter = AddressPrefilter(max_deletions=1)
+        self.prefilter.filter = BloomFilter(100)
+
+    def tearDown(self):
+        self.prefilter.close()
+
+    def test_ip_address_key(self):
+        self.assertEquals(ip_address_key('192.168.1.1'), '4:c0a80101')
+        self.assertEquals(
+            ip_address_key('::1'),
+            ip_address_key(str(IPAddress(1, 6)))
+        )
+
+    def test_add(self):
+        self.assertFalse(self.prefilter.might_contain('192.168.1.1'))
+        self.prefilter.add('192.168.1.1')
+        self.assertTrue(self.prefilter.might_contain('192.168.1.1'))
+
+    def test_inserted_addresses_are_added(self):
+        dbapi.insert_ip_into_db(FakeConnection(), '192.168.1.1')
+        self.assertTrue(self.prefilter.might_contain('192.168.1.1'))
+        dbapi.notify_inserted(6, [IPAddress('fe80::1').value])
+        self.assertTrue(self.prefilter.might_contain('fe80::1'))
+        self.prefilter.close()
+        dbapi.notify_inserted(4, [IPAddress('10.0.0.1').value])
+        self.assertFalse(self.prefilter.might_contain('10.0.0.1'))
+
+    def test_absent_address_skips_database(self):
+        self.assertFalse(
+            self.prefilter.check_if_ip_in_database(None, '192.168.1.1')
+        )
+        self.assertIsNone(
+            self.prefilter.find_ip_list_type(None, '192.168.1.1')
+        )
+        self.assertEquals(self.prefilter.stats['skipped'], 2)
+
+    def test_lookups_before_build_query_database(self):
+        self.prefilter.filter = None
+        check_if_ip_in_database = dbapi.check_if_ip_in_database
+        dbapi.check_if_ip_in_database = lambda connection, ip: True
+        try:
+            self.prefilter.add('192.168.1.1')
+            self.assertTrue(self.prefilter.might_contain('10.0.0.1'))
+            self.assertTrue(
+                self.prefilter.check_if_ip_in_database(None, '10.0.0.1')
+            )
+        finally:
+            dbapi.check_if_ip_in_database = check_if_ip_in_database
+        self.assertEquals(self.prefilter.stats['skipped'], 0)
+
+    def test_rebuild_due(self):
+        self.assertFalse(self.prefilter.rebuild_due())
+        self.prefilter.deletions = 1
+        self.assertTrue(self.prefilter.rebuild_due())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,313 @@
+"""Module implements in-memory prefix trie (Patricia tree) of ip networks for
+longest-prefix match, subnet containment and enumeration of stored prefixes
+under a network. Trie is path compressed binary tree, nodes use __slots__
+and keep prefix as an integer, so millions of prefixes fit in memory.
+:classes: PrefixTrie
+:functions: build_address_trie"""
+from binascii import hexlify
+
+import MySQLdb as mdb
+from netaddr import IPAddress, IPNetwork
+
+import dbapi
+from dbapi_exceptions import SQLSyntaxError
+from logging_conf import create_logger
+from slow_query import server_side_cursor
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+ADDRESS_WIDTH = {4: 32, 6: 128}
+
+
+class _Node(object):
+    """Trie node, glue nodes which only join two branches have no data"""
+
+    __slots__ = ('key', 'length', 'left', 'right', 'data', 'has_data')
+
+    def __init__(self, key, length):
+        self.key = key
+        self.length = length
+        self.left = None
+        self.right = None
+        self.data = None
+        self.has_data = False
+
+    def child(self, bit):
+        return self.right if bit else self.left
+
+    def set_child(self, bit, node):
+        if bit:
+            self.right = node
+        else:
+            self.left = node
+
+    def children_count(self):
+        return (self.left is not None) + (self.right is not None)
+
+
+class PrefixTrie(object):
+    """Patricia tree of ip prefixes of one ip version. Prefixes are given
+    as address value and prefix length, or as strings by *_network methods.
+
+        trie = PrefixTrie(4)
+        trie.insert_network('10.0.0.0/8', 'blacklist')
+        trie.lookup('10.1.2.3')  # ('10.0.0.0/8', 'blacklist')
+
+    """
+
+    def __init__(self, ip_version):
+        self.version = ip_version
+        self.width = ADDRESS_WIDTH[ip_version]
+        self._root = _Node(0, 0)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _bit(self, key, position):
+        """Return bit of key at position counted from most significant"""
+        return (key >> (self.width - 1 - position)) & 1
+
+    def _mask(self, key, length):
+        """Zero all bits of key after first length bits"""
+        if length == 0:
+            return 0
+        return key & (((1 << length) - 1) << (self.width - length))
+
+    def _common_length(self, key, other_key, limit):
+        """Return length of common prefix of two keys, at most limit"""
+        difference = key ^ other_key
+        if not difference:
+            return limit
+        return min(limit, self.width - difference.bit_length())
+
+    def _matches(self, node, key):
+        """Check if key starts with node prefix"""
+        return self._common_length(node.key, key, node.length) == node.length
+
+    def insert(self, key, length, data=True):
+        """Insert prefix or replace data of existing prefix
+
+        :param key: Network address value.
+        :type key: int.
+        :param length: Prefix length.
+        :type length: int.
+        :param data: Value stored with prefix.
+
+        """
+        if not 0 <= length <= self.width:
+            raise ValueError("Wrong prefix length %s" % length)
+        key = self._mask(key, length)
+        node = self._root
+        while node.length != length:
+            bit = self._bit(key, node.length)
+            child = node.child(bit)
+            if child is None:
+                child = _Node(key, length)
+                node.set_child(bit, child)
+                node = child
+                break
+            common = self._common_length(
+                child.key, key, min(child.length, length)
+            )
+            if common == child.length:
+                node = child
+                continue
+            # new prefix splits edge between node and child
+            split = _Node(self._mask(key, common), common)
+            node.set_child(bit, split)
+            split.set_child(self._bit(child.key, common), child)
+            if common == length:
+                node = split
+            else:
+                node = _Node(key, length)
+                split.set_child(self._bit(key, common), node)
+            break
+        if not node.has_data:
+            self._size += 1
+        node.data = data
+        node.has_data = True
+
+    def _find(self, key, length):
+        """Return path of nodes from root to node with exact prefix, None
+        if there is no such prefix"""
+        key = self._mask(key, length)
+        path = [self._root]
+        node = self._root
+        while node.length < length:
+            node = node.child(self._bit(key, node.length))
+            if node is None or node.length > length or \
+                    not self._matches(node, key):
+                return None
+            path.append(node)
+        if node.length != length or not node.has_data:
+            return None
+        return path
+
+    def get(self, key, length):
+        """Return data of exact prefix, None if there is no such prefix"""
+        path = self._find(key, length)
+        return path[-1].data if path else None
+
+    def delete(self, key, length):
+        """Remove prefix, nodes which are not needed anymore are merged
+
+        :returns: bool -- True if prefix was in trie.
+
+        """
+        path = self._find(key, length)
+        if path is None:
+            return False
+        node = path[-1]
+        node.data = None
+        node.has_data = False
+        self._size -= 1
+        # remove or bypass nodes without data that have less than 2 children
+        while len(path) > 1:
+            node = path.pop()
+            if node.has_data or node.children_count() == 2:
+                break
+            parent = path[-1]
+            bit = self._bit(node.key, parent.length)
+            parent.set_child(bit, node.left or node.right)
+        return True
+
+    def longest_prefix_match(self, key):
+        """Return longest stored prefix which contains address
+
+        :param key: Address value.
+        :type key: int.
+        :returns: tuple -- key, length and data of prefix, None if address
+        isn't in any stored prefix.
+
+        """
+        best = None
+        node = self._root
+        while node is not None and self._matches(node, key):
+            if node.has_data:
+                best = node
+            if node.length == self.width:
+                break
+            node = node.child(self._bit(key, node.length))
+        if best is None:
+            return None
+        return best.key, best.length, best.data
+
+    def contains(self, key):
+        """Check if address is in any stored prefix"""
+        return self.longest_prefix_match(key) is not None
+
+    def subtree(self, key, length):
+        """Generate all stored prefixes inside network in address order
+
+        :param key: Network address value.
+        :type key: int.
+        :param length: Prefix length of network.
+        :type length: int.
+        :returns: generator of tuples with key, length and data of prefix.
+
+        """
+        key = self._mask(key, length)
+        node = self._root
+        while node is not None and node.length < length:
+            if not self._matches(node, key):
+                return
+            node = node.child(self._bit(key, node.length))
+        if node is None or \
+                self._common_length(node.key, key, length) != length:
+            return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.has_data:
+                yield node.key, node.length, node.data
+            # right is pushed first, so left branch with lower addresses
+            # is visited first
+            if node.right is not None:
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
+
+    def _network(self, network):
+        network = IPNetwork(network)
+        if network.version != self.version:
+            raise ValueError("Trie is for ipv%s networks" % self.version)
+        return network.network.value, network.prefixlen
+
+    def _format(self, key, length):
+        return '%s/%s' % (IPAddress(key, self.version), length)
+
+    def insert_network(self, network, data=True):
+        """Insert network given as string like '10.0.0.0/8'"""
+        self.insert(*self._network(network), data=data)
+
+    def delete_network(self, network):
+        """Remove network given as string"""
+        return self.delete(*self._network(network))
+
+    def lookup(self, ip_address):
+        """Return longest network with ip address as string and its data,
+        None if ip address isn't in any network"""
+        match = self.longest_prefix_match(IPAddress(ip_address).value)
+        if match is None:
+            return None
+        return self._format(match[0], match[1]), match[2]
+
+    def networks_under(self, network):
+        """Generate pairs of network string and data for prefixes inside
+        network"""
+        for key, length, data in self.subtree(*self._network(network)):
+            yield self._format(key, length), data
+
+
+def build_address_trie(connection, ip_version, list_type=None,
+                       batch_size=10000):
+    """Build trie of stored addresses, each address is a full length prefix
+    with list type or None as data
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param ip_version: Version of ip addresses (4 or 6).
+    :type ip_version: int.
+    :param list_type: 'whitelist' or 'blacklist' to load only addresses of
+    that list, all addresses if not set.
+    :type list_type: str.
+    :returns: PrefixTrie -- trie of addresses.
+
+    """
+    if list_type and dbapi.LIST_MEMBERSHIP:
+        sql = '''
+        SELECT ipv{0}_addresses.address, "{1}" FROM ipv{0}_addresses
+        JOIN list_membership
+            ON list_membership.address_version = {0}
+            AND list_membership.address_id = ipv{0}_addresses.id
+        WHERE list_membership.list_type = "{1}"'''
+    elif list_type:
+        sql = '''
+        SELECT ipv{0}_addresses.address, "{1}" FROM ipv{0}_addresses
+        JOIN {1} ON {1}.v{0}_id_{1} = ipv{0}_addresses.id'''
+    else:
+        sql = '''
+        SELECT ipv{0}_addresses.address, NULL FROM ipv{0}_addresses'''
+    trie = PrefixTrie(ip_version)
+    cursor = connection.cursor(server_side_cursor())
+    try:
+        cursor.execute(sql.format(ip_version, list_type))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for value, data in rows:
+                if ip_version == 6:
+                    value = int(hexlify(value), 16)
+                trie.insert(value, trie.width, data)
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug(
+        'Built ipv%s trie of %s list, %s prefixes'
+        % (ip_version, list_type, len(trie))
+    )
+    return trie
@@ -0,0 +1,40 @@
+"""Benchmark of prefix trie build time, lookup latency and memory for
+millions of random ipv4 prefixes. No database is needed."""
+import random
+import resource
+import time
+
+from prefix_trie import PrefixTrie
+
+PREFIXES = 2000000
+LOOKUPS = 200000
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    random.seed(0)
+    trie = PrefixTrie(4)
+    rss_before = max_rss_mb()
+    start = time.time()
+    for _ in xrange(PREFIXES):
+        trie.insert(random.getrandbits(32), random.randint(16, 32))
+    elapsed = time.time() - start
+    print('insert: %d prefixes in %.1f s, %.1f us per insert'
+          % (len(trie), elapsed, elapsed / PREFIXES * 1e6))
+    print('memory: %.1f MB, %.1f bytes per prefix'
+          % (max_rss_mb() - rss_before,
+             (max_rss_mb() - rss_before) * 1024 * 1024 / len(trie)))
+    addresses = [random.getrandbits(32) for _ in xrange(LOOKUPS)]
+    start = time.time()
+    found = sum(trie.contains(address) for address in addresses)
+    elapsed = time.time() - start
+    print('lookup: %.1f us per lookup, %d of %d addresses matched'
+          % (elapsed / LOOKUPS * 1e6, found, LOOKUPS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import random
+import unittest
+
+from prefix_trie import PrefixTrie
+
+
+class PrefixTrieTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = PrefixTrie(4)
+        self.trie.insert_network('10.0.0.0/8', 'ten')
+        self.trie.insert_network('10.1.0.0/16', 'ten-one')
+        self.trie.insert_network('10.1.2.3/32', 'host')
+        self.trie.insert_network('192.168.1.0/24', 'local')
+
+    def test_lookup(self):
+        self.assertEquals(
+            self.trie.lookup('10.1.2.3'), ('10.1.2.3/32', 'host')
+        )
+        self.assertEquals(
+            self.trie.lookup('10.1.2.4'), ('10.1.0.0/16', 'ten-one')
+        )
+        self.assertEquals(self.trie.lookup('10.2.0.1'), ('10.0.0.0/8', 'ten'))
+        self.assertIsNone(self.trie.lookup('11.0.0.1'))
+        self.assertEquals(len(self.trie), 4)
+
+    def test_networks_under(self):
+        self.assertEquals(
+            list(self.trie.networks_under('10.0.0.0/8')),
+            [('10.0.0.0/8', 'ten'), ('10.1.0.0/16', 'ten-one'),
+             ('10.1.2.3/32', 'host')]
+        )
+        self.assertEquals(
+            list(self.trie.networks_under('10.1.2.0/24')),
+            [('10.1.2.3/32', 'host')]
+        )
+        self.assertEquals(list(self.trie.networks_under('172.16.0.0/12')), [])
+
+    def test_delete(self):
+        self.assertTrue(self.trie.delete_network('10.1.0.0/16'))
+        self.assertFalse(self.trie.delete_network('10.1.0.0/16'))
+        self.assertEquals(self.trie.lookup('10.1.2.4'), ('10.0.0.0/8', 'ten'))
+        self.assertEquals(
+            self.trie.lookup('10.1.2.3'), ('10.1.2.3/32', 'host')
+        )
+        self.assertEquals(len(self.trie), 3)
+
+    def test_ipv6(self):
+        trie = PrefixTrie(6)
+        trie.insert_network('fe80::/10', 'link-local')
+        trie.insert_network('fe80::1/128', 'host')
+        self.assertEquals(trie.lookup('fe80::1'), ('fe80::1/128', 'host'))
+        self.assertEquals(
+            trie.lookup('fe80::2'), ('fe80::/10', 'link-local')
+        )
+        self.assertIsNone(trie.lookup('::1'))
+        self.assertRaises(ValueError, trie.insert_network, '10.0.0.0/8')
+
+    def test_random_prefixes(self):
+        random.seed(1)
+        trie = PrefixTrie(4)
+        prefixes = {}
+        for _ in xrange(2000):
+            length = random.randint(0, 32)
+            key = trie._mask(random.getrandbits(32), length)
+            prefixes[(key, length)] = key
+            trie.insert(key, length, key)
+        for key, length in random.sample(sorted(prefixes), 1000):
+            del prefixes[(key, length)]
+            self.assertTrue(trie.delete(key, length))
+        self.assertEquals(len(trie), len(prefixes))
+        for _ in xrange(2000):
+            address = random.getrandbits(32)
+            matches = [
+                (length, key) for key, length in prefixes
+                if trie._mask(address, length) == key
+            ]
+            expected = max(matches) if matches else None
+            match = trie.longest_prefix_match(address)
+            self.assertEquals(match and (match[1], match[0]), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
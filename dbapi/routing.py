@@ -0,0 +1,140 @@
+"""Module implements routing of dbapi function calls between primary database
+and its replicas. Each database is a section of config file and gets its own
+pool of connections, [Routing] section names primary section and comma
+separated replica sections:
+
+    [Routing]
+    primary=MySQL settings
+    replicas=MySQL replica 1, MySQL replica 2
+
+:classes: Router, RouterSession"""
+import itertools
+import threading
+
+from sqlalchemy import exc
+
+from config_parser import get_section_settings
+from dbapi import READ_FUNCTIONS
+from dbapi_exceptions import ConnectionError
+from logging_conf import create_logger
+from pooling import create_pool
+
+MODULE_LOGGER = create_logger('logging.cfg', 'connector')
+
+
+def is_read_function(function):
+    """Check if dbapi function only reads from database"""
+    return function.__name__ in READ_FUNCTIONS
+
+
+class Router(object):
+    """Sends read-only dbapi functions to replica pools and all other
+    functions to primary pool. Reads are balanced between replicas by number
+    of checked out connections, replicas that can't give connection are
+    skipped and primary serves reads if no replica is available.
+
+        router = Router('dbapi.cfg')
+        router.call(dbapi.find_ip_list_type, '192.168.1.1')
+        router.close()
+
+    """
+
+    def __init__(self, config):
+        """
+        :param config: String with name of configuration file which contains
+        [Routing] section and connection settings of all databases.
+
+        """
+        settings = get_section_settings(config, 'Routing')
+        self.primary = create_pool(config, settings['primary'])
+        replica_sections = [
+            section.strip()
+            for section in settings.get('replicas', '').split(',')
+            if section.strip()
+        ]
+        self.replicas = [
+            create_pool(config, section) for section in replica_sections
+        ]
+        self._counter = itertools.count()
+        self._counter_lock = threading.Lock()
+
+    def replica_order(self):
+        """Return replica pools in order they should be tried, least loaded
+        first, round robin between equally loaded ones"""
+        if not self.replicas:
+            return []
+        with self._counter_lock:
+            start = next(self._counter) % len(self.replicas)
+        rotated = self.replicas[start:] + self.replicas[:start]
+        # sort is stable, so round robin order stays between equal loads
+        return sorted(rotated, key=lambda replica: replica.checkedout())
+
+    def connect(self, read_only):
+        """Check out connection for read or write
+
+        :param read_only: True if connection is used only for reading.
+        :type read_only: bool.
+        :returns: pooled connection, close it to return it to the pool.
+
+        """
+        if read_only:
+            for replica in self.replica_order():
+                try:
+                    return replica.connect()
+                except (ConnectionError, exc.SQLAlchemyError) as error:
+                    MODULE_LOGGER.error(
+                        'Replica is not available, trying next: %s' % error
+                    )
+        return self.primary.connect()
+
+    def call(self, function, *args, **kwargs):
+        """Call dbapi function with connection from primary or replica pool
+
+        :param function: dbapi function that takes connection as a first
+        parameter.
+        :type function: function.
+        :returns: result of function.
+
+        """
+        connection = self.connect(is_read_function(function))
+        try:
+            return function(connection, *args, **kwargs)
+        finally:
+            connection.close()
+
+    def close(self):
+        """Close connections of primary and replica pools"""
+        for mysql_pool in [self.primary] + self.replicas:
+            mysql_pool.dispose()
+
+    def session(self, read_your_writes=True):
+        """Create session which can pin itself to primary after write
+
+        :param read_your_writes: If set all calls after first write go to
+        primary, so session always sees its own writes.
+        :type read_your_writes: bool.
+
+        """
+        return RouterSession(self, read_your_writes)
+
+
+class RouterSession(object):
+    """Sequence of dbapi calls of one client routed by Router. With
+    read_your_writes session reads from replicas only until it writes,
+    replicas may lag behind primary and miss the write."""
+
+    def __init__(self, router, read_your_writes=True):
+        self.router = router
+        self.read_your_writes = read_your_writes
+        self.pinned = False
+
+    def call(self, function, *args, **kwargs):
+        """Call dbapi function with connection chosen for this session"""
+        read_only = is_read_function(function)
+        if not read_only and self.read_your_writes:
+            self.pinned = True
+        connection = self.router.connect(read_only and not self.pinned)
+        try:
+            return function(connection, *args, **kwargs)
+        finally:
+            connection.close()
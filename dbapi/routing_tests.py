@@ -0,0 +1,46 @@
+import unittest
+
+import dbapi
+from routing import Router, is_read_function
+
+
+def insert_spam(connection):
+    """Function which is not in dbapi.READ_FUNCTIONS"""
+    return connection
+
+
+class RoutingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router('test_config.cfg')
+
+    def tearDown(self):
+        self.router.close()
+
+    def test_is_read_function(self):
+        self.assertTrue(is_read_function(dbapi.find_ip_list_type))
+        self.assertTrue(is_read_function(dbapi.get_ip_from_range))
+        self.assertFalse(is_read_function(dbapi.insert_ip_into_db))
+        self.assertFalse(is_read_function(dbapi.delete_ip))
+
+    def test_read_call(self):
+        self.assertTrue(
+            self.router.call(dbapi.check_if_ip_in_database, '192.168.1.15')
+        )
+
+    def test_session_pins_to_primary_after_write(self):
+        session = self.router.session()
+        self.assertFalse(session.pinned)
+        session.call(dbapi.check_if_ip_in_database, '192.168.1.15')
+        self.assertFalse(session.pinned)
+        session.call(insert_spam)
+        self.assertTrue(session.pinned)
+
+    def test_session_without_read_your_writes(self):
+        session = self.router.session(read_your_writes=False)
+        session.call(insert_spam)
+        self.assertFalse(session.pinned)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+"""Module implements compact representation of rows from ip address tables.
+AddressRow is a record with __slots__, AddressBatch keeps rows of one ip
+version in parallel arrays. Address values are decoded to printable form
+only when address is asked for.
+:classes: AddressRow, AddressBatch
+:functions: decode_address, fetch_rows, fetch_batch, get_ip_rows_from_range,
+get_ip_batch_from_range"""
+from array import array
+from binascii import hexlify
+from datetime import date
+
+import MySQLdb as mdb
+from netaddr import IPAddress
+
+from dbapi import add_sql_limit, get_ip_data
+from dbapi_exceptions import SQLSyntaxError
+from logging_conf import create_logger
+from slow_query import server_side_cursor
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+
+def decode_address(value):
+    """Convert address column value to printable ip address
+
+    :param value: v4 address as integer or v6 address as binary string.
+    :returns: str -- ip address.
+
+    """
+    if isinstance(value, (int, long)):
+        return str(IPAddress(value, 4))
+    return str(IPAddress(int(hexlify(value), 16), 6))
+
+
+class AddressRow(object):
+    """Row of ipv4_addresses or ipv6_addresses table"""
+
+    __slots__ = ('id', 'value', 'date_added', '_address')
+
+    def __init__(self, id, value, date_added):
+        self.id = id
+        self.value = value
+        self.date_added = date_added
+        self._address = None
+
+    @property
+    def version(self):
+        return 4 if isinstance(self.value, (int, long)) else 6
+
+    @property
+    def address(self):
+        """Printable ip address, decoded on first access"""
+        if self._address is None:
+            self._address = decode_address(self.value)
+        return self._address
+
+    def as_tuple(self):
+        """Return row in form returned by dbapi functions"""
+        return self.id, self.value, self.date_added
+
+    def __repr__(self):
+        return 'AddressRow(%r, %r, %r)' % self.as_tuple()
+
+
+class AddressBatch(object):
+    """Rows of one ip version kept in parallel arrays of ids, address values
+    and dates. v4 values are stored as unsigned 32-bit integers, dates as
+    ordinal numbers with 0 for missing date."""
+
+    def __init__(self, ip_version):
+        self.version = ip_version
+        self.ids = array('l')
+        self.values = array('I') if ip_version == 4 else []
+        self.dates = array('l')
+
+    def append(self, row):
+        """Add row in form returned by cursor"""
+        row_id, value, date_added = row
+        self.ids.append(row_id)
+        self.values.append(value)
+        self.dates.append(date_added.toordinal() if date_added else 0)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def date_added(self, index):
+        ordinal = self.dates[index]
+        return date.fromordinal(ordinal) if ordinal else None
+
+    def address(self, index):
+        """Decode address of row with given index"""
+        value = self.values[index]
+        if self.version == 4:
+            return str(IPAddress(value, 4))
+        return decode_address(value)
+
+    def addresses(self):
+        """Generate printable addresses of all rows"""
+        for index in xrange(len(self)):
+            yield self.address(index)
+
+    def __getitem__(self, index):
+        return AddressRow(
+            self.ids[index],
+            long(self.values[index]) if self.version == 4
+            else self.values[index],
+            self.date_added(index)
+        )
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+
+def fetch_rows(cursor, batch_size=10000):
+    """Generate AddressRow objects from executed cursor"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield AddressRow(*row)
+
+
+def fetch_batch(cursor, ip_version, batch_size=10000):
+    """Read all rows of executed cursor into AddressBatch"""
+    batch = AddressBatch(ip_version)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        batch.extend(rows)
+    return batch
+
+
+def _range_cursor(connection, start, end, limit):
+    """Execute range query on server side cursor, so rows are not kept in
+    memory all at once"""
+    start_value, start_version = get_ip_data(start)
+    end_value, end_version = get_ip_data(end)
+    if start_version != end_version:
+        raise Exception("Different ip versions in start and end")
+    sql = '''
+    SELECT id, address, date_added FROM ipv{0}_addresses
+    WHERE address BETWEEN {1} AND {2}'''.format(
+        start_version, start_value, end_value
+    )
+    if limit:
+        sql = add_sql_limit(sql, limit)
+    cursor = connection.cursor(server_side_cursor())
+    try:
+        cursor.execute(sql)
+    except mdb.ProgrammingError as mdb_error:
+        cursor.close()
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    return cursor, start_version
+
+
+def get_ip_rows_from_range(connection, start, end, limit=None):
+    """Same as dbapi.get_ip_from_range, but returns list of AddressRow
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param start: Start ip-address.
+    :type start: str.
+    :param end: End ip-address.
+    :type end: str.
+    :param limit: A tuple of offset and row count.
+    :type: limit: tuple.
+    :returns: list -- AddressRow for each address within range.
+
+    """
+    cursor = _range_cursor(connection, start, end, limit)[0]
+    try:
+        result = list(fetch_rows(cursor))
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug(
+        'Searching for ip rows in range %s - %s, limit is %s, found %s'
+        % (start, end, limit, len(result))
+    )
+    return result
+
+
+def get_ip_batch_from_range(connection, start, end, limit=None):
+    """Same as dbapi.get_ip_from_range, but returns AddressBatch
+
+    :param connection: MySQL database connection.
+    :type connection: MySQLdb.connections.Connection.
+    :param start: Start ip-address.
+    :type start: str.
+    :param end: End ip-address.
+    :type end: str.
+    :param limit: A tuple of offset and row count.
+    :type: limit: tuple.
+    :returns: AddressBatch -- all addresses within range.
+
+    """
+    cursor, ip_version = _range_cursor(connection, start, end, limit)
+    try:
+        result = fetch_batch(cursor, ip_version)
+    finally:
+        cursor.close()
+    MODULE_LOGGER.debug(
+        'Searching for ip batch in range %s - %s, limit is %s, found %s'
+        % (start, end, limit, len(result))
+    )
+    return result
@@ -0,0 +1,64 @@
+"""Benchmark of memory per row and address decoding time of tuples returned
+by dbapi functions against AddressRow and AddressBatch, for million rows of
+v4 addresses. Rows are generated in memory, no database is needed."""
+import random
+import sys
+import time
+from datetime import date
+
+from rows import AddressBatch, AddressRow, decode_address
+
+ROWS = 1000000
+
+
+def tuple_size(row):
+    # date object is shared by all rows, so it isn't counted
+    return sys.getsizeof(row) + sys.getsizeof(row[0]) + sys.getsizeof(row[1])
+
+
+def row_size(row):
+    return (sys.getsizeof(row) + sys.getsizeof(row.id)
+            + sys.getsizeof(row.value))
+
+
+def batch_size(batch):
+    return sum(
+        column.buffer_info()[1] * column.itemsize
+        for column in (batch.ids, batch.values, batch.dates)
+    )
+
+
+def timed(function):
+    start = time.time()
+    function()
+    return time.time() - start
+
+
+def main():
+    today = date.today()
+    tuples = [
+        (row_id, long(random.getrandbits(32)), today)
+        for row_id in xrange(ROWS)
+    ]
+    address_rows = [AddressRow(*row) for row in tuples]
+    batch = AddressBatch(4)
+    batch.extend(tuples)
+
+    print('tuple: %6.1f bytes/row' % (
+        sum(tuple_size(row) for row in tuples) / float(ROWS)))
+    print('row:   %6.1f bytes/row' % (
+        sum(row_size(row) for row in address_rows) / float(ROWS)))
+    print('batch: %6.1f bytes/row' % (batch_size(batch) / float(ROWS)))
+
+    print('decode tuples:   %.2f s' % timed(
+        lambda: [decode_address(row[1]) for row in tuples]))
+    print('decode rows:     %.2f s' % timed(
+        lambda: [row.address for row in address_rows]))
+    print('decode batch:    %.2f s' % timed(lambda: list(batch.addresses())))
+    # lazy decoding pays only for rows that are actually printed
+    print('decode 1%% rows: %.2f s' % timed(
+        lambda: [row.address for row in address_rows[::100]]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import unittest
+from datetime import date
+
+from netaddr import IPAddress
+
+from rows import AddressBatch, AddressRow, decode_address
+
+
+class RowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.v6_value = IPAddress('fe80::1').packed
+        self.row = AddressRow(3, 3232235777L, date(2013, 6, 20))
+
+    def test_decode_address(self):
+        self.assertEquals(decode_address(3232235777L), '192.168.1.1')
+        self.assertEquals(decode_address(self.v6_value), 'fe80::1')
+        self.assertEquals(decode_address('\x01'), '::1')
+
+    def test_address_row(self):
+        self.assertEquals(self.row.version, 4)
+        self.assertEquals(self.row.address, '192.168.1.1')
+        self.assertEquals(
+            self.row.as_tuple(),
+            (3, 3232235777L, date(2013, 6, 20))
+        )
+        self.assertRaises(AttributeError, setattr, self.row, 'spam', 1)
+
+    def test_v4_batch(self):
+        batch = AddressBatch(4)
+        batch.extend([
+            (3, 3232235777L, date(2013, 6, 20)),
+            (4, 3232235791L, None),
+        ])
+        self.assertEquals(len(batch), 2)
+        self.assertEquals(
+            list(batch.addresses()),
+            ['192.168.1.1', '192.168.1.15']
+        )
+        self.assertEquals(batch[0].as_tuple(), self.row.as_tuple())
+        self.assertIsNone(batch.date_added(1))
+
+    def test_v6_batch(self):
+        batch = AddressBatch(6)
+        batch.append((1, self.v6_value, date(2013, 6, 20)))
+        self.assertEquals(batch.address(0), 'fe80::1')
+        self.assertEquals(batch[0].version, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,309 @@
+"""Module implements sharding of ip addresses between several databases. Each
+shard is a section of config file with its own pool of connections, address
+is placed on shard by consistent hash of its value. [Sharding] section names
+comma separated shard sections and number of virtual nodes per shard:
+
+    [Sharding]
+    shards=MySQL shard 1, MySQL shard 2
+    virtual_nodes=100
+
+Sources are stored on every shard, ip ids are unique only inside a shard.
+:classes: HashRing, ShardedDatabase"""
+import bisect
+import hashlib
+import inspect
+from multiprocessing.pool import ThreadPool
+
+import dbapi
+from config_parser import get_section_settings
+from logging_conf import create_logger
+from pooling import create_pool
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+# functions with ip address as second parameter, they run on one shard
+ADDRESS_FUNCTIONS = frozenset([
+    'find_ip_id',
+    'check_if_ip_in_database',
+    'find_ip_list_type',
+    'get_sourcename_list_with_ip',
+    'get_ip_score',
+    'insert_ip_into_db',
+    'insert_ip_into_list',
+    'insert_ip_into_source',
+    'del_ip_from_list',
+    'delete_ip',
+])
+
+# functions over address tables that run on all shards, value is index of
+# address column in result rows, used to merge results in address order
+FAN_OUT_FUNCTIONS = {
+    'get_ip_with_source_name': 1,
+    'get_ip_from_range': 1,
+    'get_ips_added_in_range': 1,
+    'get_ip_not_in_source': 1,
+    'select_ip_with_rank': 0,
+    'select_ips_with_rank_in_range': 0,
+}
+
+# functions that change sources or several addresses, run on all shards
+BROADCAST_FUNCTIONS = frozenset([
+    'insert_new_source',
+    'delete_ip_range',
+    'refresh_ip_scores',
+    'rebuild_source_stats',
+])
+
+# functions that read only sources table, which is same on every shard
+SOURCE_FUNCTIONS = frozenset([
+    'get_source_by_sourcename',
+    'get_sources_modified_in_range',
+    'select_source_with_rank',
+    'select_sourcename_with_rank_in_range',
+])
+
+
+def _merge_dicts(results):
+    merged = {}
+    for result in results:
+        merged.update(result)
+    return merged
+
+
+def _merge_source_stats(results):
+    """Add up address counts of source, last update is the latest one"""
+    results = [result for result in results if result is not None]
+    if not results:
+        return None
+    counts = tuple(sum(column) for column in zip(*results)[:4])
+    updates = [result[4] for result in results if result[4] is not None]
+    return counts + (max(updates) if updates else None,)
+
+
+# functions with ip addresses as second parameter, addresses are split
+# between their shards, value merges results of shards
+MULTI_ADDRESS_FUNCTIONS = {
+    'find_ip_list_types': _merge_dicts,
+    'insert_ips_into_db': _merge_dicts,
+    'insert_ips_into_list': _merge_dicts,
+    'delete_ips': sum,
+}
+
+# score functions that run on all shards, rows are merged by weighted rank
+# and cut to top rows
+SCORE_FUNCTIONS = frozenset([
+    'get_ip_scores',
+    'get_top_scored_ips',
+])
+
+# functions that read per shard statistics, value merges results of shards
+MERGE_FUNCTIONS = {
+    'get_source_stats': _merge_source_stats,
+}
+
+
+def address_key(value):
+    """Sort key of address column value, v4 addresses are numbers and go
+    before v6 addresses stored as 16 byte strings"""
+    return (not isinstance(value, (int, long)), value)
+
+
+class HashRing(object):
+    """Consistent hash ring, each node is placed on ring virtual_nodes times,
+    so adding or removing node moves only about 1/N of keys"""
+
+    def __init__(self, nodes, virtual_nodes=100):
+        self.virtual_nodes = virtual_nodes
+        self._hashes = []
+        self._nodes = {}
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+    def add_node(self, node):
+        for replica in xrange(self.virtual_nodes):
+            node_hash = self._hash('%s-%s' % (node, replica))
+            bisect.insort(self._hashes, node_hash)
+            self._nodes[node_hash] = node
+
+    def remove_node(self, node):
+        for replica in xrange(self.virtual_nodes):
+            node_hash = self._hash('%s-%s' % (node, replica))
+            self._hashes.remove(node_hash)
+            del self._nodes[node_hash]
+
+    def get_node(self, key):
+        """Return node that owns key"""
+        if not self._hashes:
+            raise Exception("Hash ring is empty")
+        index = bisect.bisect(self._hashes, self._hash(key))
+        # ring wraps around after last hash
+        return self._nodes[self._hashes[index % len(self._hashes)]]
+
+
+class ShardedDatabase(object):
+    """Runs dbapi functions on shards: address functions on the shard which
+    owns address, functions of many addresses on shards of their addresses,
+    range, score and statistics queries on all shards in parallel with
+    results merged.
+
+        shards = ShardedDatabase('dbapi.cfg')
+        shards.call(dbapi.insert_ip_into_db, '192.168.1.1')
+        shards.call(dbapi.get_ip_from_range, '192.168.1.1', '192.168.1.15')
+        shards.close()
+
+    """
+
+    def __init__(self, config):
+        """
+        :param config: String with name of configuration file which contains
+        [Sharding] section and connection settings of all shards.
+
+        """
+        settings = get_section_settings(config, 'Sharding')
+        self.sections = [
+            section.strip()
+            for section in settings['shards'].split(',')
+            if section.strip()
+        ]
+        self.pools = dict(
+            (section, create_pool(config, section))
+            for section in self.sections
+        )
+        self.ring = HashRing(
+            self.sections,
+            int(settings.get('virtual_nodes', 100))
+        )
+        self._workers = ThreadPool(len(self.sections))
+
+    def shard_for(self, ip_address):
+        """Return name of shard section which owns ip address"""
+        ip_value, ip_version = dbapi.get_ip_data(ip_address)
+        if ip_version == 6:
+            # ring keys of v6 addresses predate 16 byte storage format, they
+            # are kept so that stored addresses stay on their shards
+            ip_value = bin(int(ip_value, 16))
+        return self.ring.get_node('%s:%s' % (ip_version, ip_value))
+
+    def call_on_shard(self, section, function, *args, **kwargs):
+        """Call dbapi function with connection to one shard"""
+        connection = self.pools[section].connect()
+        try:
+            return function(connection, *args, **kwargs)
+        finally:
+            connection.close()
+
+    def call_on_all(self, function, *args, **kwargs):
+        """Call dbapi function on all shards in parallel, return list of
+        results in order of shards"""
+        results = [
+            self._workers.apply_async(
+                self.call_on_shard, (section, function) + args, kwargs
+            )
+            for section in self.sections
+        ]
+        return [result.get() for result in results]
+
+    def call_on_owners(self, function, ip_addresses, *args, **kwargs):
+        """Call dbapi function on each shard with addresses it owns in
+        parallel, return list of results of shards that own any address"""
+        by_shard = {}
+        for ip_address in ip_addresses:
+            by_shard.setdefault(
+                self.shard_for(ip_address), []
+            ).append(ip_address)
+        results = [
+            self._workers.apply_async(
+                self.call_on_shard,
+                (section, function, shard_addresses) + args, kwargs
+            )
+            for section, shard_addresses in sorted(by_shard.items())
+        ]
+        return [result.get() for result in results]
+
+    def call(self, function, *args, **kwargs):
+        """Route dbapi function call to shards
+
+        :param function: dbapi function that takes connection as a first
+        parameter.
+        :type function: function.
+        :returns: result of function, merged from shards for queries that
+        run on several shards.
+
+        """
+        name = function.__name__
+        if name in ADDRESS_FUNCTIONS:
+            section = self.shard_for(args[0])
+            return self.call_on_shard(section, function, *args, **kwargs)
+        if name in SOURCE_FUNCTIONS:
+            return self.call_on_shard(
+                self.sections[0], function, *args, **kwargs
+            )
+        if name in BROADCAST_FUNCTIONS:
+            return self.call_on_all(function, *args, **kwargs)
+        if name in FAN_OUT_FUNCTIONS:
+            return self._fan_out(
+                function, FAN_OUT_FUNCTIONS[name], args, kwargs
+            )
+        if name in MULTI_ADDRESS_FUNCTIONS:
+            return MULTI_ADDRESS_FUNCTIONS[name](
+                self.call_on_owners(function, *args, **kwargs)
+            )
+        if name in SCORE_FUNCTIONS:
+            return self._merge_scores(function, args, kwargs)
+        if name in MERGE_FUNCTIONS:
+            return MERGE_FUNCTIONS[name](
+                self.call_on_all(function, *args, **kwargs)
+            )
+        raise Exception("Function %s can't be routed to shards" % name)
+
+    def close(self):
+        """Stop worker threads and close connections of all shards"""
+        self._workers.close()
+        self._workers.join()
+        for mysql_pool in self.pools.values():
+            mysql_pool.dispose()
+
+    def _fan_out(self, function, address_column, args, kwargs):
+        """Run query on all shards and merge rows in address order. Limit
+        is applied to merged rows, so each shard returns offset + count rows
+        at most."""
+        kwargs = dict(kwargs)
+        # limit can be passed positionally, it follows connection and query
+        # parameters of function
+        limit_index = inspect.getargspec(function).args.index('limit') - 1
+        if len(args) > limit_index:
+            kwargs['limit'] = args[limit_index]
+            args = args[:limit_index]
+        limit = kwargs.pop('limit', None)
+        if limit:
+            offset, count = limit
+            kwargs['limit'] = (0, offset + count)
+        rows = []
+        for result in self.call_on_all(function, *args, **kwargs):
+            rows.extend(result)
+        rows.sort(key=lambda row: address_key(row[address_column]))
+        if limit:
+            rows = rows[offset:offset + count]
+        MODULE_LOGGER.debug(
+            '%s on %s shards, found %s'
+            % (function.__name__, len(self.sections), len(rows))
+        )
+        return tuple(rows)
+
+    def _merge_scores(self, function, args, kwargs):
+        """Run score query on all shards and merge rows by weighted rank,
+        each shard returns top rows at most, so merged rows are cut to
+        top"""
+        top = inspect.getcallargs(function, None, *args, **kwargs)['top']
+        rows = []
+        for result in self.call_on_all(function, *args, **kwargs):
+            rows.extend(result)
+        # ids are unique only inside shard, addresses break ties
+        rows.sort(key=lambda row: (-row[-1], address_key(row[2])))
+        if top is not None:
+            rows = rows[:int(top)]
+        return tuple(rows)
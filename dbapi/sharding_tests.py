@@ -0,0 +1,248 @@
+import inspect
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import dbapi
+import sharding
+from sharding import HashRing, ShardedDatabase, address_key
+
+CONFIG = """
+[Sharding]
+shards=shard 1, shard 2
+virtual_nodes=10
+
+[Pooling]
+pool_size=1
+max_overflow=0
+timeout=5
+recycle=-1
+pre_ping=0
+validate_interval=0
+"""
+
+
+class FakeConnection(object):
+
+    def __init__(self, section):
+        self.section = section
+
+    def close(self):
+        pass
+
+
+class FakePool(object):
+
+    def __init__(self, section):
+        self.section = section
+        self.disposed = False
+
+    def connect(self):
+        return FakeConnection(self.section)
+
+    def dispose(self):
+        self.disposed = True
+
+
+# rows of get_ip_from_range on each shard, sorted by address
+SHARD_ROWS = {
+    'shard 1': [(1, 1), (2, 4), (3, 5), (4, 9)],
+    'shard 2': [(1, 2), (2, 3), (3, 7), (4, 8)],
+}
+
+
+def find_ip_id(connection, ip_address):
+    return connection.section
+
+
+def get_source_by_sourcename(connection, sourcename):
+    return connection.section
+
+
+def get_ip_from_range(connection, start, end, limit=None):
+    rows = SHARD_ROWS[connection.section]
+    if limit:
+        rows = rows[limit[0]:limit[0] + limit[1]]
+    return tuple(rows)
+
+
+def get_ip_spam(connection):
+    pass
+
+
+def find_ip_list_types(connection, ip_addresses, chunk_size=1000):
+    return dict(
+        (ip_address, connection.section) for ip_address in ip_addresses
+    )
+
+
+def delete_ips(connection, ip_addresses, chunk_size=1000):
+    return len(ip_addresses)
+
+
+# score rows of each shard, highest weighted rank first
+SHARD_SCORES = {
+    'shard 1': [(4, 1, 5, 2, 5, 9), (4, 2, 1, 1, 3, 3)],
+    'shard 2': [(4, 1, 7, 1, 7, 7), (4, 2, 2, 1, 3, 3)],
+}
+
+
+def get_top_scored_ips(connection, top=None, min_score=None):
+    return tuple(SHARD_SCORES[connection.section][:top])
+
+
+def get_source_stats(connection, sourcename):
+    if connection.section == 'shard 1':
+        return (2, 1, 0, 1, datetime(2013, 7, 1))
+    return (3, 0, 1, 0, datetime(2013, 7, 2))
+
+
+class HashRingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = ['shard 1', 'shard 2', 'shard 3']
+        self.ring = HashRing(self.nodes)
+        self.keys = ['4:%s' % value for value in xrange(3000)]
+
+    def test_same_key_same_node(self):
+        self.assertEquals(
+            [self.ring.get_node(key) for key in self.keys],
+            [HashRing(self.nodes).get_node(key) for key in self.keys]
+        )
+
+    def test_all_nodes_used(self):
+        nodes = set(self.ring.get_node(key) for key in self.keys)
+        self.assertEquals(nodes, set(self.nodes))
+
+    def test_adding_node_moves_few_keys(self):
+        before = [self.ring.get_node(key) for key in self.keys]
+        self.ring.add_node('shard 4')
+        after = [self.ring.get_node(key) for key in self.keys]
+        moved = [old for old, new in zip(before, after) if old != new]
+        # keys move only to new node, about quarter of them
+        self.assertTrue(all(
+            self.ring.get_node(key) == 'shard 4'
+            for key, old, new in zip(self.keys, before, after) if old != new
+        ))
+        self.assertTrue(len(moved) < len(self.keys) / 2)
+
+    def test_remove_node(self):
+        self.ring.remove_node('shard 2')
+        nodes = set(self.ring.get_node(key) for key in self.keys)
+        self.assertEquals(nodes, set(['shard 1', 'shard 3']))
+
+    def test_empty_ring(self):
+        self.assertRaises(Exception, HashRing([]).get_node, '4:1')
+
+    def test_address_key(self):
+        values = ['\x01', 3232235777L, 16843009L]
+        self.assertEquals(
+            sorted(values, key=address_key),
+            [16843009L, 3232235777L, '\x01']
+        )
+
+
+class ShardedDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        config = os.path.join(self.directory, 'sharding.cfg')
+        with open(config, 'w') as config_file:
+            config_file.write(CONFIG)
+        self.shards = ShardedDatabase(config)
+        for section in self.shards.sections:
+            self.shards.pools[section].dispose()
+            self.shards.pools[section] = FakePool(section)
+
+    def tearDown(self):
+        self.shards.close()
+        shutil.rmtree(self.directory)
+
+    def test_address_routing(self):
+        self.assertEquals(self.shards.sections, ['shard 1', 'shard 2'])
+        ip_addresses = ['10.0.0.%s' % number for number in xrange(50)]
+        sections = [
+            self.shards.call(find_ip_id, ip_address)
+            for ip_address in ip_addresses
+        ]
+        self.assertEquals(sections, [
+            self.shards.shard_for(ip_address) for ip_address in ip_addresses
+        ])
+        self.assertEquals(set(sections), set(self.shards.sections))
+        self.assertEquals(
+            self.shards.call(get_source_by_sourcename, 'spam'), 'shard 1'
+        )
+        self.assertRaises(Exception, self.shards.call, get_ip_spam)
+
+    def test_multi_address_routing(self):
+        ip_addresses = ['10.0.0.%s' % number for number in xrange(50)]
+        self.assertEquals(
+            self.shards.call(find_ip_list_types, ip_addresses),
+            dict((ip_address, self.shards.shard_for(ip_address))
+                 for ip_address in ip_addresses)
+        )
+        self.assertEquals(self.shards.call(delete_ips, ip_addresses), 50)
+        self.assertEquals(self.shards.call(delete_ips, []), 0)
+
+    def test_score_merge(self):
+        self.assertEquals(
+            [row[2] for row in self.shards.call(get_top_scored_ips)],
+            [5, 7, 1, 2]
+        )
+        self.assertEquals(
+            [row[2] for row in self.shards.call(get_top_scored_ips, 1)],
+            [5]
+        )
+
+    def test_source_stats_merge(self):
+        self.assertEquals(
+            self.shards.call(get_source_stats, 'spam'),
+            (5, 1, 1, 1, datetime(2013, 7, 2))
+        )
+
+    def test_every_dbapi_function_is_routed(self):
+        routed = (sharding.ADDRESS_FUNCTIONS | sharding.SOURCE_FUNCTIONS
+                  | sharding.BROADCAST_FUNCTIONS | sharding.SCORE_FUNCTIONS
+                  | set(sharding.FAN_OUT_FUNCTIONS)
+                  | set(sharding.MULTI_ADDRESS_FUNCTIONS)
+                  | set(sharding.MERGE_FUNCTIONS))
+        for name, function in inspect.getmembers(dbapi,
+                                                 inspect.isfunction):
+            if name.startswith('_') or function.__module__ != 'dbapi':
+                continue
+            # functions without connection don't run on database
+            if inspect.getargspec(function).args[:1] != ['connection']:
+                continue
+            self.assertIn(name, routed)
+
+    def test_fan_out_merge(self):
+        self.assertEquals(
+            [row[1] for row in self.shards.call(get_ip_from_range, 'a', 'b')],
+            [1, 2, 3, 4, 5, 7, 8, 9]
+        )
+
+    def test_fan_out_limit(self):
+        self.assertEquals(
+            [row[1] for row in self.shards.call(
+                get_ip_from_range, 'a', 'b', limit=(2, 3)
+            )],
+            [3, 4, 5]
+        )
+        # positional limit is applied to merged rows too
+        self.assertEquals(
+            [row[1] for row in self.shards.call(
+                get_ip_from_range, 'a', 'b', (5, 5)
+            )],
+            [7, 8, 9]
+        )
+
+    def test_close(self):
+        pools = self.shards.pools.values()
+        self.shards.close()
+        self.assertTrue(all(mysql_pool.disposed for mysql_pool in pools))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Module implements coalescing of identical concurrent read queries. When
+several threads call the same read-only dbapi function with equal arguments
+at once, only the first call takes pool connection and runs the query,
+others wait for it and get the same result or error. Result is shared only
+with calls that arrive while the query is running and nothing is kept after
+it finishes, so there is no cache that could go stale.
+:classes: SingleFlight"""
+import threading
+
+from logging_conf import create_logger
+from routing import is_read_function
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+
+class _Flight(object):
+    """Query in progress and callers waiting for it"""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Calls dbapi functions with pooled connections, concurrent calls of
+    read function with equal arguments share one query
+
+        flights = SingleFlight(mysql_pool)
+        flights.call(dbapi.find_ip_list_type, '192.168.1.1')
+
+    Shared results are the same objects for all callers, they should not
+    be changed in place. Functions that are not in dbapi.READ_FUNCTIONS and
+    calls with unhashable arguments are run without coalescing.
+
+    """
+
+    def __init__(self, mysql_pool):
+        """
+        :param mysql_pool: Pool of database connections.
+        :type mysql_pool: sqlalchemy.pool.QueuePool.
+
+        """
+        self.mysql_pool = mysql_pool
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'queries': 0, 'coalesced': 0}
+        # number of coalesced calls of each function
+        self.coalesced_by_function = {}
+
+    def _run(self, function, args, kwargs):
+        connection = self.mysql_pool.connect()
+        try:
+            return function(connection, *args, **kwargs)
+        finally:
+            connection.close()
+
+    def call(self, function, *args, **kwargs):
+        """Call dbapi function, wait for identical call in progress if there
+        is one
+
+        :param function: dbapi function that takes connection as a first
+        parameter.
+        :type function: function.
+        :returns: result of function.
+
+        """
+        key = None
+        if is_read_function(function):
+            # functions of other modules may have the same name
+            key = (function, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                key = None
+        with self._lock:
+            self.stats['calls'] += 1
+            if key is None:
+                self.stats['queries'] += 1
+            else:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self.stats['queries'] += 1
+                else:
+                    flight.waiters += 1
+                    self.stats['coalesced'] += 1
+                    name = function.__name__
+                    self.coalesced_by_function[name] = \
+                        self.coalesced_by_function.get(name, 0) + 1
+        if key is None:
+            return self._run(function, args, kwargs)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._run(function, args, kwargs)
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            # calls arriving from now on start new query
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+            if flight.waiters:
+                MODULE_LOGGER.debug(
+                    '%s calls of %s shared one query'
+                    % (flight.waiters + 1, function.__name__)
+                )
+        return flight.result
+
+    def metrics(self):
+        """Return counters of calls, queries run and coalesced calls
+
+        :returns: dict -- 'calls', 'queries', 'coalesced', 'in_flight'
+        counts and 'by_function' dict of coalesced calls.
+
+        """
+        with self._lock:
+            metrics = dict(self.stats)
+            metrics['in_flight'] = len(self._flights)
+            metrics['by_function'] = dict(self.coalesced_by_function)
+        return metrics
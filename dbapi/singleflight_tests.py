@@ -0,0 +1,140 @@
+import threading
+import unittest
+
+from singleflight import SingleFlight
+
+
+class FakeConnection(object):
+
+    def close(self):
+        pass
+
+
+class FakePool(object):
+
+    def __init__(self):
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+        return FakeConnection()
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FakePool()
+        self.flights = SingleFlight(self.pool)
+        self.release = threading.Event()
+        self.queries = []
+
+    def run_threads(self, function, args_list):
+        results = []
+
+        def call(args):
+            try:
+                results.append(self.flights.call(function, *args))
+            except Exception as error:
+                results.append(error)
+
+        threads = [
+            threading.Thread(target=call, args=(args,))
+            for args in args_list
+        ]
+        for thread in threads:
+            thread.start()
+        # wait until every thread either runs query or waits for one
+        while self.flights.metrics()['calls'] < len(threads):
+            self.release.wait(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_identical_calls_share_query(self):
+        def find_ip_list_type(connection, ip_address):
+            self.queries.append(ip_address)
+            self.release.wait()
+            return 'blacklist'
+
+        results = self.run_threads(
+            find_ip_list_type, [('1.1.1.1',)] * 10 + [('2.2.2.2',)] * 5
+        )
+        self.assertEquals(results, ['blacklist'] * 15)
+        self.assertEquals(sorted(self.queries), ['1.1.1.1', '2.2.2.2'])
+        self.assertEquals(self.pool.connects, 2)
+        metrics = self.flights.metrics()
+        self.assertEquals(metrics['coalesced'], 13)
+        self.assertEquals(metrics['by_function'], {'find_ip_list_type': 13})
+        self.assertEquals(metrics['in_flight'], 0)
+
+    def test_error_is_shared(self):
+        def find_ip_list_type(connection, ip_address):
+            self.release.wait()
+            raise ValueError('spam')
+
+        results = self.run_threads(find_ip_list_type, [('1.1.1.1',)] * 3)
+        self.assertEquals(len(results), 3)
+        self.assertTrue(
+            all(isinstance(error, ValueError) for error in results)
+        )
+        self.assertEquals(self.pool.connects, 1)
+
+    def test_writes_are_not_coalesced(self):
+        def insert_ip_into_db(connection, ip_address):
+            self.release.wait()
+
+        self.run_threads(insert_ip_into_db, [('1.1.1.1',)] * 3)
+        self.assertEquals(self.pool.connects, 3)
+        self.assertEquals(self.flights.metrics()['coalesced'], 0)
+
+    def test_no_caching(self):
+        def find_ip_list_type(connection, ip_address):
+            return None
+
+        self.flights.call(find_ip_list_type, '1.1.1.1')
+        self.flights.call(find_ip_list_type, '1.1.1.1')
+        self.assertEquals(self.pool.connects, 2)
+
+    def test_functions_with_same_name_do_not_share_query(self):
+        def lookup(list_type):
+            def find_ip_list_type(connection, ip_address):
+                self.release.wait()
+                return list_type
+            return find_ip_list_type
+
+        functions = [lookup('blacklist'), lookup('whitelist')]
+        results = {}
+
+        def call(function):
+            results.setdefault(function, []).append(
+                self.flights.call(function, '1.1.1.1')
+            )
+
+        threads = [
+            threading.Thread(target=call, args=(functions[number % 2],))
+            for number in xrange(6)
+        ]
+        for thread in threads:
+            thread.start()
+        while self.flights.metrics()['calls'] < len(threads):
+            self.release.wait(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(results[functions[0]], ['blacklist'] * 3)
+        self.assertEquals(results[functions[1]], ['whitelist'] * 3)
+        self.assertEquals(self.pool.connects, 2)
+
+    def test_unhashable_arguments(self):
+        def find_ip_list_types(connection, ip_addresses):
+            return dict.fromkeys(ip_addresses)
+
+        self.assertEquals(
+            self.flights.call(find_ip_list_types, ['1.1.1.1']),
+            {'1.1.1.1': None}
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
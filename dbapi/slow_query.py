@@ -0,0 +1,337 @@
+"""Module implements capture of slow queries. Connections from
+mysql_connector use ProfilingCursor when config file has [Slow query]
+section:
+
+    [Slow query]
+    threshold=100
+    explain_sample_rate=0.1
+    max_entries=1000
+    dump_file=slow_queries.json
+
+Every query that takes longer than threshold milliseconds is logged to
+slow_query logger from logging.cfg and kept in ring buffer of max_entries
+last slow queries, with normalized sql, parameters, duration, row count and
+dbapi function that ran it. Share explain_sample_rate of slow queries also
+gets plan from EXPLAIN. Process dumps the buffer to dump_file on SIGUSR1,
+dump is summarized by
+
+    python slow_query.py slow_queries.json
+
+:classes: SlowQueryLog, ProfilingCursor, SSProfilingCursor
+:functions: configure, server_side_cursor, normalize_sql,
+get_slow_query_log"""
+import json
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import deque, namedtuple
+
+import MySQLdb.cursors
+
+from logging_conf import create_logger
+
+MODULE_LOGGER = create_logger('logging.cfg', 'slow_query')
+
+SLOW_QUERY_DEFAULTS = {
+    'threshold': '100',
+    'explain_sample_rate': '0.1',
+    'max_entries': '1000',
+}
+# statements that EXPLAIN accepts
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE')
+MAX_PARAMS_LENGTH = 1000
+
+SlowQuery = namedtuple(
+    'SlowQuery',
+    'time function sql normalized params duration rows plan'
+)
+
+_LITERALS = re.compile(r"""
+    '(?:[^'\\]|\\.)*'         # single quoted string
+    | "(?:[^"\\]|\\.)*"       # double quoted string
+    | \b0x[0-9a-fA-F]+\b      # hex literal
+    | \b\d+(?:\.\d+)?\b       # number
+    """, re.VERBOSE)
+_VALUE_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_REPEATED_LISTS = re.compile(r'\(\?\+\)(?:\s*,\s*\(\?\+\))+')
+_SPACES = re.compile(r'\s+')
+
+# log used by profiling cursors, set by configure
+SLOW_QUERY_LOG = None
+
+
+def normalize_sql(sql):
+    """Replace literals and placeholders with '?' and collapse lists of
+    values, so queries that differ only in values look the same
+
+    :param sql: Sql query.
+    :type sql: str.
+    :returns: str -- normalized query.
+
+    """
+    sql = _LITERALS.sub('?', sql.replace('%s', '?'))
+    sql = _VALUE_LISTS.sub('(?+)', sql)
+    sql = _REPEATED_LISTS.sub('(?+), ...', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def _calling_function():
+    """Return name of function outside this module and MySQLdb that ran
+    query"""
+    for filename, _, function, _ in reversed(traceback.extract_stack()):
+        module = os.path.splitext(os.path.basename(filename))[0]
+        if module == __name__ or os.sep + 'MySQLdb' + os.sep in filename:
+            continue
+        return '%s.%s' % (module, function)
+    return None
+
+
+class SlowQueryLog(object):
+    """Ring buffer of slow queries shared by all profiling cursors"""
+
+    def __init__(self, threshold=100, explain_sample_rate=0.1,
+                 max_entries=1000):
+        """
+        :param threshold: Duration in milliseconds above which query is
+        slow.
+        :type threshold: float.
+        :param explain_sample_rate: Share of slow queries to EXPLAIN, from
+        0 to 1.
+        :type explain_sample_rate: float.
+        :param max_entries: Number of last slow queries kept.
+        :type max_entries: int.
+
+        """
+        self.threshold = threshold
+        self.explain_sample_rate = explain_sample_rate
+        self.entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        self.stats = {'slow': 0, 'explained': 0}
+
+    def should_explain(self, sql):
+        return sql.lstrip().upper().startswith(EXPLAINABLE) and \
+            random.random() < self.explain_sample_rate
+
+    def record(self, sql, params, duration, rows, plan=None):
+        """Add slow query to buffer and log it
+
+        :param duration: Duration of query in milliseconds.
+        :type duration: float.
+        :param plan: Rows of EXPLAIN output as dicts.
+        :type plan: list.
+
+        """
+        params = repr(params) if params is not None else None
+        if params and len(params) > MAX_PARAMS_LENGTH:
+            params = params[:MAX_PARAMS_LENGTH] + '...'
+        entry = SlowQuery(
+            time.time(), _calling_function(), sql, normalize_sql(sql),
+            params, duration, rows, plan
+        )
+        with self._lock:
+            self.entries.append(entry)
+            self.stats['slow'] += 1
+            if plan is not None:
+                self.stats['explained'] += 1
+        MODULE_LOGGER.warning(
+            '%.1f ms, %s rows, %s: %s'
+            % (duration, rows, entry.function, entry.normalized)
+        )
+        if plan is not None:
+            MODULE_LOGGER.warning('Plan: %s' % json.dumps(plan))
+        return entry
+
+    def snapshot(self):
+        """Return list of slow queries in buffer, oldest first"""
+        with self._lock:
+            return list(self.entries)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def dump(self, stream):
+        """Write slow queries in buffer to stream as JSON lines
+
+        :param stream: File like object.
+        :returns: int -- number of queries written.
+
+        """
+        entries = self.snapshot()
+        for entry in entries:
+            stream.write(json.dumps(entry._asdict(), default=str))
+            stream.write('\n')
+        return len(entries)
+
+    def dump_to_file(self, filename):
+        """Write slow queries in buffer to file, replacing it"""
+        with open(filename + '.tmp', 'w') as dump_file:
+            count = self.dump(dump_file)
+        os.rename(filename + '.tmp', filename)
+        MODULE_LOGGER.info('Dumped %s slow queries to %s'
+                           % (count, filename))
+        return count
+
+
+class ProfilingCursorMixIn(object):
+    """Cursor mix-in that times execute and executemany and records
+    queries slower than threshold of SLOW_QUERY_LOG"""
+
+    _profiled = False
+    explain_allowed = True
+
+    def execute(self, query, args=None):
+        if self._profiled or SLOW_QUERY_LOG is None:
+            return super(ProfilingCursorMixIn, self).execute(query, args)
+        return self._profile(
+            super(ProfilingCursorMixIn, self).execute, query, args
+        )
+
+    def executemany(self, query, args):
+        if self._profiled or SLOW_QUERY_LOG is None:
+            return super(ProfilingCursorMixIn, self).executemany(
+                query, args
+            )
+        return self._profile(
+            super(ProfilingCursorMixIn, self).executemany, query, args
+        )
+
+    def _profile(self, method, query, args):
+        slow_log = SLOW_QUERY_LOG
+        # executemany may call execute for each row
+        self._profiled = True
+        start = time.time()
+        try:
+            return method(query, args)
+        finally:
+            self._profiled = False
+            duration = (time.time() - start) * 1000
+            if duration > slow_log.threshold:
+                # query with parameters filled in by MySQLdb
+                sql = getattr(self, '_executed', None) or query
+                plan = None
+                if self.explain_allowed and slow_log.should_explain(sql):
+                    plan = self._explain(sql)
+                slow_log.record(sql, args, duration, self.rowcount, plan)
+
+    def _explain(self, sql):
+        """Return EXPLAIN output of query as list of dicts"""
+        cursor = self.connection.cursor(MySQLdb.cursors.Cursor)
+        try:
+            cursor.execute('EXPLAIN ' + sql)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except Exception as error:
+            MODULE_LOGGER.error('EXPLAIN failed: %s' % error)
+            return None
+        finally:
+            cursor.close()
+
+
+class ProfilingCursor(ProfilingCursorMixIn, MySQLdb.cursors.Cursor):
+    """Default MySQLdb cursor with slow query capture"""
+
+
+class SSProfilingCursor(ProfilingCursorMixIn, MySQLdb.cursors.SSCursor):
+    """Server side cursor with slow query capture, queries are not
+    EXPLAINed because connection is busy until all rows are read"""
+
+    explain_allowed = False
+
+
+def configure(settings):
+    """Create slow query log from settings of [Slow query] section, or
+    update thresholds of existing one
+
+    :param settings: Section settings.
+    :type settings: dict.
+    :returns: class -- cursor class for connections.
+
+    """
+    global SLOW_QUERY_LOG
+    options = dict(SLOW_QUERY_DEFAULTS)
+    options.update(settings)
+    if SLOW_QUERY_LOG is None:
+        SLOW_QUERY_LOG = SlowQueryLog(
+            float(options['threshold']),
+            float(options['explain_sample_rate']),
+            int(options['max_entries'])
+        )
+        if options.get('dump_file'):
+            _dump_on_signal(options['dump_file'])
+    else:
+        SLOW_QUERY_LOG.threshold = float(options['threshold'])
+        SLOW_QUERY_LOG.explain_sample_rate = \
+            float(options['explain_sample_rate'])
+    return ProfilingCursor
+
+
+def server_side_cursor():
+    """Return cursor class for queries that stream rows, SSProfilingCursor
+    when slow query capture is configured, else plain SSCursor"""
+    if SLOW_QUERY_LOG is None:
+        return MySQLdb.cursors.SSCursor
+    return SSProfilingCursor
+
+
+def _dump_on_signal(filename):
+    if not hasattr(signal, 'SIGUSR1'):
+        return
+
+    def handler(signum, frame):
+        SLOW_QUERY_LOG.dump_to_file(filename)
+
+    try:
+        signal.signal(signal.SIGUSR1, handler)
+    except ValueError:
+        # signal handlers can be set only from main thread
+        MODULE_LOGGER.error('Slow query dump on SIGUSR1 is not available')
+
+
+def get_slow_query_log():
+    """Return slow query log of process, None if capture is not
+    configured"""
+    return SLOW_QUERY_LOG
+
+
+def summarize(lines):
+    """Group dumped slow queries by normalized sql
+
+    :param lines: JSON lines written by SlowQueryLog.dump.
+    :type lines: iterable.
+    :returns: list -- tuples of normalized sql, count, total and maximal
+    duration, sorted by total duration.
+
+    """
+    groups = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        count, total, longest = groups.get(entry['normalized'], (0, 0, 0))
+        groups[entry['normalized']] = (
+            count + 1, total + entry['duration'],
+            max(longest, entry['duration'])
+        )
+    return sorted(
+        ((sql,) + group for sql, group in groups.items()),
+        key=lambda group: group[2], reverse=True
+    )
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit('usage: %s DUMP_FILE' % sys.argv[0])
+    with open(sys.argv[1]) as dump_file:
+        for sql, count, total, longest in summarize(dump_file):
+            print('%6s queries, %10.1f ms total, %8.1f ms max: %s'
+                  % (count, total, longest, sql))
+
+
+if __name__ == '__main__':
+    main()
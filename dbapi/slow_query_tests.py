@@ -0,0 +1,152 @@
+import json
+import unittest
+from StringIO import StringIO
+
+import slow_query
+from slow_query import (ProfilingCursorMixIn, SlowQueryLog, normalize_sql,
+                        summarize)
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.explained = []
+
+    def cursor(self, cursorclass=None):
+        return FakeExplainCursor(self)
+
+
+class FakeExplainCursor(object):
+
+    description = (('id',), ('type',), ('key',))
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, args=None):
+        self.connection.explained.append(query)
+
+    def fetchall(self):
+        return ((1, 'ref', 'address_UNIQUE'),)
+
+    def close(self):
+        pass
+
+
+class FakeClock(object):
+
+    now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class FakeCursor(object):
+
+    def __init__(self, connection, duration):
+        self.connection = connection
+        self.duration = duration
+        self.rowcount = 0
+
+    def execute(self, query, args=None):
+        self._executed = query % args if args is not None else query
+        self.rowcount = 3
+        # queries take as long as test says
+        slow_query.time.now += self.duration / 1000.0
+
+    def executemany(self, query, args):
+        for row in args:
+            self.execute(query, row)
+
+
+class TestCursor(ProfilingCursorMixIn, FakeCursor):
+    pass
+
+
+class SlowQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.time = slow_query.time
+        slow_query.time = FakeClock()
+        slow_query.SLOW_QUERY_LOG = SlowQueryLog(
+            threshold=50, explain_sample_rate=1, max_entries=2
+        )
+        self.connection = FakeConnection()
+
+    def tearDown(self):
+        slow_query.time = self.time
+        slow_query.SLOW_QUERY_LOG = None
+
+    def test_normalize_sql(self):
+        self.assertEquals(
+            normalize_sql('''SELECT * FROM ipv4_addresses
+            WHERE address IN (1, 2, 3) AND date_added > "2013-06-20"'''),
+            'SELECT * FROM ipv4_addresses WHERE address IN (?+) '
+            'AND date_added > ?'
+        )
+        self.assertEquals(
+            normalize_sql('INSERT INTO ipv6_addresses (address) VALUES '
+                          '(0xfe80), (0xfe81), (%s)'),
+            'INSERT INTO ipv6_addresses (address) VALUES (?+), ...'
+        )
+
+    def test_fast_query_is_not_recorded(self):
+        TestCursor(self.connection, 10).execute('SELECT 1')
+        self.assertEquals(slow_query.SLOW_QUERY_LOG.snapshot(), [])
+
+    def test_slow_query(self):
+        cursor = TestCursor(self.connection, 80)
+        cursor.execute('SELECT * FROM sources WHERE id = %s', (5,))
+        entry, = slow_query.SLOW_QUERY_LOG.snapshot()
+        self.assertEquals(entry.sql, 'SELECT * FROM sources WHERE id = 5')
+        self.assertEquals(entry.normalized,
+                          'SELECT * FROM sources WHERE id = ?')
+        self.assertEquals(entry.params, '(5,)')
+        self.assertEquals(entry.duration, 80)
+        self.assertEquals(entry.rows, 3)
+        self.assertEquals(entry.function, 'slow_query_tests.test_slow_query')
+        self.assertEquals(entry.plan, [
+            {'id': 1, 'type': 'ref', 'key': 'address_UNIQUE'}
+        ])
+        self.assertEquals(self.connection.explained,
+                          ['EXPLAIN SELECT * FROM sources WHERE id = 5'])
+
+    def test_ring_buffer_and_dump(self):
+        slow_query.SLOW_QUERY_LOG.explain_sample_rate = 0
+        cursor = TestCursor(self.connection, 100)
+        for source_id in xrange(3):
+            cursor.execute('SELECT * FROM sources WHERE id = %s',
+                           (source_id,))
+        cursor.duration = 75
+        cursor.executemany('DELETE FROM sources WHERE id = %s', [(1,), (2,)])
+        entries = slow_query.SLOW_QUERY_LOG.snapshot()
+        self.assertEquals(len(entries), 2)
+        self.assertEquals(entries[-1].normalized,
+                          'DELETE FROM sources WHERE id = ?')
+        self.assertEquals(self.connection.explained, [])
+        stream = StringIO()
+        self.assertEquals(slow_query.SLOW_QUERY_LOG.dump(stream), 2)
+        lines = stream.getvalue().splitlines()
+        self.assertEquals(json.loads(lines[0])['rows'], 3)
+        self.assertEquals(
+            [group[:2] for group in summarize(lines)],
+            [('DELETE FROM sources WHERE id = ?', 1),
+             ('SELECT * FROM sources WHERE id = ?', 1)]
+        )
+
+    def test_configure(self):
+        slow_query.SLOW_QUERY_LOG = None
+        cursorclass = slow_query.configure({'threshold': '20'})
+        self.assertIs(cursorclass, slow_query.ProfilingCursor)
+        self.assertEquals(slow_query.get_slow_query_log().threshold, 20)
+
+    def test_server_side_cursor(self):
+        self.assertIs(slow_query.server_side_cursor(),
+                      slow_query.SSProfilingCursor)
+        slow_query.SLOW_QUERY_LOG = None
+        self.assertIs(slow_query.server_side_cursor(),
+                      slow_query.MySQLdb.cursors.SSCursor)
+
+
+if __name__ == '__main__':
+    unittest.main()
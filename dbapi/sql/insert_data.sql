@@ -36,3 +36,20 @@ INSERT INTO blacklist (v4_id_blacklist) VALUES
 (2),
 (5),
 (6);
+
+INSERT INTO list_membership (address_version, address_id, list_type) VALUES
+(4, 3, 'whitelist'),
+(4, 4, 'whitelist'),
+(4, 7, 'whitelist'),
+(4, 8, 'whitelist'),
+(4, 1, 'blacklist'),
+(4, 2, 'blacklist'),
+(4, 5, 'blacklist'),
+(4, 6, 'blacklist');
+
+INSERT INTO source_stats (source_id, v4_count, whitelisted_count,
+    blacklisted_count, last_updated) VALUES
+(1, 2, 0, 2, NOW()),
+(2, 2, 2, 0, NOW()),
+(3, 2, 0, 2, NOW()),
+(4, 1, 1, 0, NOW());
@@ -19,11 +19,12 @@ DEFAULT CHARACTER SET = utf8;
 -- -----------------------------------------------------
 -- Table ipv6_addresses
 -- Stores address id, when address was added and address
--- in binary form
+-- as 16 bytes in network order, so byte order of values
+-- is numeric order of addresses
 -- -----------------------------------------------------
 CREATE  TABLE IF NOT EXISTS ipv6_addresses (
   id INT(11) NOT NULL AUTO_INCREMENT,
-  address VARBINARY(16) NOT NULL,
+  address BINARY(16) NOT NULL,
   date_added DATE NULL DEFAULT NULL,
   PRIMARY KEY (id),
   UNIQUE INDEX address_UNIQUE (address) )
@@ -40,12 +41,12 @@ DEFAULT CHARACTER SET = utf8;
 CREATE  TABLE IF NOT EXISTS blacklist (
   v4_id_blacklist INT(11) NULL DEFAULT NULL,
   v6_id_blacklist INT(11) NULL DEFAULT NULL,
-  CONSTRAINT
+  CONSTRAINT blacklist_v4_id_fk
     FOREIGN KEY (v4_id_blacklist)
     REFERENCES ipv4_addresses (id)
     ON DELETE NO ACTION
     ON UPDATE NO ACTION,
-  CONSTRAINT
+  CONSTRAINT blacklist_v6_id_fk
     FOREIGN KEY (v6_id_blacklist)
     REFERENCES ipv6_addresses (id)
     ON DELETE NO ACTION
@@ -67,7 +68,8 @@ CREATE  TABLE IF NOT EXISTS sources (
   source_date_added DATE NULL DEFAULT NULL,
   url_date_modified DATE NULL DEFAULT NULL,
   rank TINYINT(4) NOT NULL,
-  PRIMARY KEY (id) )
+  PRIMARY KEY (id),
+  INDEX source_name_INDEX (source_name) )
 ENGINE = InnoDB
 DEFAULT CHARACTER SET = utf8;
 
@@ -79,6 +81,9 @@ DEFAULT CHARACTER SET = utf8;
 -- that was added by that source, since clolumns may not
 -- be unique - many ip addresses can belong to single source
 -- When ipv4 added, v6 stays NULL, and vice versa
+-- Address foreign keys of this table, whitelist and
+-- blacklist delete rows together with address after
+-- migrations/cascade_delete.sql
 -- -----------------------------------------------------
 CREATE  TABLE IF NOT EXISTS source_to_addresses (
   source_id INT(11) NULL DEFAULT NULL,
@@ -89,12 +94,12 @@ CREATE  TABLE IF NOT EXISTS source_to_addresses (
     REFERENCES sources (id)
     ON DELETE NO ACTION
     ON UPDATE NO ACTION,
-  CONSTRAINT
+  CONSTRAINT source_to_addresses_v4_id_fk
     FOREIGN KEY (v4_id)
     REFERENCES ipv4_addresses (id)
     ON DELETE NO ACTION
     ON UPDATE NO ACTION,
-  CONSTRAINT
+  CONSTRAINT source_to_addresses_v6_id_fk
     FOREIGN KEY (v6_id)
     REFERENCES ipv6_addresses (id)
     ON DELETE NO ACTION
@@ -112,15 +117,121 @@ DEFAULT CHARACTER SET = utf8;
 CREATE  TABLE IF NOT EXISTS whitelist (
   v4_id_whitelist INT(11) NULL DEFAULT NULL,
   v6_id_whitelist INT(11) NULL DEFAULT NULL,
-  CONSTRAINT
+  CONSTRAINT whitelist_v4_id_fk
     FOREIGN KEY (v4_id_whitelist)
     REFERENCES ipv4_addresses (id)
     ON DELETE NO ACTION
     ON UPDATE NO ACTION,
-  CONSTRAINT
+  CONSTRAINT whitelist_v6_id_fk
     FOREIGN KEY (v6_id_whitelist)
     REFERENCES ipv6_addresses (id)
     ON DELETE NO ACTION
     ON UPDATE NO ACTION)
 ENGINE = InnoDB
 DEFAULT CHARACTER SET = utf8;
+
+
+-- -----------------------------------------------------
+-- Table address_scores
+-- Summary of address reputation computed from sources:
+-- number of sources that list address, maximal rank
+-- of those sources and sum of their ranks
+-- Kept up to date by refresh_ip_scores from dbapi
+-- -----------------------------------------------------
+CREATE  TABLE IF NOT EXISTS address_scores (
+  address_version TINYINT(4) NOT NULL,
+  address_id INT(11) NOT NULL,
+  source_count INT(11) NOT NULL,
+  max_rank TINYINT(4) NOT NULL,
+  weighted_rank INT(11) NOT NULL,
+  PRIMARY KEY (address_version, address_id),
+  INDEX weighted_rank_INDEX (address_version, weighted_rank) )
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8;
+
+
+-- -----------------------------------------------------
+-- Table address_scores_dirty
+-- Addresses unlinked from sources since last refresh of
+-- scores, filled by trigger on source_to_addresses and
+-- emptied by refresh_ip_scores from dbapi
+-- -----------------------------------------------------
+CREATE  TABLE IF NOT EXISTS address_scores_dirty (
+  address_version TINYINT(4) NOT NULL,
+  address_id INT(11) NOT NULL,
+  PRIMARY KEY (address_version, address_id) )
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8;
+
+DROP TRIGGER IF EXISTS source_to_addresses_after_delete;
+
+CREATE TRIGGER source_to_addresses_after_delete
+AFTER DELETE ON source_to_addresses FOR EACH ROW
+  INSERT IGNORE INTO address_scores_dirty (address_version, address_id)
+  VALUES (IF(OLD.v4_id IS NULL, 6, 4), IFNULL(OLD.v4_id, OLD.v6_id));
+
+
+-- -----------------------------------------------------
+-- Table source_stats
+-- Number of v4 and v6 addresses of each source and how
+-- many of them are whitelisted and blacklisted
+-- Updated by dbapi insert, link and delete functions,
+-- rebuild_source_stats recomputes it from scratch
+-- -----------------------------------------------------
+CREATE  TABLE IF NOT EXISTS source_stats (
+  source_id INT(11) NOT NULL,
+  v4_count INT(11) NOT NULL DEFAULT 0,
+  v6_count INT(11) NOT NULL DEFAULT 0,
+  whitelisted_count INT(11) NOT NULL DEFAULT 0,
+  blacklisted_count INT(11) NOT NULL DEFAULT 0,
+  last_updated DATETIME NULL DEFAULT NULL,
+  PRIMARY KEY (source_id),
+  CONSTRAINT
+    FOREIGN KEY (source_id)
+    REFERENCES sources (id)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8;
+
+
+-- -----------------------------------------------------
+-- Table list_membership
+-- Unified replacement of whitelist and blacklist tables,
+-- one row per listed address keyed by address version
+-- and id, so address can be only in one list
+-- Used by dbapi list functions after
+-- dbapi.use_list_membership(), see
+-- migrations/list_membership.sql
+-- -----------------------------------------------------
+CREATE  TABLE IF NOT EXISTS list_membership (
+  address_version TINYINT(4) NOT NULL,
+  address_id INT(11) NOT NULL,
+  list_type ENUM('whitelist', 'blacklist') NOT NULL,
+  PRIMARY KEY (address_version, address_id),
+  INDEX list_type_INDEX (list_type, address_version, address_id) )
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8;
+
+
+-- -----------------------------------------------------
+-- Table source_fetch_state
+-- Result of last feed download of each source: ETag and
+-- Last-Modified headers sent back in conditional
+-- requests, time and HTTP status of last fetch
+-- Updated by feed_fetcher
+-- -----------------------------------------------------
+CREATE  TABLE IF NOT EXISTS source_fetch_state (
+  source_id INT(11) NOT NULL,
+  etag VARCHAR(255) NULL DEFAULT NULL,
+  last_modified VARCHAR(64) NULL DEFAULT NULL,
+  last_fetched DATETIME NULL DEFAULT NULL,
+  last_status SMALLINT(6) NOT NULL DEFAULT 0,
+  PRIMARY KEY (source_id),
+  CONSTRAINT
+    FOREIGN KEY (source_id)
+    REFERENCES sources (id)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8;
@@ -0,0 +1,99 @@
+-- -----------------------------------------------------
+-- SQLite form of ip_addresses.sql used by sqlite_backend
+-- on edge nodes. Tables keep ids of MySQL primary and are
+-- filled by sqlite_backend.sync_from_mysql, lists are
+-- stored in unified list_membership table
+-- -----------------------------------------------------
+PRAGMA journal_mode = WAL;
+
+-- -----------------------------------------------------
+-- Table ipv4_addresses
+-- Address as integer
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS ipv4_addresses (
+  id INTEGER PRIMARY KEY,
+  address INTEGER NOT NULL,
+  date_added DATE NULL DEFAULT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ipv4_address_UNIQUE
+  ON ipv4_addresses (address);
+
+
+-- -----------------------------------------------------
+-- Table ipv6_addresses
+-- Address as 16 byte blob in network order
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS ipv6_addresses (
+  id INTEGER PRIMARY KEY,
+  address BLOB NOT NULL,
+  date_added DATE NULL DEFAULT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ipv6_address_UNIQUE
+  ON ipv6_addresses (address);
+
+
+-- -----------------------------------------------------
+-- Table sources
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS sources (
+  id INTEGER PRIMARY KEY,
+  source_name TEXT NULL DEFAULT NULL,
+  url TEXT NULL DEFAULT NULL,
+  source_date_added DATE NULL DEFAULT NULL,
+  url_date_modified DATE NULL DEFAULT NULL,
+  rank INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS source_name_INDEX ON sources (source_name);
+
+
+-- -----------------------------------------------------
+-- Table source_to_addresses
+-- When ipv4 added, v6 stays NULL, and vice versa
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS source_to_addresses (
+  source_id INTEGER NULL DEFAULT NULL,
+  v4_id INTEGER NULL DEFAULT NULL,
+  v6_id INTEGER NULL DEFAULT NULL
+);
+CREATE INDEX IF NOT EXISTS source_to_addresses_v4_INDEX
+  ON source_to_addresses (v4_id);
+CREATE INDEX IF NOT EXISTS source_to_addresses_v6_INDEX
+  ON source_to_addresses (v6_id);
+
+
+-- -----------------------------------------------------
+-- Table list_membership
+-- One row per listed address of whitelist or blacklist
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS list_membership (
+  address_version INTEGER NOT NULL,
+  address_id INTEGER NOT NULL,
+  list_type TEXT NOT NULL
+    CHECK (list_type IN ('whitelist', 'blacklist')),
+  PRIMARY KEY (address_version, address_id)
+);
+
+
+-- -----------------------------------------------------
+-- Table address_scores
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS address_scores (
+  address_version INTEGER NOT NULL,
+  address_id INTEGER NOT NULL,
+  source_count INTEGER NOT NULL,
+  max_rank INTEGER NOT NULL,
+  weighted_rank INTEGER NOT NULL,
+  PRIMARY KEY (address_version, address_id)
+);
+
+
+-- -----------------------------------------------------
+-- Table sync_state
+-- Number of rows copied from MySQL primary and time of
+-- last sync of each table
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS sync_state (
+  table_name TEXT PRIMARY KEY,
+  row_count INTEGER NOT NULL,
+  synced_at TIMESTAMP NOT NULL
+);
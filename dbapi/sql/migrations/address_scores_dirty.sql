@@ -0,0 +1,12 @@
+-- -----------------------------------------------------
+-- Migration for databases created before
+-- address_scores_dirty table was added: run
+-- ip_addresses.sql to create the table and trigger,
+-- then this script, which marks all scored addresses,
+-- so next refresh_ip_scores recomputes scores left
+-- stale by unlinks done before the trigger existed
+-- -----------------------------------------------------
+USE ip_addresses ;
+
+INSERT IGNORE INTO address_scores_dirty (address_version, address_id)
+SELECT address_version, address_id FROM address_scores;
@@ -0,0 +1,87 @@
+-- -----------------------------------------------------
+-- Migration to ON DELETE CASCADE schema: foreign keys
+-- from links and lists to address tables are replaced
+-- with named constraints that delete dependent rows
+-- together with address, list_membership and
+-- address_scores rows, which have no foreign keys, are
+-- deleted by triggers
+-- Constraints are dropped by names given to them in
+-- ip_addresses.sql
+-- After migration switch dbapi with
+-- dbapi.use_cascade_delete(), old delete functions
+-- keep working on migrated schema
+-- -----------------------------------------------------
+USE ip_addresses ;
+
+ALTER TABLE source_to_addresses
+  DROP FOREIGN KEY source_to_addresses_v4_id_fk,
+  DROP FOREIGN KEY source_to_addresses_v6_id_fk;
+
+ALTER TABLE source_to_addresses
+  ADD CONSTRAINT source_to_addresses_v4_id_fk
+    FOREIGN KEY (v4_id)
+    REFERENCES ipv4_addresses (id)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION,
+  ADD CONSTRAINT source_to_addresses_v6_id_fk
+    FOREIGN KEY (v6_id)
+    REFERENCES ipv6_addresses (id)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION;
+
+ALTER TABLE whitelist
+  DROP FOREIGN KEY whitelist_v4_id_fk,
+  DROP FOREIGN KEY whitelist_v6_id_fk;
+
+ALTER TABLE whitelist
+  ADD CONSTRAINT whitelist_v4_id_fk
+    FOREIGN KEY (v4_id_whitelist)
+    REFERENCES ipv4_addresses (id)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION,
+  ADD CONSTRAINT whitelist_v6_id_fk
+    FOREIGN KEY (v6_id_whitelist)
+    REFERENCES ipv6_addresses (id)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION;
+
+ALTER TABLE blacklist
+  DROP FOREIGN KEY blacklist_v4_id_fk,
+  DROP FOREIGN KEY blacklist_v6_id_fk;
+
+ALTER TABLE blacklist
+  ADD CONSTRAINT blacklist_v4_id_fk
+    FOREIGN KEY (v4_id_blacklist)
+    REFERENCES ipv4_addresses (id)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION,
+  ADD CONSTRAINT blacklist_v6_id_fk
+    FOREIGN KEY (v6_id_blacklist)
+    REFERENCES ipv6_addresses (id)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION;
+
+DROP TRIGGER IF EXISTS ipv4_addresses_after_delete;
+DROP TRIGGER IF EXISTS ipv6_addresses_after_delete;
+
+CREATE TRIGGER ipv4_addresses_after_delete
+AFTER DELETE ON ipv4_addresses FOR EACH ROW
+  DELETE list_membership, address_scores
+  FROM (SELECT 4 AS address_version, OLD.id AS address_id) AS deleted
+  LEFT JOIN list_membership
+    ON list_membership.address_version = deleted.address_version
+    AND list_membership.address_id = deleted.address_id
+  LEFT JOIN address_scores
+    ON address_scores.address_version = deleted.address_version
+    AND address_scores.address_id = deleted.address_id;
+
+CREATE TRIGGER ipv6_addresses_after_delete
+AFTER DELETE ON ipv6_addresses FOR EACH ROW
+  DELETE list_membership, address_scores
+  FROM (SELECT 6 AS address_version, OLD.id AS address_id) AS deleted
+  LEFT JOIN list_membership
+    ON list_membership.address_version = deleted.address_version
+    AND list_membership.address_id = deleted.address_id
+  LEFT JOIN address_scores
+    ON address_scores.address_version = deleted.address_version
+    AND address_scores.address_id = deleted.address_id;
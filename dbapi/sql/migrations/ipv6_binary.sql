@@ -0,0 +1,14 @@
+-- -----------------------------------------------------
+-- Migration for databases where v6 addresses were
+-- stored as bit literals: VARBINARY values without
+-- leading zero bytes are padded to 16 bytes, so that
+-- range queries compare them as numbers, and column
+-- becomes fixed length BINARY(16)
+-- -----------------------------------------------------
+USE ip_addresses ;
+
+UPDATE ipv6_addresses
+SET address = UNHEX(LPAD(HEX(address), 32, '0'))
+WHERE LENGTH(address) < 16;
+
+ALTER TABLE ipv6_addresses MODIFY address BINARY(16) NOT NULL;
@@ -0,0 +1,26 @@
+-- -----------------------------------------------------
+-- Migration from whitelist and blacklist tables to
+-- list_membership table: run ip_addresses.sql to create
+-- the table, then this script to copy existing rows
+-- Whitelist is copied first, so address that is in both
+-- lists stays whitelisted
+-- Old tables are kept, drop them after switching to
+-- dbapi.use_list_membership()
+-- -----------------------------------------------------
+USE ip_addresses ;
+
+INSERT IGNORE INTO list_membership (address_version, address_id, list_type)
+SELECT 4, v4_id_whitelist, 'whitelist' FROM whitelist
+WHERE v4_id_whitelist IS NOT NULL;
+
+INSERT IGNORE INTO list_membership (address_version, address_id, list_type)
+SELECT 6, v6_id_whitelist, 'whitelist' FROM whitelist
+WHERE v6_id_whitelist IS NOT NULL;
+
+INSERT IGNORE INTO list_membership (address_version, address_id, list_type)
+SELECT 4, v4_id_blacklist, 'blacklist' FROM blacklist
+WHERE v4_id_blacklist IS NOT NULL;
+
+INSERT IGNORE INTO list_membership (address_version, address_id, list_type)
+SELECT 6, v6_id_blacklist, 'blacklist' FROM blacklist
+WHERE v6_id_blacklist IS NOT NULL;
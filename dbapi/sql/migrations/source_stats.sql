@@ -0,0 +1,32 @@
+-- -----------------------------------------------------
+-- Migration for databases created before source_stats
+-- table was added: run ip_addresses.sql to create the
+-- table, then this script to index source names and
+-- fill statistics of existing sources
+-- -----------------------------------------------------
+USE ip_addresses ;
+
+ALTER TABLE sources ADD INDEX source_name_INDEX (source_name);
+
+REPLACE INTO source_stats (source_id, v4_count, v6_count,
+    whitelisted_count, blacklisted_count, last_updated)
+SELECT sources.id,
+    COUNT(source_to_addresses.v4_id),
+    COUNT(source_to_addresses.v6_id),
+    COUNT(whitelist_v4.v4_id_whitelist)
+        + COUNT(whitelist_v6.v6_id_whitelist),
+    COUNT(blacklist_v4.v4_id_blacklist)
+        + COUNT(blacklist_v6.v6_id_blacklist),
+    NOW()
+FROM sources
+LEFT JOIN source_to_addresses
+    ON source_to_addresses.source_id = sources.id
+LEFT JOIN whitelist AS whitelist_v4
+    ON whitelist_v4.v4_id_whitelist = source_to_addresses.v4_id
+LEFT JOIN whitelist AS whitelist_v6
+    ON whitelist_v6.v6_id_whitelist = source_to_addresses.v6_id
+LEFT JOIN blacklist AS blacklist_v4
+    ON blacklist_v4.v4_id_blacklist = source_to_addresses.v4_id
+LEFT JOIN blacklist AS blacklist_v6
+    ON blacklist_v6.v6_id_blacklist = source_to_addresses.v6_id
+GROUP BY sources.id;
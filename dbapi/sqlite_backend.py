@@ -0,0 +1,347 @@
+"""Module implements read-only dbapi lookups on embedded SQLite database for
+edge nodes, which don't run MySQL. Database file has schema of
+sql/ip_addresses_sqlite.sql, works in WAL mode, so lookups are not blocked
+while sync_from_mysql copies fresh contents from MySQL primary. Lookup
+functions have the same names, parameters and results as in dbapi and take
+sqlite3 connection instead of MySQL one:
+
+    connection = sqlite_backend.connect('ip_addresses.db')
+    sqlite_backend.sync_from_mysql(connection, mysql_connection)
+    sqlite_backend.find_ip_list_type(connection, '192.168.1.1')
+
+Sync copies whole tables in one SQLite transaction:
+
+    python sqlite_backend.py dbapi.cfg ip_addresses.db
+
+:classes: SQLitePool
+:functions: connect, sync_from_mysql, find_ip_id, check_if_ip_in_database,
+find_ip_list_type, find_ip_list_types, get_sourcename_list_with_ip,
+get_ip_score, get_ip_from_range"""
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+import MySQLdb as mdb
+from netaddr import IPAddress
+
+import dbapi
+from dbapi_exceptions import SQLSyntaxError
+from logging_conf import create_logger
+from mysql_connector import get_database_connection
+from slow_query import server_side_cursor
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+SCHEMA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'sql',
+    'ip_addresses_sqlite.sql'
+)
+
+# tables copied by sync_from_mysql with their columns, lists are read into
+# list_membership from whichever list tables dbapi uses
+SYNC_TABLES = (
+    ('sources', ('id', 'source_name', 'url', 'source_date_added',
+                 'url_date_modified', 'rank')),
+    ('ipv4_addresses', ('id', 'address', 'date_added')),
+    ('ipv6_addresses', ('id', 'address', 'date_added')),
+    ('source_to_addresses', ('source_id', 'v4_id', 'v6_id')),
+    ('list_membership', ('address_version', 'address_id', 'list_type')),
+    ('address_scores', ('address_version', 'address_id', 'source_count',
+                        'max_rank', 'weighted_rank')),
+)
+
+LEGACY_LISTS_SQL = ' UNION ALL '.join(
+    'SELECT {0}, v{0}_id_{1}, "{1}" FROM {1} '
+    'WHERE v{0}_id_{1} IS NOT NULL'.format(ip_version, list_type)
+    for list_type in ('whitelist', 'blacklist') for ip_version in (4, 6)
+)
+
+
+def connect(filename):
+    """Open SQLite database, create tables if they don't exist
+
+    :param filename: Name of database file.
+    :type filename: str.
+    :returns: sqlite3.Connection -- connection which can be used from any
+    thread, DATE columns are returned as datetime.date.
+
+    """
+    connection = sqlite3.connect(
+        filename, detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=False
+    )
+    # schema turns on WAL mode, so readers see last committed sync while
+    # next one is written
+    with open(SCHEMA) as schema:
+        connection.executescript(schema.read())
+    connection.execute('PRAGMA synchronous = NORMAL')
+    return connection
+
+
+class _ThreadConnection(object):
+    """Connection of one thread, stays open when caller closes it"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        pass
+
+
+class SQLitePool(object):
+    """Gives each thread its own connection to SQLite database, can be
+    used instead of pooling.create_pool in lookup_service"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = _ThreadConnection(
+                connect(self.filename)
+            )
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def dispose(self):
+        """Close connections of all threads, threads get new ones on next
+        connect"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        for connection in connections:
+            connection._connection.close()
+
+
+def _sql_value(ip_address):
+    """Return address column value and ip version of ip address"""
+    ip_value, ip_version = dbapi.get_ip_data(ip_address)
+    if ip_version == 6:
+        return buffer(IPAddress(ip_address).packed), ip_version
+    return ip_value, ip_version
+
+
+def _address_key(ip_version, value):
+    """Return integer value of address column value"""
+    if ip_version == 6:
+        return dbapi._address_value(6, str(value))
+    return value
+
+
+def _query(connection, sql, args=(), fetch='all'):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, args)
+        if fetch == 'one':
+            return cursor.fetchone()
+        return cursor.fetchall()
+    except sqlite3.OperationalError as sqlite_error:
+        MODULE_LOGGER.error(str(sqlite_error))
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+
+
+def find_ip_id(connection, ip_address):
+    """Same as dbapi.find_ip_id"""
+    ip_value, ip_version = _sql_value(ip_address)
+    row = _query(
+        connection,
+        'SELECT id FROM ipv%s_addresses WHERE address = ?' % ip_version,
+        (ip_value,), 'one'
+    )
+    return row[0] if row else None
+
+
+def check_if_ip_in_database(connection, ip_address):
+    """Same as dbapi.check_if_ip_in_database"""
+    return find_ip_id(connection, ip_address) is not None
+
+
+def find_ip_list_type(connection, ip_address):
+    """Same as dbapi.find_ip_list_type"""
+    ip_value, ip_version = _sql_value(ip_address)
+    row = _query(connection, '''
+    SELECT list_membership.list_type
+    FROM ipv{0}_addresses
+    LEFT JOIN list_membership
+        ON list_membership.address_version = {0}
+        AND list_membership.address_id = ipv{0}_addresses.id
+    WHERE ipv{0}_addresses.address = ?'''.format(ip_version),
+        (ip_value,), 'one')
+    list_name = row[0] if row else None
+    MODULE_LOGGER.debug(
+        "Get %s list type. Found: %s" % (ip_address, list_name)
+    )
+    return list_name
+
+
+def find_ip_list_types(connection, ip_addresses, chunk_size=500):
+    """Same as dbapi.find_ip_list_types, chunk_size is kept below SQLite
+    limit of query parameters"""
+    addresses = {4: {}, 6: {}}
+    for ip_address in ip_addresses:
+        ip_value, ip_version = _sql_value(ip_address)
+        key = _address_key(ip_version, ip_value)
+        addresses[ip_version].setdefault(key, (ip_value, []))[1].append(
+            ip_address
+        )
+    result = {}
+    for ip_version in (4, 6):
+        values = [value for value, _ in addresses[ip_version].values()]
+        for start in xrange(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            # with left join address index drives the query, planner may
+            # scan list_membership for inner join before ANALYZE
+            rows = _query(connection, '''
+            SELECT ipv{0}_addresses.address, list_membership.list_type
+            FROM ipv{0}_addresses
+            LEFT JOIN list_membership
+                ON list_membership.address_version = {0}
+                AND list_membership.address_id = ipv{0}_addresses.id
+            WHERE ipv{0}_addresses.address IN ({1})'''.format(
+                ip_version, ', '.join('?' * len(chunk))
+            ), chunk)
+            for value, list_name in rows:
+                key = _address_key(ip_version, value)
+                for ip_address in addresses[ip_version][key][1]:
+                    result[ip_address] = list_name
+        for _, ip_address_list in addresses[ip_version].values():
+            for ip_address in ip_address_list:
+                result.setdefault(ip_address, None)
+    return result
+
+
+def get_sourcename_list_with_ip(connection, ip_address):
+    """Same as dbapi.get_sourcename_list_with_ip"""
+    ip_value, ip_version = _sql_value(ip_address)
+    return tuple(_query(connection, '''
+    SELECT sources.source_name
+    FROM ipv{0}_addresses
+    JOIN source_to_addresses
+        ON source_to_addresses.v{0}_id = ipv{0}_addresses.id
+    JOIN sources ON sources.id = source_to_addresses.source_id
+    WHERE ipv{0}_addresses.address = ?'''.format(ip_version), (ip_value,)))
+
+
+def get_ip_score(connection, ip_address):
+    """Same as dbapi.get_ip_score"""
+    ip_value, ip_version = _sql_value(ip_address)
+    return _query(connection, '''
+    SELECT address_scores.source_count, address_scores.max_rank,
+        address_scores.weighted_rank
+    FROM address_scores
+    JOIN ipv{0}_addresses ON address_scores.address_id = ipv{0}_addresses.id
+    WHERE address_scores.address_version = {0}
+    AND ipv{0}_addresses.address = ?'''.format(ip_version), (ip_value,),
+                  'one')
+
+
+def get_ip_from_range(connection, start, end, limit=None):
+    """Same as dbapi.get_ip_from_range"""
+    start_value, start_version = _sql_value(start)
+    end_value, end_version = _sql_value(end)
+    if start_version != end_version:
+        raise Exception("Different ip versions in start and end")
+    sql = '''
+    SELECT id, address, date_added FROM ipv{0}_addresses
+    WHERE address BETWEEN ? AND ?
+    ORDER BY address'''.format(start_version)
+    args = (start_value, end_value)
+    if limit:
+        sql += ' LIMIT ? OFFSET ?'
+        args += (limit[1], limit[0])
+    return tuple(_query(connection, sql, args))
+
+
+def _mysql_rows(mysql_connection, table, columns, batch_size):
+    """Generate rows of MySQL table in batches, v6 addresses as blobs"""
+    if table == 'list_membership' and not dbapi.LIST_MEMBERSHIP:
+        sql = LEGACY_LISTS_SQL
+    else:
+        sql = 'SELECT %s FROM %s' % (
+            ', '.join('`%s`' % column for column in columns), table
+        )
+    cursor = mysql_connection.cursor(server_side_cursor())
+    try:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if table == 'ipv6_addresses':
+                rows = [
+                    (ip_id, buffer(value), date_added)
+                    for ip_id, value, date_added in rows
+                ]
+            yield rows
+    except mdb.ProgrammingError as mdb_error:
+        MODULE_LOGGER.error(mdb_error.message)
+        raise SQLSyntaxError
+    finally:
+        cursor.close()
+
+
+def sync_from_mysql(connection, mysql_connection, batch_size=10000):
+    """Replace contents of SQLite database with sources, addresses, links,
+    lists and scores from MySQL. Everything is copied in one transaction,
+    readers see old contents until it is committed.
+
+    :param connection: SQLite database connection.
+    :type connection: sqlite3.Connection.
+    :param mysql_connection: MySQL database connection.
+    :type mysql_connection: MySQLdb.connections.Connection.
+    :param batch_size: Number of rows read from MySQL at once.
+    :type batch_size: int.
+    :returns: dict -- number of rows copied to each table.
+
+    """
+    counts = {}
+    synced_at = datetime.now()
+    with connection:
+        for table, columns in SYNC_TABLES:
+            connection.execute('DELETE FROM %s' % table)
+            insert = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                table, ', '.join(columns), ', '.join('?' * len(columns))
+            )
+            counts[table] = 0
+            for rows in _mysql_rows(mysql_connection, table, columns,
+                                    batch_size):
+                connection.executemany(insert, rows)
+                counts[table] += len(rows)
+            connection.execute(
+                'INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)',
+                (table, counts[table], synced_at)
+            )
+    # statistics of query planner
+    connection.execute('ANALYZE')
+    MODULE_LOGGER.debug('Synced SQLite database from MySQL: %s' % counts)
+    return counts
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit('usage: %s CONFIG SQLITE_FILE' % sys.argv[0])
+    mysql_connection = get_database_connection(sys.argv[1], 'MySQL settings')
+    connection = connect(sys.argv[2])
+    try:
+        counts = sync_from_mysql(connection, mysql_connection)
+    finally:
+        connection.close()
+        mysql_connection.close()
+    for table, _ in SYNC_TABLES:
+        print('%s: %s rows' % (table, counts[table]))
+
+
+if __name__ == '__main__':
+    main()
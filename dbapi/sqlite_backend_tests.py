@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from netaddr import IPAddress
+
+import sqlite_backend
+
+MYSQL_TABLES = {
+    'sources': [
+        (1, 'spam', 'http://spam.example', date(2013, 6, 20), None, 5),
+        (2, 'ham', None, date(2013, 6, 20), None, 3),
+    ],
+    'ipv4_addresses': [
+        (1, IPAddress('1.1.1.1').value, date(2013, 6, 20)),
+        (2, IPAddress('192.168.1.1').value, date(2013, 6, 21)),
+        (3, IPAddress('10.0.0.1').value, None),
+    ],
+    'ipv6_addresses': [
+        (1, IPAddress('fe80::1').packed, date(2013, 6, 20)),
+    ],
+    'source_to_addresses': [
+        (1, 1, None), (2, 1, None), (1, None, 1),
+    ],
+    'list_membership': [
+        (4, 1, 'blacklist'), (4, 2, 'whitelist'), (6, 1, 'blacklist'),
+    ],
+    'address_scores': [
+        (4, 1, 2, 5, 8),
+    ],
+}
+
+
+class FakeMySQLCursor(object):
+
+    def execute(self, sql):
+        # legacy list tables are read only when list_membership is off
+        table = 'list_membership' if 'UNION' in sql else sql.split()[-1]
+        self.rows = list(MYSQL_TABLES[table])
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeMySQLConnection(object):
+
+    def cursor(self, cursorclass=None):
+        return FakeMySQLCursor()
+
+
+class SQLiteBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'ip_addresses.db')
+        self.connection = sqlite_backend.connect(self.filename)
+        self.counts = sqlite_backend.sync_from_mysql(
+            self.connection, FakeMySQLConnection(), batch_size=2
+        )
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def test_sync(self):
+        self.assertEquals(self.counts['ipv4_addresses'], 3)
+        self.assertEquals(self.counts['list_membership'], 3)
+        self.assertEquals(
+            self.connection.execute('PRAGMA journal_mode').fetchone()[0],
+            'wal'
+        )
+        # second sync replaces rows instead of adding them
+        sqlite_backend.sync_from_mysql(
+            self.connection, FakeMySQLConnection()
+        )
+        self.assertEquals(
+            self.connection.execute(
+                'SELECT COUNT(*) FROM source_to_addresses'
+            ).fetchone()[0],
+            3
+        )
+
+    def test_lookups(self):
+        self.assertEquals(
+            sqlite_backend.find_ip_list_type(self.connection, '1.1.1.1'),
+            'blacklist'
+        )
+        self.assertEquals(
+            sqlite_backend.find_ip_list_type(self.connection, '10.0.0.1'),
+            None
+        )
+        self.assertEquals(
+            sqlite_backend.find_ip_list_types(
+                self.connection,
+                ['1.1.1.1', '192.168.1.1', 'fe80::1', '8.8.8.8']
+            ),
+            {'1.1.1.1': 'blacklist', '192.168.1.1': 'whitelist',
+             'fe80::1': 'blacklist', '8.8.8.8': None}
+        )
+        self.assertTrue(
+            sqlite_backend.check_if_ip_in_database(self.connection,
+                                                   'fe80::1')
+        )
+        self.assertFalse(
+            sqlite_backend.check_if_ip_in_database(self.connection,
+                                                   '8.8.8.8')
+        )
+        self.assertEquals(
+            sorted(sqlite_backend.get_sourcename_list_with_ip(
+                self.connection, '1.1.1.1'
+            )),
+            [('ham',), ('spam',)]
+        )
+        self.assertEquals(
+            sqlite_backend.get_ip_score(self.connection, '1.1.1.1'),
+            (2, 5, 8)
+        )
+
+    def test_get_ip_from_range(self):
+        rows = sqlite_backend.get_ip_from_range(
+            self.connection, '1.0.0.0', '192.168.1.1', (1, 5)
+        )
+        self.assertEquals(
+            [(row[0], row[2]) for row in rows],
+            [(3, None), (2, date(2013, 6, 21))]
+        )
+
+    def test_pool(self):
+        pool = sqlite_backend.SQLitePool(self.filename)
+        connection = pool.connect()
+        connection.close()
+        self.assertIs(pool.connect(), connection)
+        self.assertEquals(
+            sqlite_backend.find_ip_list_type(connection, 'fe80::1'),
+            'blacklist'
+        )
+        pool.dispose()
+        self.assertIsNot(pool.connect(), connection)
+        pool.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
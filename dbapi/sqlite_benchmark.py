@@ -0,0 +1,74 @@
+"""Benchmark of list type lookups on MySQL from dbapi.cfg against the same
+lookups on local SQLite copy made by sqlite_backend.sync_from_mysql. Looks
+up addresses of database, half of them in random order, and as many
+addresses which are not in database."""
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import dbapi
+import sqlite_backend
+from mysql_connector import get_database_connection
+from rows import decode_address
+
+LOOKUPS = 10000
+
+
+def sample_addresses(mysql_connection):
+    cursor = mysql_connection.cursor()
+    cursor.execute('SELECT address FROM ipv4_addresses LIMIT %s'
+                   % (LOOKUPS / 2))
+    ip_addresses = [decode_address(row[0]) for row in cursor.fetchall()]
+    cursor.close()
+    ip_addresses += [
+        '14.%s.%s.%s' % (random.randint(0, 255), random.randint(0, 255),
+                         random.randint(0, 255))
+        for _ in xrange(LOOKUPS - len(ip_addresses))
+    ]
+    random.shuffle(ip_addresses)
+    return ip_addresses
+
+
+def timed(module, connection, ip_addresses):
+    """Return microseconds per single lookup and per address of batched
+    lookup"""
+    start = time.time()
+    for ip_address in ip_addresses:
+        module.find_ip_list_type(connection, ip_address)
+    single = (time.time() - start) * 1000000 / len(ip_addresses)
+    start = time.time()
+    module.find_ip_list_types(connection, ip_addresses)
+    batched = (time.time() - start) * 1000000 / len(ip_addresses)
+    return single, batched
+
+
+def main():
+    mysql_connection = get_database_connection('dbapi.cfg', 'MySQL settings')
+    directory = tempfile.mkdtemp()
+    connection = sqlite_backend.connect(
+        os.path.join(directory, 'ip_addresses.db')
+    )
+    try:
+        start = time.time()
+        counts = sqlite_backend.sync_from_mysql(connection, mysql_connection)
+        print('sync: %s addresses in %.2f s' % (
+            counts['ipv4_addresses'] + counts['ipv6_addresses'],
+            time.time() - start
+        ))
+        ip_addresses = sample_addresses(mysql_connection)
+        runs = (('mysql', dbapi, mysql_connection),
+                ('sqlite', sqlite_backend, connection))
+        for name, module, run_connection in runs:
+            single, batched = timed(module, run_connection, ip_addresses)
+            print('%6s: %8.1f us/lookup, %8.1f us/address batched'
+                  % (name, single, batched))
+    finally:
+        connection.close()
+        mysql_connection.close()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Module implements transaction scope for dbapi functions. Connections from
+mysql_connector work in autocommit mode, so each write is committed on its
+own, Transaction groups any number of writes into one commit.
+:classes: Transaction"""
+import time
+
+from logging_conf import create_logger
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+
+class Transaction(object):
+    """Context manager which disables autocommit of connection, commits all
+    writes done inside it on exit and rolls them back if error was raised.
+    Autocommit is turned on again when transaction ends.
+
+    Transaction can also commit in the middle, every flush_every operations
+    or when flush_interval milliseconds passed since last commit, operations
+    should be run through execute method to be counted:
+
+        with Transaction(connection, flush_every=1000) as transaction:
+            for ip_address in ip_addresses:
+                transaction.execute(dbapi.insert_ip_into_db, ip_address)
+
+    """
+
+    def __init__(self, connection, flush_every=None, flush_interval=None):
+        """
+        :param connection: MySQL database connection.
+        :type connection: MySQLdb.connections.Connection.
+        :param flush_every: Number of operations after which transaction
+        is committed, never if not set.
+        :type flush_every: int.
+        :param flush_interval: Time in milliseconds after which transaction
+        is committed, never if not set.
+        :type flush_interval: int.
+
+        """
+        self.connection = connection
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        # number of operations since last commit
+        self.pending = 0
+        # number of commits done by transaction
+        self.commits = 0
+        self._last_flush = time.time()
+
+    def __enter__(self):
+        self.connection.autocommit(0)
+        self.pending = 0
+        self._last_flush = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+            else:
+                self.rollback()
+        finally:
+            self.connection.autocommit(1)
+        # errors are not suppressed
+        return False
+
+    def execute(self, function, *args, **kwargs):
+        """Call dbapi function with transaction connection and commit if
+        flush_every or flush_interval is reached.
+
+        :param function: dbapi function that takes connection as a first
+        parameter.
+        :type function: function.
+        :returns: result of function.
+
+        """
+        result = function(self.connection, *args, **kwargs)
+        self.pending += 1
+        if self._flush_due():
+            self.flush()
+        return result
+
+    def flush(self):
+        """Commit all operations done since last commit"""
+        self.connection.commit()
+        if self.pending:
+            self.commits += 1
+            MODULE_LOGGER.debug(
+                'Committed %s operations in transaction' % self.pending
+            )
+        self.pending = 0
+        self._last_flush = time.time()
+
+    def rollback(self):
+        """Roll back all operations done since last commit"""
+        self.connection.rollback()
+        MODULE_LOGGER.debug(
+            'Rolled back %s operations in transaction' % self.pending
+        )
+        self.pending = 0
+        self._last_flush = time.time()
+
+    def _flush_due(self):
+        """Check if number of operations or time since last commit reached
+        flush limits"""
+        if self.flush_every and self.pending >= self.flush_every:
+            return True
+        if self.flush_interval is not None:
+            elapsed = (time.time() - self._last_flush) * 1000
+            return elapsed >= self.flush_interval
+        return False
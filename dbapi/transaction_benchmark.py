@@ -0,0 +1,54 @@
+"""Benchmark of dbapi writes per second depending on number of operations
+grouped in one commit. Inserts addresses from 10.0.0.0/8 network into
+database from dbapi.cfg and removes them afterwards."""
+import time
+
+from netaddr import IPAddress
+
+import dbapi
+from mysql_connector import get_database_connection
+from transaction import Transaction
+
+FIRST_ADDRESS = IPAddress('10.0.0.0')
+OPERATIONS = 10000
+BATCH_SIZES = (1, 100, 10000)
+
+
+def remove_benchmark_addresses(connection):
+    """Delete addresses inserted by benchmark"""
+    cursor = connection.cursor()
+    cursor.execute(
+        'DELETE FROM ipv4_addresses WHERE address BETWEEN %s AND %s'
+        % (FIRST_ADDRESS.value, FIRST_ADDRESS.value + OPERATIONS)
+    )
+    cursor.close()
+
+
+def run(connection, batch_size):
+    """Insert OPERATIONS addresses committing every batch_size inserts,
+    return number of writes per second"""
+    remove_benchmark_addresses(connection)
+    start = time.time()
+    with Transaction(connection, flush_every=batch_size) as transaction:
+        for offset in xrange(OPERATIONS):
+            transaction.execute(
+                dbapi.insert_ip_into_db,
+                str(FIRST_ADDRESS + offset)
+            )
+    elapsed = time.time() - start
+    remove_benchmark_addresses(connection)
+    return OPERATIONS / elapsed
+
+
+def main():
+    connection = get_database_connection('dbapi.cfg', 'MySQL settings')
+    try:
+        for batch_size in BATCH_SIZES:
+            print('%6s operations per commit: %10.1f writes/s'
+                  % (batch_size, run(connection, batch_size)))
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import unittest
+
+import dbapi
+from mysql_connector import get_database_connection
+from transaction import Transaction
+
+
+class TransactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = get_database_connection('dbapi.cfg',
+                                                  'MySQL settings')
+
+    def tearDown(self):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "DELETE FROM ipv4_addresses WHERE address = INET_ATON('10.1.1.1')"
+        )
+        cursor.close()
+        self.connection.close()
+
+    def test_commit(self):
+        with Transaction(self.connection) as transaction:
+            transaction.execute(dbapi.insert_ip_into_db, '10.1.1.1')
+        self.assertEquals(transaction.commits, 1)
+        self.assertTrue(
+            dbapi.check_if_ip_in_database(self.connection, '10.1.1.1')
+        )
+
+    def test_rollback(self):
+        def insert_and_fail():
+            with Transaction(self.connection) as transaction:
+                transaction.execute(dbapi.insert_ip_into_db, '10.1.1.1')
+                raise ValueError
+        self.assertRaises(ValueError, insert_and_fail)
+        self.assertFalse(
+            dbapi.check_if_ip_in_database(self.connection, '10.1.1.1')
+        )
+
+    def test_flush_every(self):
+        with Transaction(self.connection, flush_every=1) as transaction:
+            transaction.execute(dbapi.insert_ip_into_db, '10.1.1.1')
+            self.assertEquals(transaction.commits, 1)
+            self.assertEquals(transaction.pending, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
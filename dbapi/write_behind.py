@@ -0,0 +1,269 @@
+"""Module implements write-behind queue for single address writes coming from
+many threads. Writes are deduplicated while they wait and flushed by
+background thread as multi-row inserts in one transaction, when max_batch
+writes are queued or the oldest write waited max_delay seconds. Each write
+returns WriteFuture with its result. Queue holds at most max_size writes,
+callers block when it is full.
+:classes: WriteFuture, WriteBehindQueue"""
+import atexit
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import dbapi
+from logging_conf import create_logger
+from transaction import Transaction
+
+MODULE_LOGGER = create_logger('logging.cfg', 'dbapi')
+
+# flush order of write kinds, address must be inserted before it is listed
+KINDS = ('address', 'whitelist', 'blacklist')
+
+# queues which are not closed yet, closed queues are dropped so they and
+# their pools can be collected
+_OPEN_QUEUES = weakref.WeakSet()
+
+
+@atexit.register
+def _close_queues():
+    """Close and flush queues left open at interpreter exit"""
+    for queue in list(_OPEN_QUEUES):
+        queue.close()
+
+
+class WriteFuture(object):
+    """Result of queued write, available after write is flushed"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for flush and return result of write, raise its error
+
+        :param timeout: Seconds to wait, forever if not set.
+        :type timeout: float.
+        :returns: bool -- True if row was added, False if it already
+        existed.
+
+        """
+        if not self._done.wait(timeout):
+            raise Exception("Write is not flushed in %s seconds" % timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for flush and return error of write, None if it succeeded"""
+        if not self._done.wait(timeout):
+            raise Exception("Write is not flushed in %s seconds" % timeout)
+        return self._error
+
+    def add_done_callback(self, callback):
+        """Call callback with future when write is flushed, at once if it
+        already is"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set(self, result=None, error=None):
+        with self._lock:
+            self._result = result
+            self._error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as error:
+                MODULE_LOGGER.error('Write callback failed: %s' % error)
+
+
+class WriteBehindQueue(object):
+    """Buffer of insert_ip_into_db and insert_ip_into_list writes
+
+        queue = WriteBehindQueue(mysql_pool)
+        future = queue.insert_ip_into_db('192.168.1.1')
+        queue.insert_ip_into_list('192.168.1.1', 'blacklist')
+        queue.close()
+
+    Queue is closed and flushed at interpreter exit if close was not called.
+
+    """
+
+    def __init__(self, mysql_pool, max_batch=500, max_delay=0.05,
+                 max_size=10000):
+        """
+        :param mysql_pool: Pool of database connections.
+        :type mysql_pool: sqlalchemy.pool.QueuePool.
+        :param max_batch: Number of writes flushed at once.
+        :type max_batch: int.
+        :param max_delay: Seconds write may wait before flush.
+        :type max_delay: float.
+        :param max_size: Number of queued writes after which callers block.
+        :type max_size: int.
+
+        """
+        self.mysql_pool = mysql_pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_size = max_size
+        # queued writes keyed by kind and address, in order of arrival
+        self._pending = OrderedDict()
+        self._arrived = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        self.stats = {
+            'writes': 0, 'deduplicated': 0, 'batches': 0, 'errors': 0
+        }
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        _OPEN_QUEUES.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _submit(self, kind, ip_address, timeout):
+        # invalid address is reported to caller at once
+        ip_value, ip_version = dbapi.get_ip_data(ip_address)
+        key = (kind, ip_version, ip_value)
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            if key in self._pending:
+                self.stats['deduplicated'] += 1
+                return self._pending[key][1]
+            while len(self._pending) >= self.max_size and not self._closed:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Exception("Write-behind queue is full")
+                self._condition.wait(remaining)
+            if self._closed:
+                raise Exception("Write-behind queue is closed")
+            future = WriteFuture()
+            self._pending[key] = (ip_address, future)
+            self._arrived[key] = time.time()
+            self.stats['writes'] += 1
+            self._condition.notify_all()
+        return future
+
+    def insert_ip_into_db(self, ip_address, timeout=None):
+        """Queue insert of ip address in database
+
+        :param ip_address: Ip address to add.
+        :type ip_address: str.
+        :param timeout: Seconds to wait if queue is full, forever if not
+        set.
+        :type timeout: float.
+        :returns: WriteFuture -- result is False if address was already in
+        database.
+
+        """
+        return self._submit('address', ip_address, timeout)
+
+    def insert_ip_into_list(self, ip_address, list_type, timeout=None):
+        """Queue insert of ip address in 'whitelist' or 'blacklist', result
+        of future is False if address is not in database or is already in
+        a list"""
+        if list_type not in KINDS[1:]:
+            raise ValueError("Unknown list %s" % list_type)
+        return self._submit(list_type, ip_address, timeout)
+
+    def _next_batch(self):
+        """Wait until flush is due and take batch of writes, None when queue
+        is closed and empty"""
+        with self._condition:
+            while True:
+                if not self._pending:
+                    if self._closed:
+                        return None
+                    self._condition.wait()
+                    continue
+                if len(self._pending) >= self.max_batch or self._closed:
+                    break
+                oldest = self._arrived[next(iter(self._pending))]
+                remaining = oldest + self.max_delay - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = []
+            for _ in xrange(min(self.max_batch, len(self._pending))):
+                key, (ip_address, future) = self._pending.popitem(last=False)
+                del self._arrived[key]
+                batch.append((key[0], ip_address, future))
+            # room for blocked callers
+            self._condition.notify_all()
+            return batch
+
+    def _flush(self, batch):
+        writes = dict((kind, []) for kind in KINDS)
+        for kind, ip_address, future in batch:
+            writes[kind].append((ip_address, future))
+        connection = self.mysql_pool.connect()
+        try:
+            with Transaction(connection):
+                results = {}
+                for kind in KINDS:
+                    ip_addresses = [write[0] for write in writes[kind]]
+                    if not ip_addresses:
+                        continue
+                    if kind == 'address':
+                        results[kind] = dbapi.insert_ips_into_db(
+                            connection, ip_addresses
+                        )
+                    else:
+                        results[kind] = dbapi.insert_ips_into_list(
+                            connection, ip_addresses, kind
+                        )
+        finally:
+            connection.close()
+        # futures are resolved only after commit
+        for kind in results:
+            for ip_address, future in writes[kind]:
+                future._set(results[kind][ip_address])
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._flush(batch)
+            except Exception as error:
+                MODULE_LOGGER.error('Write-behind flush failed: %s' % error)
+                self.stats['errors'] += 1
+                for _, _, future in batch:
+                    future._set(error=error)
+            self.stats['batches'] += 1
+
+    def flush(self):
+        """Block until all writes queued before the call are flushed"""
+        with self._condition:
+            futures = [future for _, future in self._pending.values()]
+            self._condition.notify_all()
+        for future in futures:
+            future.exception()
+
+    def close(self):
+        """Stop accepting writes, flush all queued writes and stop flushing
+        thread. Safe to call more than once."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        _OPEN_QUEUES.discard(self)
@@ -0,0 +1,85 @@
+"""Benchmark of concurrent single address inserts made directly through
+dbapi.insert_ip_into_db against the same inserts through WriteBehindQueue.
+Addresses from 13.0.0.0/8 network are inserted in database from dbapi.cfg
+and removed afterwards."""
+import threading
+import time
+
+from netaddr import IPAddress
+
+import dbapi
+from pooling import create_pool
+from write_behind import WriteBehindQueue
+
+FIRST_ADDRESS = IPAddress('13.0.0.0')
+THREADS = 32
+ADDRESSES_PER_THREAD = 1000
+
+
+def thread_addresses(thread_number):
+    first = FIRST_ADDRESS + thread_number * ADDRESSES_PER_THREAD
+    return [str(first + offset) for offset in xrange(ADDRESSES_PER_THREAD)]
+
+
+def remove_benchmark_addresses(mysql_pool):
+    connection = mysql_pool.connect()
+    cursor = connection.cursor()
+    cursor.execute(
+        'DELETE FROM ipv4_addresses WHERE address BETWEEN %s AND %s'
+        % (FIRST_ADDRESS.value,
+           FIRST_ADDRESS.value + THREADS * ADDRESSES_PER_THREAD)
+    )
+    cursor.close()
+    connection.close()
+
+
+def direct(mysql_pool, thread_number):
+    for ip_address in thread_addresses(thread_number):
+        connection = mysql_pool.connect()
+        try:
+            dbapi.insert_ip_into_db(connection, ip_address)
+        finally:
+            connection.close()
+
+
+def write_behind(queue, thread_number):
+    futures = [
+        queue.insert_ip_into_db(ip_address)
+        for ip_address in thread_addresses(thread_number)
+    ]
+    for future in futures:
+        future.result()
+
+
+def timed(target, argument):
+    threads = [
+        threading.Thread(target=target, args=(argument, thread_number))
+        for thread_number in xrange(THREADS)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def main():
+    mysql_pool = create_pool('dbapi.cfg')
+    total = THREADS * ADDRESSES_PER_THREAD
+    try:
+        remove_benchmark_addresses(mysql_pool)
+        elapsed = timed(direct, mysql_pool)
+        print('      direct: %10.1f inserts/s' % (total / elapsed))
+        remove_benchmark_addresses(mysql_pool)
+        queue = WriteBehindQueue(mysql_pool)
+        elapsed = timed(write_behind, queue)
+        queue.close()
+        print('write-behind: %10.1f inserts/s, %s batches'
+              % (total / elapsed, queue.stats['batches']))
+    finally:
+        remove_benchmark_addresses(mysql_pool)
+
+
+if __name__ == '__main__':
+    main()
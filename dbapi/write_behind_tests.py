@@ -0,0 +1,141 @@
+import gc
+import threading
+import unittest
+import weakref
+
+import dbapi
+from dbapi_exceptions import IPAddressError
+from write_behind import _OPEN_QUEUES, WriteBehindQueue, _close_queues
+
+
+class FakeConnection(object):
+
+    def autocommit(self, enabled):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePool(object):
+
+    def connect(self):
+        return FakeConnection()
+
+
+class WriteBehindQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.insert_ips_into_db = dbapi.insert_ips_into_db
+        self.insert_ips_into_list = dbapi.insert_ips_into_list
+        dbapi.insert_ips_into_db = self.fake_insert
+        dbapi.insert_ips_into_list = self.fake_insert_into_list
+        self.queue = WriteBehindQueue(FakePool(), max_batch=100,
+                                      max_delay=0.05, max_size=1000)
+
+    def tearDown(self):
+        self.queue.close()
+        dbapi.insert_ips_into_db = self.insert_ips_into_db
+        dbapi.insert_ips_into_list = self.insert_ips_into_list
+
+    def fake_insert(self, connection, ip_addresses):
+        self.batches.append(('address', ip_addresses))
+        return dict((ip_address, True) for ip_address in ip_addresses)
+
+    def fake_insert_into_list(self, connection, ip_addresses, list_type):
+        self.batches.append((list_type, ip_addresses))
+        return dict(
+            (ip_address, ip_address != '10.0.0.2')
+            for ip_address in ip_addresses
+        )
+
+    def test_batches_and_results(self):
+        futures = [
+            self.queue.insert_ip_into_db('10.0.0.%s' % i) for i in xrange(5)
+        ]
+        listed = self.queue.insert_ip_into_list('10.0.0.2', 'blacklist')
+        self.assertTrue(all(future.result(1) for future in futures))
+        self.assertFalse(listed.result(1))
+        # addresses are inserted before they are listed
+        self.assertEquals(
+            [kind for kind, _ in self.batches], ['address', 'blacklist']
+        )
+
+    def test_deduplication(self):
+        first = self.queue.insert_ip_into_db('10.0.0.1')
+        second = self.queue.insert_ip_into_db('10.0.0.1')
+        self.assertIs(first, second)
+        self.assertEquals(self.queue.stats['deduplicated'], 1)
+
+    def test_many_threads(self):
+        futures = []
+
+        def write(thread_number):
+            for i in xrange(100):
+                futures.append(self.queue.insert_ip_into_db(
+                    '10.%s.0.%s' % (thread_number, i)
+                ))
+
+        threads = [
+            threading.Thread(target=write, args=(i,)) for i in xrange(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.queue.flush()
+        self.assertEquals(len(futures), 1000)
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertTrue(len(self.batches) < 100)
+
+    def test_close_flushes(self):
+        future = self.queue.insert_ip_into_db('10.0.0.1')
+        self.queue.close()
+        self.assertTrue(future.done())
+        self.assertRaises(
+            Exception, self.queue.insert_ip_into_db, '10.0.0.2'
+        )
+
+    def test_closed_queue_is_released(self):
+        self.assertIn(self.queue, _OPEN_QUEUES)
+        self.queue.close()
+        self.assertNotIn(self.queue, _OPEN_QUEUES)
+        queue = weakref.ref(self.queue)
+        self.queue = WriteBehindQueue(FakePool())
+        gc.collect()
+        self.assertIsNone(queue())
+
+    def test_open_queues_are_closed_at_exit(self):
+        future = self.queue.insert_ip_into_db('10.0.0.1')
+        _close_queues()
+        self.assertTrue(future.done())
+        self.assertNotIn(self.queue, _OPEN_QUEUES)
+
+    def test_errors(self):
+        self.assertRaises(
+            IPAddressError, self.queue.insert_ip_into_db, 'SpamHam'
+        )
+        self.assertRaises(
+            ValueError, self.queue.insert_ip_into_list, '10.0.0.1', 'spam'
+        )
+
+        def fail(connection, ip_addresses):
+            raise IOError('spam')
+
+        dbapi.insert_ips_into_db = fail
+        future = self.queue.insert_ip_into_db('10.0.0.1')
+        self.assertRaises(IOError, future.result, 1)
+        callbacks = []
+        future.add_done_callback(callbacks.append)
+        self.assertEquals(callbacks, [future])
+
+
+if __name__ == '__main__':
+    unittest.main()